@@ -0,0 +1,64 @@
+import os
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import pandas as pd
+
+from profiling import phase
+
+DEFAULT_CHUNK_SIZE = 10000
+
+
+def read_address_chunks(path: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[List[str]]:
+    """Addresses from a CSV in lists of at most chunk_size.
+
+    Only the address column is parsed and only one chunk is held in memory,
+    so input files of any length can be processed.
+    """
+    if 'address' not in pd.read_csv(path, nrows=0).columns:
+        raise ValueError("CSV must contain an 'address' column")
+    reader = pd.read_csv(path, usecols=['address'], chunksize=chunk_size)
+    while True:
+        with phase('CSV load'):
+            chunk = next(reader, None)
+        if chunk is None:
+            return
+        yield chunk['address'].tolist()
+
+
+def read_row_keys(path: str, columns: List[str], chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[Tuple]:
+    """The values of the given columns for every row of a CSV, one chunk at a time"""
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return
+    for chunk in pd.read_csv(path, usecols=columns, chunksize=chunk_size, dtype=str):
+        yield from chunk[columns].itertuples(index=False, name=None)
+
+
+class CsvAppender:
+    """Writes result rows to a CSV as they are produced.
+
+    The header comes from the first rows written, or from the existing file
+    when appending to it; later rows are aligned to those columns. Nothing is
+    kept in memory between writes.
+    """
+
+    def __init__(self, path: str, append: bool = False):
+        self.path = path
+        self.columns: Optional[List[str]] = None
+        self.rows_written = 0
+        if append and os.path.exists(path) and os.path.getsize(path) > 0:
+            self.columns = list(pd.read_csv(path, nrows=0).columns)
+        elif os.path.exists(path):
+            os.remove(path)
+
+    def write(self, rows: List[Dict]) -> None:
+        """Append rows to the file"""
+        if not rows:
+            return
+        with phase('DataFrame build'):
+            df = pd.DataFrame(rows)
+            if self.columns is None:
+                self.columns = list(df.columns)
+                df.to_csv(self.path, index=False)
+            else:
+                df.reindex(columns=self.columns).to_csv(self.path, mode='a', header=False, index=False)
+        self.rows_written += len(df)
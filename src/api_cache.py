@@ -0,0 +1,233 @@
+import atexit
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+
+from api_metrics import get_metrics
+
+# Time-to-live per endpoint, in seconds (None means never expire)
+DAY = 24 * 60 * 60
+GEOCODE_TTL = None
+PLACES_TTL = 21 * DAY
+TRANSIT_TTL = 7 * DAY
+TRAFFIC_TTL = 7 * DAY
+DRIVING_TTL = 30 * DAY
+
+# Traffic-aware requests are keyed on (weekday/weekend, time-of-day bucket)
+# rather than the exact departure datetime, so reruns on later days still hit
+TRAFFIC_BUCKET_MINUTES = 15
+
+DEFAULT_CACHE_PATH = '.api_cache.sqlite'
+DEFAULT_MAX_MB = 256
+
+# Cache hits whose access times are held in memory before being written
+ACCESS_FLUSH_EVERY = 500
+
+
+def _normalize(value: Any, bucket_minutes: int = 1) -> Any:
+    """Convert request parameters into a stable, JSON-serializable form"""
+    if isinstance(value, datetime):
+        day_type = 'weekend' if value.weekday() > 4 else 'weekday'
+        minutes = (value.hour * 60 + value.minute) // bucket_minutes * bucket_minutes
+        return f"{day_type}@{minutes // 60:02d}:{minutes % 60:02d}"
+    if isinstance(value, str):
+        return ' '.join(value.split()).lower()
+    if isinstance(value, float):
+        return round(value, 6)
+    if isinstance(value, dict):
+        return {str(k): _normalize(v, bucket_minutes) for k, v in sorted(value.items()) if v is not None}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v, bucket_minutes) for v in value]
+    return value
+
+
+def _ttl_for(endpoint: str, kwargs: Dict) -> Optional[int]:
+    """Pick the time-to-live for a request based on endpoint and travel mode"""
+    if endpoint == 'geocode':
+        return GEOCODE_TTL
+    if endpoint == 'places_nearby':
+        return PLACES_TTL
+    mode = kwargs.get('mode') or 'driving'
+    if mode == 'transit':
+        return TRANSIT_TTL
+    if kwargs.get('departure_time') is not None:
+        return TRAFFIC_TTL
+    return DRIVING_TTL
+
+
+class CachedClient:
+    """SQLite-backed response cache wrapping a googlemaps.Client.
+
+    Responses for geocode, places_nearby, directions and distance_matrix are
+    stored keyed on their normalized request parameters. Other attributes are
+    passed straight through to the wrapped client. Access times used for
+    eviction are written in batches, so a cache hit is a read only.
+    """
+
+    def __init__(self, client, path: str = DEFAULT_CACHE_PATH, max_mb: float = DEFAULT_MAX_MB):
+        self.client = client
+        self.path = path
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                endpoint TEXT NOT NULL,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                expires_at REAL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_accessed ON responses (accessed_at)")
+        self._conn.commit()
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+        # key -> last access time not yet written to the database
+        self._accessed: Dict[str, float] = {}
+        atexit.register(self.flush_access_times)
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def geocode(self, address=None, **kwargs):
+        return self._call('geocode', self.client.geocode, dict(kwargs, address=address))
+
+    def places_nearby(self, **kwargs):
+        return self._call('places_nearby', self.client.places_nearby, kwargs)
+
+    def directions(self, origin, destination, **kwargs):
+        return self._call('directions', self.client.directions,
+                          dict(kwargs, origin=origin, destination=destination))
+
+    def distance_matrix(self, origins, destinations, **kwargs):
+        return self._call('distance_matrix', self.client.distance_matrix,
+                          dict(kwargs, origins=origins, destinations=destinations))
+
+    def make_key(self, endpoint: str, kwargs: Dict) -> str:
+        """Build the cache key for a request"""
+        mode = kwargs.get('mode') or 'driving'
+        bucket = 1 if mode == 'transit' else TRAFFIC_BUCKET_MINUTES
+        return json.dumps([endpoint, _normalize(kwargs, bucket)], sort_keys=True)
+
+    def lookup(self, endpoint: str, kwargs: Dict) -> Any:
+        """Return the cached response for a request, or None on a miss"""
+        cached = self._get(self.make_key(endpoint, kwargs))
+        if cached is not None:
+            self.hits += 1
+            get_metrics().record_cache_hit(endpoint)
+            logging.debug("Cache hit for %s", endpoint)
+        else:
+            self.misses += 1
+        return cached
+
+    def store(self, endpoint: str, kwargs: Dict, response: Any) -> None:
+        """Save a response fetched outside this client (e.g. by the async client)"""
+        self._put(self.make_key(endpoint, kwargs), endpoint, response, _ttl_for(endpoint, kwargs))
+
+    def _call(self, endpoint: str, fn: Callable, kwargs: Dict) -> Any:
+        cached = self.lookup(endpoint, kwargs)
+        if cached is not None:
+            return cached
+
+        response = fn(**kwargs)
+        self.store(endpoint, kwargs, response)
+        return response
+
+    def _get(self, key: str) -> Any:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, expires_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            response, expires_at = row
+            if expires_at is not None and expires_at < now:
+                self._accessed.pop(key, None)
+                self._delete(key)
+                self._conn.commit()
+                return None
+            self._accessed[key] = now
+            if len(self._accessed) >= ACCESS_FLUSH_EVERY:
+                self._write_access_times()
+                self._conn.commit()
+        return json.loads(response)
+
+    def _write_access_times(self) -> None:
+        if self._accessed:
+            self._conn.executemany("UPDATE responses SET accessed_at = ? WHERE key = ?",
+                                   [(accessed_at, key) for key, accessed_at in self._accessed.items()])
+            self._accessed.clear()
+
+    def flush_access_times(self) -> None:
+        """Write access times held in memory to the database"""
+        with self._lock:
+            self._write_access_times()
+            self._conn.commit()
+
+    def _put(self, key: str, endpoint: str, response: Any, ttl: Optional[int]) -> None:
+        try:
+            payload = json.dumps(response)
+        except (TypeError, ValueError) as e:
+            logging.debug("Not caching %s response: %s", endpoint, e)
+            return
+        now = time.time()
+        expires_at = now + ttl if ttl is not None else None
+        with self._lock:
+            self._delete(key)
+            self._conn.execute(
+                "INSERT INTO responses (key, endpoint, response, size, created_at, expires_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, endpoint, payload, len(payload), now, expires_at, now)
+            )
+            self._total_bytes += len(payload)
+            self._evict()
+            self._conn.commit()
+
+    def _delete(self, key: str) -> None:
+        row = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+        if row:
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._total_bytes -= row[0]
+
+    def _evict(self) -> None:
+        """Drop least recently used entries until the cache is back under its size limit"""
+        if self._total_bytes <= self.max_bytes:
+            return
+        # Order by up-to-date access times
+        self._write_access_times()
+        target = self.max_bytes * 0.9
+        rows = self._conn.execute("SELECT key, size FROM responses ORDER BY accessed_at").fetchall()
+        evicted = 0
+        for key, size in rows:
+            if self._total_bytes <= target:
+                break
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._total_bytes -= size
+            evicted += 1
+        logging.debug("Evicted %d cached responses", evicted)
+
+    def clear(self) -> None:
+        """Remove every cached response"""
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._accessed.clear()
+            self._conn.commit()
+            self._total_bytes = 0
+
+
+def cache_settings_from_env() -> Dict:
+    """Read cache location and size limit from environment variables"""
+    return {
+        'path': os.getenv('API_CACHE_PATH', DEFAULT_CACHE_PATH),
+        'max_mb': float(os.getenv('API_CACHE_MAX_MB', DEFAULT_MAX_MB)),
+    }
@@ -0,0 +1,248 @@
+import contextlib
+import contextvars
+import functools
+import inspect
+import json
+import random
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Calls made outside any tracked function are reported under this caller
+UNATTRIBUTED = 'other'
+
+# Latency samples kept per (endpoint, caller); counts stay exact beyond this
+MAX_SAMPLES = 10000
+
+PERCENTILES = (50, 95, 99)
+
+_caller: contextvars.ContextVar = contextvars.ContextVar('api_caller', default=None)
+
+
+class EndpointStats:
+    """Counters and a latency reservoir for one endpoint and calling function"""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.cache_hits = 0
+        self.bytes = 0
+        self.latencies: List[float] = []
+
+    def add_latency(self, seconds: float) -> None:
+        # Reservoir sampling keeps percentiles representative on long runs
+        if len(self.latencies) < MAX_SAMPLES:
+            self.latencies.append(seconds)
+            return
+        slot = random.randrange(self.calls)
+        if slot < MAX_SAMPLES:
+            self.latencies[slot] = seconds
+
+    def merge(self, other: 'EndpointStats') -> None:
+        self.calls += other.calls
+        self.errors += other.errors
+        self.cache_hits += other.cache_hits
+        self.bytes += other.bytes
+        self.latencies.extend(other.latencies)
+
+    def to_dict(self) -> Dict:
+        row = {
+            'calls': self.calls,
+            'errors': self.errors,
+            'cache_hits': self.cache_hits,
+            'bytes': self.bytes,
+        }
+        values = np.percentile(self.latencies, PERCENTILES) * 1000 if self.latencies else [None] * len(PERCENTILES)
+        for p, value in zip(PERCENTILES, values):
+            row[f'p{p}_ms'] = None if value is None else round(float(value), 1)
+        return row
+
+
+class ApiMetrics:
+    """Per-endpoint, per-caller counts and latencies for every Google Maps request.
+
+    Network calls are recorded by InstrumentedClient and AsyncMapsClient,
+    cache hits by CachedClient. The caller is the innermost function
+    decorated with track_caller that is running when the request is made.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stats: Dict[Tuple[str, str], EndpointStats] = {}
+        self.started = time.time()
+
+    def _stats(self, endpoint: str) -> EndpointStats:
+        key = (endpoint, _caller.get() or UNATTRIBUTED)
+        if key not in self.stats:
+            self.stats[key] = EndpointStats()
+        return self.stats[key]
+
+    def record_call(self, endpoint: str, seconds: float, size: int = 0, error: bool = False) -> None:
+        """Record one request sent over the network"""
+        with self._lock:
+            stats = self._stats(endpoint)
+            stats.calls += 1
+            stats.errors += error
+            stats.bytes += size
+            stats.add_latency(seconds)
+
+    def record_cache_hit(self, endpoint: str) -> None:
+        """Record a request answered from the response cache"""
+        with self._lock:
+            self._stats(endpoint).cache_hits += 1
+
+    def rows(self) -> List[Dict]:
+        """One row per (endpoint, caller), followed by a total row per endpoint"""
+        with self._lock:
+            items = sorted(self.stats.items())
+            totals: Dict[str, EndpointStats] = {}
+            rows = []
+            for (endpoint, caller), stats in items:
+                rows.append(dict(endpoint=endpoint, caller=caller, **stats.to_dict()))
+                totals.setdefault(endpoint, EndpointStats()).merge(stats)
+            rows.extend(dict(endpoint=endpoint, caller='total', **stats.to_dict())
+                        for endpoint, stats in sorted(totals.items()))
+        return rows
+
+    def counts(self) -> Dict[str, Dict[str, int]]:
+        """Calls, errors, cache hits and bytes per endpoint, without computing latencies"""
+        with self._lock:
+            totals: Dict[str, Dict[str, int]] = {}
+            for (endpoint, _), stats in self.stats.items():
+                total = totals.setdefault(endpoint, {'calls': 0, 'errors': 0, 'cache_hits': 0, 'bytes': 0})
+                total['calls'] += stats.calls
+                total['errors'] += stats.errors
+                total['cache_hits'] += stats.cache_hits
+                total['bytes'] += stats.bytes
+        return totals
+
+    def to_dict(self) -> Dict:
+        return {
+            'started_at': self.started,
+            'elapsed_seconds': round(time.time() - self.started, 3),
+            'endpoints': self.rows(),
+        }
+
+    def write_json(self, path: str) -> None:
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def summary(self) -> str:
+        """Plain-text table of every row"""
+        header = (f"{'endpoint':<16} {'caller':<28} {'calls':>7} {'errors':>7} {'cached':>7} "
+                  f"{'KB':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+        lines = [header, '-' * len(header)]
+        for row in self.rows():
+            latencies = ''.join(
+                f" {'-' if row[f'p{p}_ms'] is None else row[f'p{p}_ms']:>8}" for p in PERCENTILES
+            )
+            lines.append(f"{row['endpoint']:<16} {row['caller']:<28} {row['calls']:>7} {row['errors']:>7} "
+                         f"{row['cache_hits']:>7} {row['bytes'] / 1024:>9.1f}{latencies}")
+        return '\n'.join(lines)
+
+
+def current_caller() -> Optional[str]:
+    """Name of the tracked function making requests right now, if any"""
+    return _caller.get()
+
+
+@contextlib.contextmanager
+def calls_from(name: str):
+    """Attribute Google Maps requests made inside the block to name"""
+    token = _caller.set(name)
+    try:
+        yield
+    finally:
+        _caller.reset(token)
+
+
+def track_caller(fn):
+    """Attribute Google Maps requests made while fn runs to fn's name"""
+    if inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def async_wrapper(*args, **kwargs):
+            with calls_from(fn.__name__):
+                return await fn(*args, **kwargs)
+        return async_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with calls_from(fn.__name__):
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+def response_size(response) -> int:
+    """Approximate size in bytes of a decoded JSON response"""
+    try:
+        return len(json.dumps(response))
+    except (TypeError, ValueError):
+        return 0
+
+
+class InstrumentedClient:
+    """Wraps a googlemaps.Client, timing every request and recording it in ApiMetrics.
+
+    With a cost ledger, each request is checked against the run's budget
+    before it is sent and priced once it succeeds.
+    """
+
+    def __init__(self, client, metrics: 'ApiMetrics', ledger=None):
+        self.client = client
+        self.metrics = metrics
+        self.ledger = ledger
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def geocode(self, *args, **kwargs):
+        return self._call('geocode', self.client.geocode, args, kwargs)
+
+    def places_nearby(self, *args, **kwargs):
+        return self._call('places_nearby', self.client.places_nearby, args, kwargs)
+
+    def directions(self, *args, **kwargs):
+        return self._call('directions', self.client.directions, args, kwargs)
+
+    def distance_matrix(self, *args, **kwargs):
+        return self._call('distance_matrix', self.client.distance_matrix, args, kwargs)
+
+    def _call(self, endpoint: str, fn, args, kwargs):
+        if self.ledger is not None:
+            self.ledger.check()
+        start = time.perf_counter()
+        try:
+            response = fn(*args, **kwargs)
+        except Exception:
+            self.metrics.record_call(endpoint, time.perf_counter() - start, error=True)
+            raise
+        self.metrics.record_call(endpoint, time.perf_counter() - start, response_size(response))
+        if self.ledger is not None:
+            self.ledger.charge(endpoint, kwargs, args)
+        return response
+
+
+_shared_metrics: Optional[ApiMetrics] = None
+_shared_metrics_lock = threading.Lock()
+
+
+def get_metrics() -> ApiMetrics:
+    """The metrics registry shared by every client in this process"""
+    global _shared_metrics
+    with _shared_metrics_lock:
+        if _shared_metrics is None:
+            _shared_metrics = ApiMetrics()
+        return _shared_metrics
+
+
+def report_metrics(json_path: Optional[str] = None) -> None:
+    """Print the end-of-run API summary and optionally save it as JSON"""
+    metrics = get_metrics()
+    if metrics.stats:
+        print("\nGoogle Maps API usage:")
+        print(metrics.summary())
+    if json_path:
+        metrics.write_json(json_path)
+        print(f"API metrics saved to {json_path}")
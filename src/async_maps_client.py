@@ -0,0 +1,165 @@
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiohttp
+from googlemaps import convert
+from googlemaps.exceptions import ApiError, HTTPError, _OverQueryLimit
+
+from api_metrics import get_metrics
+from cost_ledger import get_cost_ledger
+from rate_limiter import MAX_RETRIES, RateLimiter, backoff_delay, get_rate_limiter, is_throttled
+
+DEFAULT_BASE_URL = 'https://maps.googleapis.com'
+
+# Parameters holding a single location or a list of locations
+LOCATION_PARAMS = {'location', 'origin', 'destination'}
+LOCATION_LIST_PARAMS = {'origins', 'destinations'}
+
+
+def _encode_params(params: Dict) -> Dict[str, str]:
+    """Convert request parameters the same way googlemaps.Client does"""
+    encoded = {}
+    for name, value in params.items():
+        if value is None:
+            continue
+        if name in LOCATION_LIST_PARAMS:
+            encoded[name] = convert.location_list(value)
+        elif name in LOCATION_PARAMS and not isinstance(value, str):
+            encoded[name] = convert.latlng(value)
+        elif isinstance(value, datetime):
+            encoded[name] = convert.time(value)
+        elif isinstance(value, bool):
+            encoded[name] = 'true' if value else 'false'
+        elif isinstance(value, (list, tuple)):
+            encoded[name] = convert.join_list('|', value)
+        else:
+            encoded[name] = str(value)
+    return encoded
+
+
+class AsyncMapsClient:
+    """Asyncio Google Maps client sharing one keep-alive connection pool.
+
+    Exposes the geocode, places_nearby, directions and distance_matrix calls
+    used by the analysis scripts, returning the same shapes as
+    googlemaps.Client. Responses go through the on-disk cache when one is
+    given, and requests share the process-wide rate limiter. base_url can
+    point at a local server for testing.
+    """
+
+    def __init__(self, key: str, base_url: str = DEFAULT_BASE_URL, pool_size: int = 100,
+                 timeout: float = 30, cache=None, limiter: Optional[RateLimiter] = None):
+        self.key = key
+        self.base_url = base_url.rstrip('/')
+        self.pool_size = pool_size
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.cache = cache
+        self.limiter = limiter or get_rate_limiter()
+        self.session: Optional[aiohttp.ClientSession] = None
+
+    async def __aenter__(self) -> 'AsyncMapsClient':
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.pool_size),
+            timeout=self.timeout
+        )
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def geocode(self, address=None, **kwargs) -> List[Dict]:
+        body = await self._request('geocode', '/maps/api/geocode/json', dict(kwargs, address=address))
+        return body.get('results', [])
+
+    async def places_nearby(self, **kwargs) -> Dict:
+        return await self._request('places_nearby', '/maps/api/place/nearbysearch/json', kwargs)
+
+    async def directions(self, origin, destination, **kwargs) -> List[Dict]:
+        body = await self._request('directions', '/maps/api/directions/json',
+                                   dict(kwargs, origin=origin, destination=destination))
+        return body.get('routes', [])
+
+    async def distance_matrix(self, origins, destinations, **kwargs) -> Dict:
+        return await self._request('distance_matrix', '/maps/api/distancematrix/json',
+                                   dict(kwargs, origins=origins, destinations=destinations))
+
+    async def _request(self, endpoint: str, path: str, params: Dict) -> Any:
+        # The cache stores what googlemaps.Client returns, so entries are
+        # shared with the synchronous scripts
+        if self.cache is not None:
+            cached = self.cache.lookup(endpoint, params)
+            if cached is not None:
+                return _as_body(endpoint, cached)
+
+        if self.session is None:
+            raise RuntimeError("AsyncMapsClient must be used as an async context manager")
+
+        ledger = get_cost_ledger()
+        for attempt in range(MAX_RETRIES + 1):
+            ledger.check()
+            # The limiter blocks, so wait for it off the event loop
+            await asyncio.to_thread(self.limiter.acquire, endpoint)
+            throttled = False
+            start = time.perf_counter()
+            try:
+                body, size = await self._fetch(path, params)
+                get_metrics().record_call(endpoint, time.perf_counter() - start, size)
+                ledger.charge(endpoint, params)
+                break
+            except Exception as e:
+                get_metrics().record_call(endpoint, time.perf_counter() - start, error=True)
+                throttled = is_throttled(e)
+                if not throttled or attempt == MAX_RETRIES:
+                    raise
+            finally:
+                self.limiter.release(throttled)
+            await asyncio.sleep(backoff_delay(attempt))
+        logging.debug("Async %s request returned %s", endpoint, body.get('status'))
+
+        if self.cache is not None:
+            self.cache.store(endpoint, params, _as_result(endpoint, body))
+        return body
+
+    async def _fetch(self, path: str, params: Dict) -> Tuple[Dict, int]:
+        """Decoded response body and its size in bytes"""
+        query = _encode_params(params)
+        query['key'] = self.key
+        async with self.session.get(self.base_url + path, params=query) as response:
+            if response.status != 200:
+                raise HTTPError(response.status)
+            content = await response.read()
+        body = json.loads(content)
+
+        status = body.get('status')
+        if status == 'OVER_QUERY_LIMIT':
+            raise _OverQueryLimit(status, body.get('error_message'))
+        if status not in ('OK', 'ZERO_RESULTS'):
+            raise ApiError(status, body.get('error_message'))
+        return body, len(content)
+
+
+def _as_result(endpoint: str, body: Dict) -> Any:
+    """Convert a raw response body to what googlemaps.Client returns for the endpoint"""
+    if endpoint == 'geocode':
+        return body.get('results', [])
+    if endpoint == 'directions':
+        return body.get('routes', [])
+    return body
+
+
+def _as_body(endpoint: str, result: Any) -> Dict:
+    """Inverse of _as_result, for responses read back from the cache"""
+    if endpoint == 'geocode':
+        return {'status': 'OK', 'results': result}
+    if endpoint == 'directions':
+        return {'status': 'OK', 'routes': result}
+    return result
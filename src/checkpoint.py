@@ -0,0 +1,106 @@
+import json
+import logging
+import os
+import sqlite3
+from typing import Dict, Iterable, Iterator, Optional, Set, Tuple
+
+MORNING = 'Morning'
+EVENING = 'Evening'
+
+# Keys looked up per query, within SQLite's default limit on bound parameters
+LOOKUP_BATCH = 400
+
+
+class CompletedKeys:
+    """Set of finished (address, direction) keys kept in a temporary on-disk table.
+
+    Used by streaming runs so memory stays flat however many addresses are
+    recorded; SQLite spills the table to a temporary file as it grows.
+    """
+
+    def __init__(self, keys: Iterable[Tuple[str, str]] = ()):
+        # An empty path gives a private temporary database, deleted on close
+        self._conn = sqlite3.connect('')
+        self._conn.execute("CREATE TABLE completed (address TEXT, direction TEXT, PRIMARY KEY (address, direction))")
+        self.add_many(keys)
+
+    def add_many(self, keys: Iterable[Tuple[str, str]]) -> None:
+        self._conn.executemany("INSERT OR IGNORE INTO completed VALUES (?, ?)", keys)
+        self._conn.commit()
+
+    def present(self, keys: Iterable[Tuple[str, str]]) -> Set[Tuple[str, str]]:
+        """The given keys that have been recorded"""
+        keys = list(dict.fromkeys(keys))
+        found = set()
+        for start in range(0, len(keys), LOOKUP_BATCH):
+            batch = keys[start:start + LOOKUP_BATCH]
+            found.update(self._conn.execute(
+                "SELECT address, direction FROM completed WHERE (address, direction) IN "
+                f"(VALUES {', '.join(['(?, ?)'] * len(batch))})",
+                [value for key in batch for value in key]
+            ).fetchall())
+        return found
+
+    def __contains__(self, key: Tuple[str, str]) -> bool:
+        return bool(self.present([key]))
+
+    def __len__(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM completed").fetchone()[0]
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+class CheckpointStore:
+    """Append-only JSONL record of finished (address, direction) results.
+
+    Results are written and synced to disk a batch at a time, so a run that
+    dies part way leaves every finished batch on disk. Results with no valid
+    route are recorded too (as null) so they are not retried.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _entries(self) -> Iterator[Dict]:
+        """Recorded entries in the order they were written, read one line at a time"""
+        if not os.path.exists(self.path):
+            return
+        line = '\n'
+        with open(self.path) as f:
+            for number, line in enumerate(f, 1):
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # A crash mid-write leaves at most one truncated last line
+                    logging.warning(f"Skipping unreadable line {number} of {self.path}")
+        if not line.endswith('\n'):
+            # Terminate the truncated line so new records start on their own line
+            with open(self.path, 'a') as f:
+                f.write('\n')
+
+    def load(self) -> Dict[Tuple[str, str], Optional[Dict]]:
+        """Every result recorded so far, keyed on (address, direction)"""
+        return {(entry['address'], entry['direction']): entry['result'] for entry in self._entries()}
+
+    def completed(self) -> CompletedKeys:
+        """The (address, direction) pairs recorded so far, without their results, held on disk"""
+        return CompletedKeys((entry['address'], entry['direction']) for entry in self._entries())
+
+    def record_many(self, results: Iterable[Tuple[str, str, Optional[Dict]]]) -> None:
+        """Append (address, direction, result) tuples with a single sync to disk"""
+        lines = [
+            json.dumps({'address': address, 'direction': direction, 'result': result}) + '\n'
+            for address, direction, result in results
+        ]
+        if not lines:
+            return
+        with open(self.path, 'a') as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def clear(self) -> None:
+        """Forget every recorded result"""
+        if os.path.exists(self.path):
+            os.remove(self.path)
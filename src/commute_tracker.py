@@ -2,23 +2,45 @@ import os
 from datetime import datetime, timedelta
 import pandas as pd
 from dotenv import load_dotenv
-import googlemaps
+from maps_client import create_client
 import argparse
 import pytz
+from rate_limiter import QuotaExhausted
+from distance_matrix import batch_distance_matrix, element_minutes, element_miles
+from traffic_cache import ROUTE_RANGE, get_traffic_cache
+from address_stream import CsvAppender, read_address_chunks
+from api_metrics import report_metrics, track_caller
+from cost_ledger import get_cost_ledger, report_costs
+from profiling import PROFILE_MODES, finish_profiling, phase, start_profiling
 
 # Load environment variables
 load_dotenv()
 
 # Initialize Google Maps client
-gmaps = googlemaps.Client(key=os.getenv('GOOGLE_MAPS_API_KEY'))
+gmaps = create_client(os.getenv('GOOGLE_MAPS_API_KEY'))
 WORK_ADDRESS = os.getenv('WORK_ADDRESS')
 
+# One row per address; every metric is a number so results can be sorted,
+# filtered and aggregated directly. Strings are only made by format_results.
+RESULT_SCHEMA = {
+    'address': 'string',
+    'distance_miles': 'float64',
+    'morning_min': 'float64',
+    'morning_avg': 'float64',
+    'morning_max': 'float64',
+    'evening_min': 'float64',
+    'evening_avg': 'float64',
+    'evening_max': 'float64',
+    'total_daily_min': 'float64',
+}
+
 def get_next_weekday(d):
     """Get the next weekday (Monday-Friday) from a given date"""
     while d.weekday() > 4:  # 5 is Saturday, 6 is Sunday
         d += timedelta(days=1)
     return d
 
+@track_caller
 def get_commute_time(origin, destination, target_time=None, is_arrival=False):
     """
     Get the commute time between two addresses with time ranges
@@ -36,6 +58,13 @@ def get_commute_time(origin, destination, target_time=None, is_arrival=False):
         else:
             departure_time = target_time
 
+        # Drive times for this pair and departure slot may already be known
+        traffic = get_traffic_cache()
+        if traffic is not None:
+            cached = traffic.get(origin, destination, departure_time, ROUTE_RANGE)
+            if cached is not None:
+                return cached
+
         params = {
             'origins': [origin],
             'destinations': [destination],
@@ -70,14 +99,52 @@ def get_commute_time(origin, destination, target_time=None, is_arrival=False):
         # Get distance from the first route
         distance_miles = result[0]['legs'][0]['distance']['value'] / 1609.34
 
+        if traffic is not None:
+            traffic.put(origin, destination, departure_time,
+                        (optimistic_mins, average_mins, pessimistic_mins, distance_miles), ROUTE_RANGE)
         return optimistic_mins, average_mins, pessimistic_mins, distance_miles
+    except QuotaExhausted:
+        raise
     except Exception as e:
         print(f"Error getting commute time for {origin} to {destination}: {e}")
         return None, None, None, None
 
-def analyze_commutes(addresses_df):
-    """Analyze commutes for all addresses"""
-    # Use Eastern Time
+@track_caller
+def get_commute_times_matrix(origins, destinations, departure_time):
+    """
+    Get commute times for many (origin, destination) pairs using batched Distance Matrix calls.
+    Returns a dict mapping each pair to (optimistic, average, pessimistic, distance); the
+    matrix only reports the best route, so all three times are the same.
+    """
+    results = {}
+    pairs = list(zip(origins, destinations))
+    traffic = get_traffic_cache()
+    if traffic is not None:
+        found, pairs = traffic.split(pairs, departure_time)
+        for pair, (minutes, miles) in found.items():
+            results[pair] = (minutes, minutes, minutes, miles)
+
+    elements = batch_distance_matrix(
+        gmaps,
+        pairs,
+        mode="driving",
+        departure_time=departure_time
+    )
+    observed = {}
+    for pair, element in elements.items():
+        if element is None:
+            print(f"Error getting commute time for {pair[0]} to {pair[1]}: No route found")
+            results[pair] = (None, None, None, None)
+            continue
+        minutes = element_minutes(element)
+        results[pair] = (minutes, minutes, minutes, element_miles(element))
+        observed[pair] = (minutes, element_miles(element))
+    if traffic is not None:
+        traffic.put_many(observed, departure_time)
+    return results
+
+def commute_departures():
+    """Morning and evening departure times on the next weekday, in Eastern Time"""
     eastern = pytz.timezone('America/New_York')
     next_weekday = get_next_weekday(datetime.now(eastern).date() + timedelta(days=1))
     
@@ -88,72 +155,191 @@ def analyze_commutes(addresses_df):
     evening_departure = eastern.localize(
         datetime.combine(next_weekday, datetime.strptime("17:00", "%H:%M").time())
     )
+    return morning_departure, evening_departure
 
-    results = []
-    
-    for idx, row in addresses_df.iterrows():
-        home_address = row['address']
-        print(f"Analyzing commute for: {home_address}")
+def iter_commutes(addresses, use_matrix=False):
+    """
+    Yield a result row for every address with a complete commute, in input order.
+    QuotaExhausted propagates, after the rows for addresses already finished.
+    """
+    morning_departure, evening_departure = commute_departures()
+
+    if use_matrix:
+        print(f"Analyzing commutes for {len(addresses)} addresses")
+        with phase('drive routing'):
+            morning_times = get_commute_times_matrix(
+                addresses, [WORK_ADDRESS] * len(addresses), morning_departure)
+            # Match get_commute_time, which leaves 45 minutes before an arrival target
+            evening_times = get_commute_times_matrix(
+                [WORK_ADDRESS] * len(addresses), addresses, evening_departure - timedelta(minutes=45))
 
-        # Morning commute (to work)
-        morning_opt, morning_avg, morning_pess, morning_dist = get_commute_time(
-            home_address, WORK_ADDRESS, morning_departure, False)
+    for home_address in addresses:
+        if use_matrix:
+            morning_opt, morning_avg, morning_pess, morning_dist = morning_times[(home_address, WORK_ADDRESS)]
+            evening_opt, evening_avg, evening_pess, evening_dist = evening_times[(WORK_ADDRESS, home_address)]
+        else:
+            print(f"Analyzing commute for: {home_address}")
 
-        # Evening commute (to home)
-        evening_opt, evening_avg, evening_pess, evening_dist = get_commute_time(
-            WORK_ADDRESS, home_address, evening_departure, True)
+            with phase('drive routing'):
+                # Morning commute (to work)
+                morning_opt, morning_avg, morning_pess, morning_dist = get_commute_time(
+                    home_address, WORK_ADDRESS, morning_departure, False)
+
+                # Evening commute (to home)
+                evening_opt, evening_avg, evening_pess, evening_dist = get_commute_time(
+                    WORK_ADDRESS, home_address, evening_departure, True)
 
         if all(v is not None for v in [morning_opt, morning_avg, morning_pess, evening_opt, evening_avg, evening_pess]):
-            results.append({
-                'Address': home_address,
-                'Distance (miles)': f"{morning_dist:.1f}",
-                'Morning Avg (min)': f"{morning_avg:.0f}",
-                'Morning Range': f"{morning_opt:.0f}-{morning_pess:.0f}",
-                'Evening Avg (min)': f"{evening_avg:.0f}",
-                'Evening Range': f"{evening_opt:.0f}-{evening_pess:.0f}",
-                'Total Daily (min)': f"{(morning_avg + evening_avg):.0f}",
-                '_sort': morning_avg + evening_avg  # Hidden column for sorting
-            })
-
-    return pd.DataFrame(results)
+            yield {
+                'address': home_address,
+                'distance_miles': morning_dist,
+                'morning_min': morning_opt,
+                'morning_avg': morning_avg,
+                'morning_max': morning_pess,
+                'evening_min': evening_opt,
+                'evening_avg': evening_avg,
+                'evening_max': evening_pess,
+                'total_daily_min': morning_avg + evening_avg
+            }
+
+def results_frame(rows):
+    """Build a DataFrame with the typed result schema, even when there are no rows"""
+    return pd.DataFrame(list(rows), columns=list(RESULT_SCHEMA)).astype(RESULT_SCHEMA)
+
+def format_results(results_df):
+    """Presentation copy of typed results: rounded values and min-max ranges as text"""
+    def minutes(column):
+        return results_df[column].map('{:.0f}'.format).astype(str)
+
+    return pd.DataFrame({
+        'Address': results_df['address'],
+        'Distance (miles)': results_df['distance_miles'].map('{:.1f}'.format),
+        'Morning Avg (min)': minutes('morning_avg'),
+        'Morning Range': minutes('morning_min') + '-' + minutes('morning_max'),
+        'Evening Avg (min)': minutes('evening_avg'),
+        'Evening Range': minutes('evening_min') + '-' + minutes('evening_max'),
+        'Total Daily (min)': minutes('total_daily_min'),
+    }, index=results_df.index)
+
+def analyze_commutes(addresses_df, use_matrix=False):
+    """
+    Analyze commutes for all addresses
+    use_matrix: if True, fetch all travel times through batched Distance Matrix calls
+    instead of a directions request (with alternative routes) per address
+    """
+    results = []
+    try:
+        for row in iter_commutes(addresses_df['address'].tolist(), use_matrix):
+            results.append(row)
+    except QuotaExhausted as e:
+        # Keep the addresses finished so far
+        print(f"Stopping early: {e}")
+
+    return results_frame(results)
+
+def stream_commutes(addresses_path, output_path, chunk_size, use_matrix=False, formatted=False):
+    """
+    Analyze an address CSV chunk by chunk, appending each chunk's rows to the output
+    in input order. Only one chunk is held in memory. Returns the number of rows written.
+    formatted: if True, write the presentation columns instead of the typed schema
+    """
+    output = CsvAppender(output_path)
+    rows = []
+    try:
+        for chunk in read_address_chunks(addresses_path, chunk_size):
+            rows.extend(iter_commutes(chunk, use_matrix))
+            write_rows(output, rows, formatted)
+            rows = []
+            print(f"{output.rows_written} rows written to {output_path}")
+    except QuotaExhausted as e:
+        # Keep the addresses finished so far
+        print(f"Stopping early: {e}")
+        write_rows(output, rows, formatted)
+    return output.rows_written
+
+def write_rows(output, rows, formatted):
+    """Append typed result rows to a CsvAppender, formatting them first if asked"""
+    if not rows:
+        return
+    with phase('DataFrame build'):
+        results_df = results_frame(rows)
+        if formatted:
+            results_df = format_results(results_df)
+    output.write(results_df.to_dict('records'))
 
 def main():
     parser = argparse.ArgumentParser(description='Analyze commute times for multiple addresses')
     parser.add_argument('--addresses', default='addresses.csv', help='Path to CSV file with addresses')
     parser.add_argument('--output', default='commute_analysis.csv', help='Output CSV file name')
+    parser.add_argument('--matrix', action='store_true',
+                        help='Fetch travel times with batched Distance Matrix calls (much faster for many addresses)')
+    parser.add_argument('--ranges', action='store_true',
+                        help='Report min-max ranges over alternative routes (uses per-address directions, even with --matrix)')
+    parser.add_argument('--chunk-size', type=int,
+                        help='Stream the addresses this many at a time, appending results in input order instead of sorting')
+    parser.add_argument('--formatted', action='store_true',
+                        help='Write rounded values and min-max ranges as text instead of numeric columns')
+    parser.add_argument('--metrics-json', help='Save per-endpoint API call metrics to this JSON file')
+    parser.add_argument('--max-cost', type=float,
+                        help='Stop sending API requests once their estimated cost reaches this many dollars')
+    parser.add_argument('--max-calls', type=int, help='Stop sending API requests after this many')
+    parser.add_argument('--profile', nargs='?', const='spans', choices=PROFILE_MODES,
+                        help='Time each phase and write <output>.profile.txt and a folded flamegraph file; '
+                             '"sample" adds stack sampling, "cprofile" adds cProfile')
     args = parser.parse_args()
+    start_profiling(args.profile)
+    get_cost_ledger().set_budget(args.max_cost, args.max_calls)
 
-    if not WORK_ADDRESS:
-        print("Error: WORK_ADDRESS not found in .env file")
-        return
-
-    # Read addresses from CSV
+    rows = 0
     try:
-        addresses_df = pd.read_csv(args.addresses)
-        if 'address' not in addresses_df.columns:
-            raise ValueError("CSV must contain an 'address' column")
-    except Exception as e:
-        print(f"Error reading addresses CSV: {e}")
-        return
+        if not WORK_ADDRESS:
+            print("Error: WORK_ADDRESS not found in .env file")
+            return
 
-    # Analyze commutes
-    results_df = analyze_commutes(addresses_df)
+        if args.chunk_size:
+            try:
+                rows = stream_commutes(args.addresses, args.output, args.chunk_size,
+                                       use_matrix=args.matrix and not args.ranges, formatted=args.formatted)
+            except ValueError as e:
+                print(f"Error reading addresses CSV: {e}")
+                return
+            print(f"\nResults saved to {args.output}")
+            return
 
-    # Sort by total daily commute time
-    results_df = results_df.sort_values('_sort')
-    results_df = results_df.drop('_sort', axis=1)  # Remove sorting column
+        # Read addresses from CSV
+        try:
+            with phase('CSV load'):
+                addresses_df = pd.read_csv(args.addresses)
+            if 'address' not in addresses_df.columns:
+                raise ValueError("CSV must contain an 'address' column")
+        except Exception as e:
+            print(f"Error reading addresses CSV: {e}")
+            return
 
-    # Save to CSV
-    results_df.to_csv(args.output, index=False)
-    
-    # Print formatted results
-    print("\nCommute Analysis Results:")
-    print("-" * 120)
-    pd.set_option('display.max_rows', None)
-    pd.set_option('display.max_columns', None)
-    pd.set_option('display.width', None)
-    print(results_df.to_string())
-    print(f"\nResults saved to {args.output}")
+        # Analyze commutes
+        results_df = analyze_commutes(addresses_df, use_matrix=args.matrix and not args.ranges)
+        rows = len(results_df)
+
+        with phase('DataFrame build'):
+            # Sort by total daily commute time
+            results_df = results_df.sort_values('total_daily_min', ignore_index=True)
+            formatted_df = format_results(results_df)
+
+            # Save to CSV
+            (formatted_df if args.formatted else results_df).to_csv(args.output, index=False)
+
+        # Print formatted results
+        print("\nCommute Analysis Results:")
+        print("-" * 120)
+        pd.set_option('display.max_rows', None)
+        pd.set_option('display.max_columns', None)
+        pd.set_option('display.width', None)
+        print(formatted_df.to_string())
+        print(f"\nResults saved to {args.output}")
+    finally:
+        report_metrics(args.metrics_json)
+        report_costs(rows)
+        finish_profiling(os.path.splitext(args.output)[0])
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,174 @@
+import logging
+import threading
+from typing import Dict, Optional, Tuple
+
+from api_metrics import UNATTRIBUTED, current_caller
+from rate_limiter import QuotaExhausted
+
+# Google Maps Platform list prices in USD per 1,000 billable units. A unit
+# is a request, except for Distance Matrix where it is an element.
+SKU_PRICES = {
+    'geocoding': 5.00,
+    'places_nearby_search': 32.00,
+    'directions': 5.00,
+    'directions_advanced': 10.00,
+    'distance_matrix': 5.00,
+    'distance_matrix_advanced': 10.00,
+}
+
+# Share of the budget after which callers cut back on optional requests
+DEGRADE_AT = 0.8
+
+# Parameter names of positional arguments, so calls can be priced from args
+POSITIONAL_PARAMS = {
+    'geocode': ('address',),
+    'places_nearby': ('location', 'radius', 'keyword'),
+    'directions': ('origin', 'destination', 'mode'),
+    'distance_matrix': ('origins', 'destinations', 'mode'),
+}
+
+
+class BudgetExhausted(QuotaExhausted):
+    """Raised before a request that would go over the run's cost or call budget"""
+
+
+def request_params(endpoint: str, args: Tuple, kwargs: Dict) -> Dict:
+    """Name the positional arguments of a googlemaps.Client call"""
+    return dict(zip(POSITIONAL_PARAMS.get(endpoint, ()), args), **kwargs)
+
+
+def _count(locations) -> int:
+    if locations is None:
+        return 1
+    if isinstance(locations, (str, dict)) or (isinstance(locations, tuple) and len(locations) == 2
+                                               and all(isinstance(v, (int, float)) for v in locations)):
+        return 1
+    return len(locations)
+
+
+def sku_for(endpoint: str, params: Dict) -> Tuple[str, int]:
+    """The SKU a request is billed under and how many units it uses"""
+    if endpoint == 'geocode':
+        return 'geocoding', 1
+    if endpoint == 'places_nearby':
+        return 'places_nearby_search', 1
+
+    # Traffic-aware driving and many waypoints are billed at the advanced rate
+    mode = params.get('mode') or 'driving'
+    advanced = (mode == 'driving' and params.get('departure_time') is not None) or params.get('traffic_model')
+    if endpoint == 'directions':
+        advanced = advanced or _count(params.get('waypoints') or []) > 10
+        return ('directions_advanced' if advanced else 'directions'), 1
+    elements = _count(params.get('origins')) * _count(params.get('destinations'))
+    return ('distance_matrix_advanced' if advanced else 'distance_matrix'), elements
+
+
+class CostLedger:
+    """Prices every Google Maps request sent and enforces the run's budget.
+
+    Costs are kept per SKU and per calling function. With a budget set,
+    degraded turns true once DEGRADE_AT of it is used so callers can skip
+    optional requests, and check() raises BudgetExhausted once it is gone.
+    """
+
+    def __init__(self, max_cost: Optional[float] = None, max_calls: Optional[int] = None):
+        self._lock = threading.Lock()
+        self.max_cost = max_cost
+        self.max_calls = max_calls
+        self.total_cost = 0.0
+        self.total_calls = 0
+        # (sku, caller) -> [requests, units, cost]
+        self.entries: Dict[Tuple[str, str], list] = {}
+        self._warned = False
+
+    def set_budget(self, max_cost: Optional[float] = None, max_calls: Optional[int] = None) -> None:
+        with self._lock:
+            self.max_cost = max_cost
+            self.max_calls = max_calls
+
+    def used(self) -> float:
+        """Fraction of the budget spent, by whichever limit is closest; 0 with no budget"""
+        fractions = [0.0]
+        if self.max_cost:
+            fractions.append(self.total_cost / self.max_cost)
+        if self.max_calls:
+            fractions.append(self.total_calls / self.max_calls)
+        return max(fractions)
+
+    @property
+    def degraded(self) -> bool:
+        return self.used() >= DEGRADE_AT
+
+    def check(self) -> None:
+        """Raise BudgetExhausted if no more requests may be sent"""
+        if self.used() >= 1:
+            raise BudgetExhausted(
+                f"Run budget used up: {self.total_calls} requests, ${self.total_cost:.2f}"
+            )
+
+    def charge(self, endpoint: str, params: Dict, args: Tuple = ()) -> float:
+        """Record a request that was sent and return its cost; args are any positional arguments"""
+        sku, units = sku_for(endpoint, request_params(endpoint, args, params))
+        cost = units * SKU_PRICES[sku] / 1000
+        with self._lock:
+            entry = self.entries.setdefault((sku, current_caller() or UNATTRIBUTED), [0, 0, 0.0])
+            entry[0] += 1
+            entry[1] += units
+            entry[2] += cost
+            self.total_calls += 1
+            self.total_cost += cost
+            warn = self.degraded and not self._warned
+            self._warned = self._warned or warn
+        if warn:
+            logging.warning(f"{self.used():.0%} of the run budget used; cutting back on optional requests")
+        return cost
+
+    def to_dict(self, addresses: Optional[int] = None) -> Dict:
+        with self._lock:
+            rows = [
+                {'sku': sku, 'caller': caller, 'requests': requests, 'units': units, 'cost': round(cost, 4)}
+                for (sku, caller), (requests, units, cost) in sorted(self.entries.items())
+            ]
+            total_cost, total_calls = self.total_cost, self.total_calls
+        return {
+            'total_cost': round(total_cost, 4),
+            'total_requests': total_calls,
+            'cost_per_address': round(total_cost / addresses, 4) if addresses else None,
+            'max_cost': self.max_cost,
+            'max_calls': self.max_calls,
+            'entries': rows,
+        }
+
+    def summary(self, addresses: Optional[int] = None) -> str:
+        """Plain-text table of cost per SKU and calling function"""
+        report = self.to_dict(addresses)
+        header = f"{'sku':<26} {'caller':<28} {'requests':>9} {'units':>9} {'cost $':>10}"
+        lines = [header, '-' * len(header)]
+        for row in report['entries']:
+            lines.append(f"{row['sku']:<26} {row['caller']:<28} {row['requests']:>9} "
+                         f"{row['units']:>9} {row['cost']:>10.2f}")
+        lines.append(f"{'total':<26} {'':<28} {report['total_requests']:>9} {'':>9} {report['total_cost']:>10.2f}")
+        if report['cost_per_address'] is not None:
+            lines.append(f"Cost per address: ${report['cost_per_address']:.4f} over {addresses} addresses")
+        return '\n'.join(lines)
+
+
+_shared_ledger: Optional[CostLedger] = None
+_shared_ledger_lock = threading.Lock()
+
+
+def get_cost_ledger() -> CostLedger:
+    """The cost ledger shared by every client in this process"""
+    global _shared_ledger
+    with _shared_ledger_lock:
+        if _shared_ledger is None:
+            _shared_ledger = CostLedger()
+        return _shared_ledger
+
+
+def report_costs(addresses: Optional[int] = None) -> None:
+    """Print the end-of-run cost summary if any billable request was sent"""
+    ledger = get_cost_ledger()
+    if ledger.total_calls:
+        print("\nEstimated Google Maps cost:")
+        print(ledger.summary(addresses))
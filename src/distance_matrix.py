@@ -0,0 +1,118 @@
+import asyncio
+import logging
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from rate_limiter import QuotaExhausted
+
+# Distance Matrix request limits
+MAX_ORIGINS = 25
+MAX_DESTINATIONS = 25
+MAX_ELEMENTS = 100
+
+
+def plan_requests(pairs: Iterable[Tuple[str, str]]) -> List[Tuple[List[str], List[str]]]:
+    """Group (origin, destination) pairs into Distance Matrix requests.
+
+    Every element of a matrix is billed, so only origins that need exactly
+    the same destinations share a request; each request then bills just the
+    pairs asked for. Origins are packed within the origin and element limits,
+    and a destination set too large for one request is split across several.
+    """
+    by_origin: Dict[str, List[str]] = {}
+    for origin, destination in pairs:
+        destinations = by_origin.setdefault(origin, [])
+        if destination not in destinations:
+            destinations.append(destination)
+
+    by_destinations: Dict[frozenset, Tuple[List[str], List[str]]] = {}
+    for origin, destinations in by_origin.items():
+        by_destinations.setdefault(frozenset(destinations), ([], destinations))[0].append(origin)
+
+    max_destinations = min(MAX_DESTINATIONS, MAX_ELEMENTS)
+    blocks = []
+    for origins, destinations in by_destinations.values():
+        for i in range(0, len(destinations), max_destinations):
+            chunk = destinations[i:i + max_destinations]
+            per_request = min(MAX_ORIGINS, MAX_ELEMENTS // len(chunk))
+            for j in range(0, len(origins), per_request):
+                blocks.append((origins[j:j + per_request], chunk))
+    return blocks
+
+
+def batch_distance_matrix(client, pairs: Iterable[Tuple[str, str]], map_fn: Callable = map,
+                          **kwargs) -> Dict[Tuple[str, str], Optional[Dict]]:
+    """Look up many (origin, destination) pairs with as few Distance Matrix calls as possible.
+
+    Returns the matrix element for every requested pair, or None when the
+    element (or its whole request) failed. map_fn can be swapped for a
+    thread pool's map to send the requests concurrently.
+    """
+    pairs = list(pairs)
+    results: Dict[Tuple[str, str], Optional[Dict]] = {pair: None for pair in pairs}
+
+    def fetch(block):
+        origins, destinations = block
+        try:
+            return client.distance_matrix(origins, destinations, **kwargs)
+        except QuotaExhausted:
+            raise
+        except Exception as e:
+            logging.error(f"Error getting distance matrix for {len(origins)}x{len(destinations)} block: {e}")
+            return None
+
+    blocks = plan_requests(pairs)
+    for block, response in zip(blocks, map_fn(fetch, blocks)):
+        _collect_elements(results, block, response)
+
+    return results
+
+
+async def batch_distance_matrix_async(client, pairs: Iterable[Tuple[str, str]],
+                                      **kwargs) -> Dict[Tuple[str, str], Optional[Dict]]:
+    """Async version of batch_distance_matrix that sends every request at once"""
+    pairs = list(pairs)
+    results: Dict[Tuple[str, str], Optional[Dict]] = {pair: None for pair in pairs}
+
+    async def fetch(block):
+        origins, destinations = block
+        try:
+            return await client.distance_matrix(origins, destinations, **kwargs)
+        except QuotaExhausted:
+            raise
+        except Exception as e:
+            logging.error(f"Error getting distance matrix for {len(origins)}x{len(destinations)} block: {e}")
+            return None
+
+    blocks = plan_requests(pairs)
+    responses = await asyncio.gather(*(fetch(block) for block in blocks))
+    for block, response in zip(blocks, responses):
+        _collect_elements(results, block, response)
+
+    return results
+
+
+def _collect_elements(results: Dict, block: Tuple[List[str], List[str]], response: Optional[Dict]) -> None:
+    """Store the elements of one matrix response for the pairs that were asked for"""
+    if response is None:
+        return
+
+    origins, destinations = block
+    for origin, row in zip(origins, response.get('rows', [])):
+        for destination, element in zip(destinations, row.get('elements', [])):
+            if (origin, destination) not in results:
+                continue
+            if element.get('status') == 'OK':
+                results[(origin, destination)] = element
+            else:
+                logging.debug("No matrix result from %s to %s: %s", origin, destination, element.get('status'))
+
+
+def element_minutes(element: Dict) -> float:
+    """Travel time of a matrix element in minutes, preferring the traffic-aware estimate"""
+    duration = element.get('duration_in_traffic') or element['duration']
+    return duration['value'] / 60
+
+
+def element_miles(element: Dict) -> float:
+    """Travel distance of a matrix element in miles"""
+    return element['distance']['value'] / 1609.34
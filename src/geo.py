@@ -0,0 +1,52 @@
+from typing import Sequence, Tuple
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371
+KM_PER_MILE = 1.60934
+
+
+def _to_radians(points: Sequence[Tuple[float, float]]) -> np.ndarray:
+    """Convert a sequence of (lat, lng) pairs in degrees to an (N, 2) array in radians"""
+    return np.radians(np.asarray(points, dtype=np.float64).reshape(-1, 2))
+
+
+def haversine_matrix(origins: Sequence[Tuple[float, float]],
+                     destinations: Sequence[Tuple[float, float]]) -> np.ndarray:
+    """Great-circle distances in kilometers between every origin and every destination.
+
+    Takes N origins and M destinations as (lat, lng) pairs and returns an
+    N x M array computed in a single NumPy pass.
+    """
+    a = _to_radians(origins)
+    b = _to_radians(destinations)
+    lat1, lng1 = a[:, 0:1], a[:, 1:2]
+    lat2, lng2 = b[:, 0], b[:, 1]
+
+    h = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(h, 0, 1)))
+
+
+def haversine_pairs(origins: Sequence[Tuple[float, float]],
+                    destinations: Sequence[Tuple[float, float]]) -> np.ndarray:
+    """Great-circle distances in kilometers between origins[i] and destinations[i]"""
+    a = _to_radians(origins)
+    b = _to_radians(destinations)
+
+    h = (np.sin((b[:, 0] - a[:, 0]) / 2) ** 2
+         + np.cos(a[:, 0]) * np.cos(b[:, 0]) * np.sin((b[:, 1] - a[:, 1]) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(h, 0, 1)))
+
+
+def nearest(origins: Sequence[Tuple[float, float]], candidates: Sequence[Tuple[float, float]],
+            k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+    """Indices and distances (km) of the k nearest candidates to each origin, closest first"""
+    distances = haversine_matrix(origins, candidates)
+    k = min(k, distances.shape[1])
+    if k < distances.shape[1]:
+        indices = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    else:
+        indices = np.tile(np.arange(distances.shape[1]), (distances.shape[0], 1))
+    order = np.take_along_axis(distances, indices, axis=1).argsort(axis=1)
+    indices = np.take_along_axis(indices, order, axis=1)
+    return indices, np.take_along_axis(distances, indices, axis=1)
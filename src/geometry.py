@@ -0,0 +1,120 @@
+import math
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+# Web Mercator ground resolution at the equator, zoom 0 (meters per pixel)
+EQUATOR_METERS_PER_PIXEL = 156543.03
+METERS_PER_DEGREE = 111320
+
+# Points closer than this many decimal degrees (about 1 m) are the same vertex
+SNAP_DECIMALS = 5
+
+Line = List[Tuple[float, float]]
+
+
+def tolerance_for_zoom(zoom: float, latitude: float, pixels: float = 1.0) -> float:
+    """Simplification tolerance in meters that is invisible at a map zoom level"""
+    return pixels * EQUATOR_METERS_PER_PIXEL * math.cos(math.radians(latitude)) / 2 ** zoom
+
+
+def _project(coords: Sequence[Tuple[float, float]]) -> np.ndarray:
+    """Equirectangular projection of (lat, lng) points to meters, fine at city scale"""
+    points = np.asarray(coords, dtype=np.float64)
+    scale = math.cos(math.radians(points[:, 0].mean()))
+    return np.column_stack([points[:, 1] * METERS_PER_DEGREE * scale, points[:, 0] * METERS_PER_DEGREE])
+
+
+def simplify(coords: Sequence[Tuple[float, float]], tolerance_meters: float) -> Line:
+    """Douglas-Peucker simplification of a (lat, lng) line.
+
+    Drops every vertex that lies within tolerance_meters of the simplified
+    line; the endpoints are always kept.
+    """
+    if len(coords) <= 2 or tolerance_meters <= 0:
+        return list(coords)
+    points = _project(coords)
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+
+    stack = [(0, len(points) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        segment = points[end] - points[start]
+        offsets = points[start + 1:end] - points[start]
+        length = np.hypot(*segment)
+        if length == 0:
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        else:
+            distances = np.abs(segment[0] * offsets[:, 1] - segment[1] * offsets[:, 0]) / length
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance_meters:
+            split = start + 1 + farthest
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+
+    return [tuple(coords[i]) for i in np.flatnonzero(keep)]
+
+
+def _vertex(point: Tuple[float, float]) -> Tuple[float, float]:
+    return round(float(point[0]), SNAP_DECIMALS), round(float(point[1]), SNAP_DECIMALS)
+
+
+def merge_lines(lines: Sequence[Sequence[Tuple[float, float]]]) -> List[Tuple[Line, int]]:
+    """Merge overlapping lines into segments labelled with how many lines use them.
+
+    Every line is split into edges between consecutive vertices. An edge
+    shared by several lines is counted once per line, and consecutive
+    edges with the same count are chained back into a single polyline.
+    Identical lines therefore collapse into one segment with their count.
+    """
+    counts: Dict[Tuple, int] = {}
+    ordered_edges = []
+    for line in lines:
+        vertices = [_vertex(point) for point in line]
+        seen = set()
+        for a, b in zip(vertices, vertices[1:]):
+            if a == b:
+                continue
+            edge = (a, b) if a <= b else (b, a)
+            if edge in seen:
+                continue
+            seen.add(edge)
+            if edge not in counts:
+                counts[edge] = 0
+                ordered_edges.append((a, b))
+            counts[edge] += 1
+
+    # Chain edges in the order they were first drawn, breaking wherever the count changes
+    merged: List[Tuple[Line, int]] = []
+    current: Line = []
+    current_count = None
+    for a, b in ordered_edges:
+        count = counts[(a, b) if a <= b else (b, a)]
+        if current and current[-1] == a and count == current_count:
+            current.append(b)
+            continue
+        if current:
+            merged.append((current, current_count))
+        current, current_count = [a, b], count
+    if current:
+        merged.append((current, current_count))
+    return merged
+
+
+def prepare_lines(lines: Sequence[Sequence[Tuple[float, float]]], zoom: float) -> List[Tuple[Line, int]]:
+    """Merge shared segments and simplify them for display at a zoom level"""
+    lines = [line for line in lines if len(line) >= 2]
+    if not lines:
+        return []
+    latitude = float(np.mean([line[0][0] for line in lines]))
+    tolerance = tolerance_for_zoom(zoom, latitude)
+    return [(simplify(line, tolerance), count) for line, count in merge_lines(lines)]
+
+
+def line_weight(count: int, base: float = 2, maximum: float = 10) -> float:
+    """Stroke width for a segment used by count routes, growing logarithmically"""
+    return min(maximum, base + 1.5 * math.log2(count))
@@ -0,0 +1,701 @@
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import zipfile
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+import polyline
+import pytz
+from dotenv import load_dotenv
+
+from geo import haversine_matrix, haversine_pairs
+
+# GTFS route_type for commuter/regional rail
+RAIL_ROUTE_TYPE = 2
+
+# Walking between an address and a stop
+WALK_SPEED_KMH = 4.8
+WALK_DETOUR = 1.3  # Street distance per straight-line km
+MAX_WALK_KM = 1.0
+MIN_WALK_SECONDS = 60  # Shorter walks (e.g. a station's own platform) are treated as none
+
+MAX_TRANSFERS = 2
+TRANSFER_SLACK_SECONDS = 120
+
+INF = np.iinfo(np.int32).max
+
+
+def _read_table(source, name: str, required: bool = True) -> Optional[pd.DataFrame]:
+    """Read one GTFS table from a zip file or a directory"""
+    if isinstance(source, zipfile.ZipFile):
+        if name not in source.namelist():
+            if required:
+                raise ValueError(f"GTFS feed is missing {name}")
+            return None
+        with source.open(name) as f:
+            return pd.read_csv(f, dtype=str, keep_default_na=False)
+    path = os.path.join(source, name)
+    if not os.path.exists(path):
+        if required:
+            raise ValueError(f"GTFS feed is missing {name}")
+        return None
+    return pd.read_csv(path, dtype=str, keep_default_na=False)
+
+
+def _seconds(times: pd.Series) -> pd.Series:
+    """Convert GTFS HH:MM:SS strings (hours may exceed 24) to seconds after midnight.
+
+    Blank times, which GTFS allows at stops that are not timepoints, are NaN.
+    """
+    parts = times.str.strip().str.split(':', expand=True).reindex(columns=range(3))
+    parts = parts.apply(pd.to_numeric, errors='coerce')
+    return parts[0] * 3600 + parts[1] * 60 + parts[2]
+
+
+def _stop_time_seconds(stop_times: pd.DataFrame) -> Tuple[pd.DataFrame, np.ndarray, np.ndarray]:
+    """Arrival and departure seconds for stop times sorted by trip and sequence.
+
+    Blank times are interpolated linearly between the timed stops around
+    them. Trips must be timed at their first and last stops, so rows left
+    untimed there are dropped rather than interpolated from another trip.
+    """
+    arrivals = _seconds(stop_times['arrival_time'])
+    departures = _seconds(stop_times['departure_time'])
+    arrivals, departures = arrivals.fillna(departures), departures.fillna(arrivals)
+
+    trips = stop_times['trip_id']
+    ends = (trips != trips.shift()) | (trips != trips.shift(-1))
+    keep = ~(ends & arrivals.isna()).to_numpy()
+    if not keep.all():
+        logging.warning(f"Dropping {(~keep).sum()} untimed stop times at the ends of trips")
+    stop_times, arrivals, departures = stop_times[keep], arrivals[keep], departures[keep]
+
+    arrivals = arrivals.reset_index(drop=True).interpolate().round()
+    departures = departures.reset_index(drop=True).interpolate().round()
+    return stop_times, arrivals.to_numpy(dtype=np.int32), departures.to_numpy(dtype=np.int32)
+
+
+def _normalize_line(name: str) -> str:
+    """Lower-case a line name and drop a trailing "Line" and extra spaces"""
+    name = ' '.join(name.lower().replace('/', ' / ').split())
+    return name[:-5] if name.endswith(' line') else name
+
+
+def _line_matches(route_names: Sequence[str], names: Sequence[str]) -> bool:
+    """Whether a GTFS route is one of the named lines, ignoring a trailing "Line", spacing and case"""
+    wanted = {_normalize_line(name) for name in names}
+    return any(name and _normalize_line(name) in wanted for name in route_names)
+
+
+def _walk_seconds(km: np.ndarray) -> np.ndarray:
+    return np.ceil(km * WALK_DETOUR / WALK_SPEED_KMH * 3600).astype(np.int32)
+
+
+@dataclass
+class Pattern:
+    """Trips serving the same stop sequence, ordered so no trip overtakes another"""
+    route: int
+    stops: np.ndarray     # stop indices in travel order
+    arrivals: np.ndarray  # trips x stops, seconds after midnight
+    departures: np.ndarray
+    trips: np.ndarray     # trip indices, one per row
+
+    def reversed(self) -> 'Pattern':
+        """The same trips in a time-reversed network, used for latest-departure queries"""
+        return Pattern(
+            route=self.route,
+            stops=self.stops[::-1].copy(),
+            arrivals=-self.departures[::-1, ::-1],
+            departures=-self.arrivals[::-1, ::-1],
+            trips=self.trips[::-1].copy(),
+        )
+
+    def active(self, mask: np.ndarray) -> Optional['Pattern']:
+        """The pattern restricted to trips running on a service day"""
+        keep = mask[self.trips]
+        if not keep.any():
+            return None
+        return Pattern(self.route, self.stops, self.arrivals[keep], self.departures[keep], self.trips[keep])
+
+
+class _Network:
+    """Patterns and footpaths for one service day in one direction of time"""
+
+    def __init__(self, patterns: List[Pattern], n_stops: int, footpaths: Dict[int, List[Tuple[int, int]]]):
+        self.patterns = patterns
+        self.footpaths = footpaths
+        self.stop_patterns: List[List[Tuple[int, int]]] = [[] for _ in range(n_stops)]
+        for p, pattern in enumerate(patterns):
+            for position, stop in enumerate(pattern.stops):
+                self.stop_patterns[stop].append((p, position))
+
+    def raptor(self, sources: Dict[int, int], targets: Dict[int, int], max_transfers: int,
+               labels: Optional[List[np.ndarray]] = None, parents: Optional[List[Dict[int, Tuple]]] = None):
+        """Round-based earliest-arrival search.
+
+        sources maps stop -> time the traveller is there; targets maps
+        stop -> seconds needed to get from the stop to the final
+        destination. Returns per-round labels and the parent pointers
+        needed to rebuild journeys. Passing back the labels and parents of
+        a search that started later (rRAPTOR) reuses them, so only stops
+        the earlier start improves are scanned again.
+        """
+        n_stops = len(self.stop_patterns)
+        rounds = max_transfers + 2
+        if labels is None:
+            labels = [np.full(n_stops, INF, dtype=np.int64) for _ in range(rounds)]
+            parents = [{} for _ in range(rounds)]
+        best = np.min(labels, axis=0)
+        marked = set()
+        for stop, time in sources.items():
+            if time < labels[0][stop]:
+                labels[0][stop] = time
+                best[stop] = min(best[stop], time)
+                parents[0].pop(stop, None)
+                marked.add(stop)
+        # Footpaths from the sources can start a journey too
+        for stop in list(marked):
+            for other, seconds in self.footpaths.get(stop, ()):
+                arrival = labels[0][stop] + seconds
+                if arrival < labels[0][other]:
+                    labels[0][other] = arrival
+                    best[other] = min(best[other], arrival)
+                    parents[0][other] = ('walk', stop, seconds)
+                    marked.add(other)
+
+        def target_bound():
+            return min((best[stop] + egress for stop, egress in targets.items()), default=INF)
+
+        for k in range(1, rounds):
+            previous = labels[k - 1]
+            current = labels[k]
+            parent = parents[k]
+            # Labels carried over from the previous round have no parent in this one
+            for stop in np.flatnonzero(previous < current):
+                parent.pop(stop, None)
+            np.minimum(current, previous, out=current)
+            slack = TRANSFER_SLACK_SECONDS if k > 1 else 0
+
+            queue: Dict[int, int] = {}
+            for stop in marked:
+                for p, position in self.stop_patterns[stop]:
+                    queue[p] = min(queue.get(p, position), position)
+            marked = set()
+
+            bound = target_bound()
+            for p, start in queue.items():
+                pattern = self.patterns[p]
+                trip = None
+                board = None
+                for i in range(start, len(pattern.stops)):
+                    stop = pattern.stops[i]
+                    if trip is not None:
+                        arrival = pattern.arrivals[trip, i]
+                        if arrival < best[stop] and arrival < bound:
+                            current[stop] = best[stop] = arrival
+                            parent[stop] = ('trip', p, trip, board, i)
+                            marked.add(stop)
+                    ready = previous[stop]
+                    if ready < INF and (trip is None or ready + slack <= pattern.departures[trip, i]):
+                        earlier = int(np.searchsorted(pattern.departures[:, i], ready + slack))
+                        if earlier < len(pattern.trips) and (trip is None or earlier < trip):
+                            trip, board = earlier, i
+
+            for stop in list(marked):
+                for other, seconds in self.footpaths.get(stop, ()):
+                    arrival = current[stop] + seconds
+                    if arrival < best[other]:
+                        current[other] = best[other] = arrival
+                        parent[other] = ('walk', stop, seconds)
+                        marked.add(other)
+
+            if not marked:
+                break
+
+        return labels, parents
+
+    def journey(self, labels, parents, round_: int, stop: int) -> List[Tuple]:
+        """Rebuild the legs reaching stop in a given round, in travel order"""
+        legs = []
+        k = round_
+        while k > 0:
+            if stop not in parents[k]:
+                k -= 1
+                continue
+            entry = parents[k][stop]
+            if entry[0] == 'walk':
+                # ('walk', from stop, seconds, to stop)
+                legs.append(entry + (stop,))
+                stop = entry[1]
+                continue
+            _, p, trip, board, alight = entry
+            legs.append(entry)
+            stop = self.patterns[p].stops[board]
+            k -= 1
+        if stop in parents[0]:
+            legs.append(parents[0][stop] + (stop,))
+        return legs[::-1]
+
+
+class GTFSRouter:
+    """Offline rail router over a GTFS feed.
+
+    Stops, trips and stop times are loaded into NumPy arrays grouped by
+    stop pattern. Queries run RAPTOR over the trips active on the query's
+    service day: earliest arrival forward in time, latest departure on the
+    time-reversed network. route() returns a route in the same shape as a
+    Directions API transit response so it can stand in for one.
+    """
+
+    def __init__(self, path: str, route_names: Optional[Sequence[str]] = None):
+        source = zipfile.ZipFile(path) if zipfile.is_zipfile(path) else path
+        try:
+            self._load(source, route_names)
+        finally:
+            if isinstance(source, zipfile.ZipFile):
+                source.close()
+        self._days: Dict[Tuple[date, bool], _Network] = {}
+
+    def _load(self, source, route_names: Optional[Sequence[str]]) -> None:
+        agency = _read_table(source, 'agency.txt')
+        self.timezone = pytz.timezone(agency['agency_timezone'].iloc[0])
+
+        routes = _read_table(source, 'routes.txt')
+        routes = routes[routes['route_type'].astype(int) == RAIL_ROUTE_TYPE]
+        if route_names:
+            routes = routes[[
+                _line_matches([row.get('route_long_name', ''), row.get('route_short_name', '')], route_names)
+                for row in routes.to_dict('records')
+            ]]
+        if routes.empty:
+            raise ValueError("GTFS feed has no matching rail routes")
+        self.route_ids = routes['route_id'].tolist()
+        self.route_names = [row.get('route_long_name') or row.get('route_short_name') or row['route_id']
+                            for row in routes.to_dict('records')]
+        route_index = {route_id: i for i, route_id in enumerate(self.route_ids)}
+
+        trips = _read_table(source, 'trips.txt')
+        trips = trips[trips['route_id'].isin(route_index)].reset_index(drop=True)
+        self.trip_ids = trips['trip_id'].to_numpy()
+        self.trip_routes = trips['route_id'].map(route_index).to_numpy()
+        self.trip_services = trips['service_id'].to_numpy()
+        self.trip_headsigns = (trips['trip_headsign'] if 'trip_headsign' in trips else pd.Series([''] * len(trips))).to_numpy()
+        trip_index = {trip_id: i for i, trip_id in enumerate(self.trip_ids)}
+
+        stop_times = _read_table(source, 'stop_times.txt')
+        stop_times = stop_times[stop_times['trip_id'].isin(trip_index)].copy()
+        stop_times['stop_sequence'] = stop_times['stop_sequence'].astype(int)
+        stop_times = stop_times.sort_values(['trip_id', 'stop_sequence'])
+
+        stops = _read_table(source, 'stops.txt')
+        stops = stops[stops['stop_id'].isin(set(stop_times['stop_id']))].reset_index(drop=True)
+        self.stop_ids = stops['stop_id'].to_numpy()
+        self.stop_names = stops['stop_name'].to_numpy()
+        self.stop_coords = stops[['stop_lat', 'stop_lon']].astype(float).to_numpy()
+        stop_index = {stop_id: i for i, stop_id in enumerate(self.stop_ids)}
+
+        stop_times, arrivals, departures = _stop_time_seconds(stop_times)
+        self._build_patterns(
+            stop_times['trip_id'].map(trip_index).to_numpy(),
+            stop_times['stop_id'].map(stop_index).to_numpy(),
+            arrivals,
+            departures,
+        )
+
+        self.footpaths: Dict[int, List[Tuple[int, int]]] = {}
+        transfers = _read_table(source, 'transfers.txt', required=False)
+        if transfers is not None:
+            for row in transfers.to_dict('records'):
+                origin, dest = stop_index.get(row['from_stop_id']), stop_index.get(row['to_stop_id'])
+                if origin is None or dest is None or origin == dest:
+                    continue
+                seconds = int(row.get('min_transfer_time') or 0)
+                self.footpaths.setdefault(origin, []).append((dest, seconds))
+
+        self.calendar = _read_table(source, 'calendar.txt', required=False)
+        self.calendar_dates = _read_table(source, 'calendar_dates.txt', required=False)
+        logging.info(f"Loaded GTFS feed: {len(self.route_ids)} routes, {len(self.stop_ids)} stops, "
+                     f"{len(self.trip_ids)} trips in {len(self.patterns)} patterns")
+
+    def _build_patterns(self, trips: np.ndarray, stops: np.ndarray,
+                        arrivals: np.ndarray, departures: np.ndarray) -> None:
+        """Group trips by stop sequence, splitting groups so trips never overtake"""
+        boundaries = np.flatnonzero(np.diff(trips)) + 1
+        groups: Dict[Tuple, List[int]] = {}
+        rows = {}
+        for start, end in zip(np.r_[0, boundaries], np.r_[boundaries, len(trips)]):
+            trip = trips[start]
+            sequence = tuple(stops[start:end])
+            groups.setdefault((self.trip_routes[trip], sequence), []).append(trip)
+            rows[trip] = (arrivals[start:end], departures[start:end])
+
+        self.patterns: List[Pattern] = []
+        for (route, sequence), group in groups.items():
+            group.sort(key=lambda trip: rows[trip][1][0])
+            fifo: List[List[int]] = []
+            for trip in group:
+                for members in fifo:
+                    last = members[-1]
+                    if (np.all(rows[last][0] <= rows[trip][0])
+                            and np.all(rows[last][1] <= rows[trip][1])):
+                        members.append(trip)
+                        break
+                else:
+                    fifo.append([trip])
+            for members in fifo:
+                self.patterns.append(Pattern(
+                    route=route,
+                    stops=np.asarray(sequence, dtype=np.int64),
+                    arrivals=np.vstack([rows[trip][0] for trip in members]).astype(np.int64),
+                    departures=np.vstack([rows[trip][1] for trip in members]).astype(np.int64),
+                    trips=np.asarray(members, dtype=np.int64),
+                ))
+
+    def active_services(self, day: date) -> set:
+        """Service ids running on a date, from calendar.txt and calendar_dates.txt"""
+        services = set()
+        key = day.strftime('%Y%m%d')
+        if self.calendar is not None:
+            weekday = day.strftime('%A').lower()
+            running = self.calendar[
+                (self.calendar[weekday] == '1')
+                & (self.calendar['start_date'] <= key)
+                & (self.calendar['end_date'] >= key)
+            ]
+            services.update(running['service_id'])
+        if self.calendar_dates is not None:
+            changes = self.calendar_dates[self.calendar_dates['date'] == key]
+            services.update(changes.loc[changes['exception_type'] == '1', 'service_id'])
+            services.difference_update(changes.loc[changes['exception_type'] == '2', 'service_id'])
+        return services
+
+    def network(self, day: date, reverse: bool = False) -> _Network:
+        """Network of trips running on a service day, built once per day and direction"""
+        key = (day, reverse)
+        if key not in self._days:
+            mask = np.isin(self.trip_services, list(self.active_services(day)))
+            patterns = [p for p in (pattern.active(mask) for pattern in self.patterns) if p is not None]
+            footpaths = self.footpaths
+            if reverse:
+                patterns = [pattern.reversed() for pattern in patterns]
+                footpaths = {}
+                for origin, paths in self.footpaths.items():
+                    for dest, seconds in paths:
+                        footpaths.setdefault(dest, []).append((origin, seconds))
+            self._days[key] = _Network(patterns, len(self.stop_ids), footpaths)
+        return self._days[key]
+
+    def stops_near(self, point: Tuple[float, float], max_km: float = MAX_WALK_KM) -> Dict[int, int]:
+        """Stops within walking distance of a point, mapped to the walk in seconds"""
+        distances = haversine_matrix([point], self.stop_coords)[0]
+        nearby = np.flatnonzero(distances <= max_km)
+        walks = _walk_seconds(distances[nearby])
+        walks[walks < MIN_WALK_SECONDS] = 0
+        return dict(zip(nearby.tolist(), walks.tolist()))
+
+    def earliest_arrival(self, origins: Dict[int, int], destinations: Dict[int, int], day: date,
+                         depart_at: int, max_transfers: int = MAX_TRANSFERS) -> Optional[List[Tuple]]:
+        """Fastest journey leaving after depart_at (seconds after midnight).
+
+        origins and destinations map stops to the walk to or from them in
+        seconds. Returns the journey as ('trip', pattern, trip row, board
+        position, alight position) rides and ('walk', from stop, seconds, to
+        stop) footpaths in travel order, or None if nothing connects.
+        """
+        network = self.network(day)
+        sources = {stop: depart_at + walk for stop, walk in origins.items()}
+        labels, parents = network.raptor(sources, destinations, max_transfers)
+        best = self._best_label(labels, destinations)
+        if best is None:
+            return None
+        k, stop = best
+        return self._legs(network, labels, parents, k, stop, reverse=False)
+
+    def latest_departure(self, origins: Dict[int, int], destinations: Dict[int, int], day: date,
+                         arrive_by: int, max_transfers: int = MAX_TRANSFERS) -> Optional[List[Tuple]]:
+        """Latest-leaving journey that still arrives by arrive_by (seconds after midnight)"""
+        network = self.network(day, reverse=True)
+        sources = {stop: -(arrive_by - walk) for stop, walk in destinations.items()}
+        labels, parents = network.raptor(sources, origins, max_transfers)
+        best = self._best_label(labels, origins)
+        if best is None:
+            return None
+        k, stop = best
+        return self._legs(network, labels, parents, k, stop, reverse=True)
+
+    @staticmethod
+    def _best_label(labels, targets: Dict[int, int]) -> Optional[Tuple[int, int]]:
+        """Round and stop of the earliest arrival at any target, preferring fewer rides"""
+        best = None
+        for k, label in enumerate(labels):
+            for stop, egress in targets.items():
+                if label[stop] < INF and (best is None or label[stop] + egress < best[0]):
+                    best = (label[stop] + egress, k, stop)
+        return best and best[1:]
+
+    def _legs(self, network: _Network, labels, parents, k: int, stop: int, reverse: bool) -> List[Tuple]:
+        """Convert a RAPTOR journey into real-time rides in travel order"""
+        rides = []
+        for entry in network.journey(labels, parents, k, stop):
+            if entry[0] == 'walk':
+                # A reversed footpath is walked the other way in real time
+                rides.append(('walk', entry[3], entry[2], entry[1]) if reverse else entry)
+                continue
+            _, p, row, board, alight = entry
+            pattern = network.patterns[p]
+            if reverse:
+                # Position i in a reversed pattern is position n - 1 - i in the real one
+                n = len(pattern.stops)
+                rides.append(('trip', pattern.reversed(), len(pattern.trips) - 1 - row, n - 1 - alight, n - 1 - board))
+            else:
+                rides.append(('trip', pattern, row, board, alight))
+        return rides[::-1] if reverse else rides
+
+    def route(self, origin: Tuple[float, float], destination: Tuple[float, float],
+              arrive_by: datetime) -> Optional[Dict]:
+        """Latest-departing rail route between two points arriving by arrive_by.
+
+        Returns a route dict shaped like a Directions API transit route, or
+        None if no train connects the two points in time.
+        """
+        local = arrive_by.astimezone(self.timezone)
+        day = local.date()
+        seconds = local.hour * 3600 + local.minute * 60 + local.second
+        origins = self.stops_near(origin)
+        destinations = self.stops_near(destination)
+        if not origins or not destinations:
+            return None
+
+        legs = self.latest_departure(origins, destinations, day, seconds) or []
+        if not any(leg[0] == 'trip' for leg in legs):
+            return None
+        return self._directions_route(legs, origin, destination, origins, destinations, day)
+
+    def arrival_profile(self, origins: Dict[str, Tuple[float, float]], destination: Tuple[float, float],
+                        day: date, arrive_by: Sequence[int],
+                        max_transfers: int = MAX_TRANSFERS) -> Dict[str, List[Optional[Dict]]]:
+        """Latest-departing route from every origin for each arrival target.
+
+        arrive_by holds targets in seconds after midnight on day. One
+        search per target covers every origin, and targets are processed
+        earliest first so each search reuses the labels of the one before
+        (rRAPTOR): whatever arrives by 8:00 also arrives by 8:05, so only
+        stops the later target improves are scanned again. Returns a list of
+        Directions-shaped routes (or None) per origin, in arrive_by order.
+        """
+        profiles: Dict[str, List[Optional[Dict]]] = {key: [None] * len(arrive_by) for key in origins}
+        destinations = self.stops_near(destination)
+        access = {key: self.stops_near(point) for key, point in origins.items()}
+        if not destinations:
+            return profiles
+
+        network = self.network(day, reverse=True)
+        labels = parents = None
+        for slot in np.argsort(arrive_by, kind='stable'):
+            sources = {stop: -(arrive_by[slot] - walk) for stop, walk in destinations.items()}
+            labels, parents = network.raptor(sources, {}, max_transfers, labels, parents)
+            for key, stops in access.items():
+                best = self._best_label(labels, stops)
+                if best is None:
+                    continue
+                legs = self._legs(network, labels, parents, *best, reverse=True)
+                if any(leg[0] == 'trip' for leg in legs):
+                    profiles[key][slot] = self._directions_route(legs, origins[key], destination,
+                                                                 stops, destinations, day)
+        return profiles
+
+    def _stop_json(self, stop: int) -> Dict:
+        return {
+            'name': self.stop_names[stop],
+            'location': {'lat': float(self.stop_coords[stop][0]), 'lng': float(self.stop_coords[stop][1])},
+        }
+
+    def _time_json(self, day: date, seconds: int) -> Dict:
+        moment = self.timezone.localize(datetime.combine(day, datetime.min.time())) + timedelta(seconds=int(seconds))
+        return {
+            'text': moment.strftime('%I:%M %p').lstrip('0'),
+            'value': int(moment.timestamp()),
+            'time_zone': self.timezone.zone,
+        }
+
+    def _walk_step(self, start: Tuple[float, float], end: Tuple[float, float], seconds: int) -> Dict:
+        meters = float(haversine_pairs([start], [end])[0]) * 1000 * WALK_DETOUR
+        return {
+            'travel_mode': 'WALKING',
+            'duration': {'value': int(seconds), 'text': f"{round(seconds / 60)} mins"},
+            'distance': {'value': int(meters), 'text': f"{meters / 1609.34:.1f} mi"},
+            'start_location': {'lat': start[0], 'lng': start[1]},
+            'end_location': {'lat': end[0], 'lng': end[1]},
+        }
+
+    def _directions_route(self, legs: List[Tuple], origin: Tuple[float, float], destination: Tuple[float, float],
+                          origins: Dict[int, int], destinations: Dict[int, int], day: date) -> Dict:
+        """Directions-shaped route for a journey of rides and footpaths.
+
+        The journey starts at one of origins' stops and ends at one of
+        destinations'; footpaths between stops become WALKING steps.
+        """
+        def first_stop(leg):
+            return leg[1] if leg[0] == 'walk' else leg[1].stops[leg[3]]
+
+        def last_stop(leg):
+            return leg[3] if leg[0] == 'walk' else leg[1].stops[leg[4]]
+
+        steps = []
+        start_stop = first_stop(legs[0])
+        end_stop = last_stop(legs[-1])
+        start_walk = origins[start_stop]
+        end_walk = destinations[end_stop]
+
+        if start_walk > 0:
+            steps.append(self._walk_step(origin, tuple(self.stop_coords[start_stop]), start_walk))
+        for leg in legs:
+            if leg[0] == 'walk':
+                _, walk_from, seconds, walk_to = leg
+                steps.append(self._walk_step(tuple(self.stop_coords[walk_from]), tuple(self.stop_coords[walk_to]),
+                                             seconds))
+                continue
+            _, pattern, row, board, alight = leg
+            departure = int(pattern.departures[row, board])
+            arrival = int(pattern.arrivals[row, alight])
+            path = self.stop_coords[pattern.stops[board:alight + 1]]
+            meters = float(haversine_pairs(path[:-1], path[1:]).sum()) * 1000
+            trip = pattern.trips[row]
+            steps.append({
+                'travel_mode': 'TRANSIT',
+                'duration': {'value': arrival - departure, 'text': f"{round((arrival - departure) / 60)} mins"},
+                'distance': {'value': int(meters), 'text': f"{meters / 1609.34:.1f} mi"},
+                'transit_details': {
+                    'line': {
+                        'name': self.route_names[pattern.route],
+                        'short_name': self.route_ids[pattern.route],
+                        'vehicle': {'name': 'Train', 'type': 'HEAVY_RAIL'},
+                    },
+                    'headsign': self.trip_headsigns[trip],
+                    'trip_id': self.trip_ids[trip],
+                    'num_stops': alight - board,
+                    'departure_stop': self._stop_json(pattern.stops[board]),
+                    'arrival_stop': self._stop_json(pattern.stops[alight]),
+                    'departure_time': self._time_json(day, departure),
+                    'arrival_time': self._time_json(day, arrival),
+                },
+            })
+        if end_walk > 0:
+            steps.append(self._walk_step(tuple(self.stop_coords[end_stop]), destination, end_walk))
+
+        # The overview shape follows the stops passed through, plus the walks at either end
+        shape = [origin, tuple(self.stop_coords[start_stop])]
+        for leg in legs:
+            stops = [leg[3]] if leg[0] == 'walk' else leg[1].stops[leg[3] + 1:leg[4] + 1]
+            shape.extend(tuple(point) for point in self.stop_coords[stops])
+        shape.append(destination)
+
+        # Footpaths before the first ride and after the last are walked right up to them
+        rides = [i for i, leg in enumerate(legs) if leg[0] == 'trip']
+        first, last = legs[rides[0]], legs[rides[-1]]
+        leg_departure = (int(first[1].departures[first[2], first[3]]) - start_walk
+                         - sum(leg[2] for leg in legs[:rides[0]]))
+        leg_arrival = (int(last[1].arrivals[last[2], last[4]]) + end_walk
+                       + sum(leg[2] for leg in legs[rides[-1] + 1:]))
+        return {'overview_polyline': {'points': polyline.encode(shape)}, 'legs': [{
+            'steps': steps,
+            'departure_time': self._time_json(day, leg_departure),
+            'arrival_time': self._time_json(day, leg_arrival),
+            'duration': {'value': leg_arrival - leg_departure, 'text': f"{round((leg_arrival - leg_departure) / 60)} mins"},
+            'start_location': {'lat': origin[0], 'lng': origin[1]},
+            'end_location': {'lat': destination[0], 'lng': destination[1]},
+        }]}
+
+
+def load_router(path: Optional[str], route_names: Optional[Sequence[str]] = None) -> Optional[GTFSRouter]:
+    """Load the GTFS feed at path, or None if no feed is configured"""
+    if not path:
+        return None
+    if not os.path.exists(path):
+        logging.warning(f"GTFS feed {path} not found; using Google transit directions")
+        return None
+    return GTFSRouter(path, route_names)
+
+
+def validate(router: GTFSRouter, cache_path: str, tolerance_minutes: float = 2) -> Dict:
+    """Compare the router against transit directions recorded in the API cache.
+
+    For every recorded ride on a routed line, the router is asked for the
+    earliest arrival at the alighting stop when boarding at Google's
+    departure time. Returns counts and the arrival-time differences.
+    """
+    conn = sqlite3.connect(cache_path)
+    rows = conn.execute("SELECT key, response FROM responses WHERE endpoint = 'directions'").fetchall()
+    conn.close()
+
+    differences = []
+    for key, response in rows:
+        if json.loads(key)[1].get('mode') != 'transit':
+            continue
+        for route in json.loads(response):
+            for step in route['legs'][0]['steps']:
+                details = step.get('transit_details')
+                if step['travel_mode'] != 'TRANSIT' or not details:
+                    continue
+                if not _line_matches([details['line'].get('name', ''), details['line'].get('short_name', '')],
+                                     router.route_names):
+                    continue
+                board = details['departure_stop']['location']
+                alight = details['arrival_stop']['location']
+                departed = datetime.fromtimestamp(details['departure_time']['value'], router.timezone)
+                origins = {stop: 0 for stop in router.stops_near((board['lat'], board['lng']), 0.3)}
+                destinations = {stop: 0 for stop in router.stops_near((alight['lat'], alight['lng']), 0.3)}
+                if not origins or not destinations:
+                    continue
+                seconds = departed.hour * 3600 + departed.minute * 60 + departed.second
+                journey = router.earliest_arrival(origins, destinations, departed.date(), seconds, max_transfers=0)
+                rides = [ride for ride in journey or [] if ride[0] == 'trip']
+                if not rides:
+                    differences.append(None)
+                    continue
+                _, pattern, row, _, alight_position = rides[-1]
+                arrival = datetime.combine(departed.date(), datetime.min.time()) + timedelta(
+                    seconds=int(pattern.arrivals[row, alight_position]))
+                recorded = datetime.fromtimestamp(details['arrival_time']['value'], router.timezone).replace(tzinfo=None)
+                differences.append((arrival - recorded).total_seconds() / 60)
+
+    found = [d for d in differences if d is not None]
+    return {
+        'rides': len(differences),
+        'unrouted': len(differences) - len(found),
+        'within_tolerance': sum(abs(d) <= tolerance_minutes for d in found),
+        'median_abs_minutes': float(np.median(np.abs(found))) if found else None,
+        'max_abs_minutes': float(np.max(np.abs(found))) if found else None,
+    }
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description='Check the offline GTFS rail router against recorded Google directions.')
+    parser.add_argument('--feed', default=os.getenv('GTFS_FEED_PATH'), help='GTFS zip file or directory')
+    parser.add_argument('--cache', default=os.getenv('API_CACHE_PATH', '.api_cache.sqlite'),
+                        help='API response cache holding recorded transit directions')
+    parser.add_argument('--all-lines', action='store_true', help='Route every rail line, not just VALID_RAIL_LINES')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    if not args.feed:
+        parser.error('--feed or GTFS_FEED_PATH is required')
+
+    from transit_analyzer import VALID_RAIL_LINES
+    router = GTFSRouter(args.feed, None if args.all_lines else VALID_RAIL_LINES)
+    report = validate(router, args.cache)
+    print(f"Compared {report['rides']} recorded rides: {report['within_tolerance']} within 2 minutes, "
+          f"{report['unrouted']} with no matching trip")
+    if report['median_abs_minutes'] is not None:
+        print(f"Arrival difference: median {report['median_abs_minutes']:.1f} min, max {report['max_abs_minutes']:.1f} min")
+
+
+if __name__ == "__main__":
+    main()
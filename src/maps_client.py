@@ -0,0 +1,36 @@
+import logging
+from typing import Optional
+
+import googlemaps
+import requests
+from requests.adapters import HTTPAdapter
+
+from api_cache import CachedClient, cache_settings_from_env
+from api_metrics import InstrumentedClient, get_metrics
+from cost_ledger import get_cost_ledger
+from rate_limiter import RateLimitedClient, get_rate_limiter
+
+
+def create_client(api_key: Optional[str], use_cache: bool = True, pool_size: Optional[int] = None):
+    """Create the Google Maps client shared by the analysis scripts.
+
+    Requests go through the process-wide rate limiter and are timed in the
+    shared API metrics and cost ledger, and responses are
+    cached on disk unless caching is disabled or API_CACHE_PATH is set to an
+    empty string. pool_size sets how many keep-alive connections are kept
+    open for concurrent callers.
+    """
+    session = None
+    if pool_size:
+        session = requests.Session()
+        session.mount('https://', HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size))
+    # Throttling is retried by the rate limiter, which also slows every other caller down
+    client = googlemaps.Client(key=api_key, requests_session=session, retry_over_query_limit=False)
+    client = RateLimitedClient(InstrumentedClient(client, get_metrics(), get_cost_ledger()), get_rate_limiter())
+
+    settings = cache_settings_from_env()
+    if use_cache and settings['path']:
+        logging.debug("Caching API responses in %s", settings['path'])
+        client = CachedClient(client, **settings)
+
+    return client
@@ -0,0 +1,139 @@
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+from api_metrics import get_metrics
+from rate_limiter import get_rate_limiter
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class RunProgress:
+    """Progress of the current analysis run, fed by the analyzer and the CLI loops"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.addresses_total: Optional[int] = None
+        self.addresses_processed = 0
+        # (direction, whether a valid route was found) -> commutes analyzed
+        self.commutes: Dict[Tuple[str, str], int] = {}
+
+    def set_total(self, count: int) -> None:
+        with self._lock:
+            self.addresses_total = count
+
+    def addresses_done(self, count: int = 1) -> None:
+        """Record addresses whose morning and evening commutes are both finished"""
+        with self._lock:
+            self.addresses_processed += count
+
+    def commutes_done(self, is_morning: bool, results) -> None:
+        """Record analyzed commutes in one direction; results are options or None"""
+        direction = 'morning' if is_morning else 'evening'
+        with self._lock:
+            for result in results:
+                key = (direction, 'found' if result else 'none')
+                self.commutes[key] = self.commutes.get(key, 0) + 1
+
+    def snapshot(self) -> Tuple[int, Optional[int], Dict[Tuple[str, str], int]]:
+        """Addresses processed, addresses in the run (if known) and commute counts"""
+        with self._lock:
+            return self.addresses_processed, self.addresses_total, dict(self.commutes)
+
+    def addresses_per_second(self) -> float:
+        elapsed = time.time() - self.started
+        return self.addresses_processed / elapsed if elapsed > 0 else 0.0
+
+
+_shared_progress: Optional[RunProgress] = None
+_shared_progress_lock = threading.Lock()
+
+
+def get_progress() -> RunProgress:
+    """The progress tracker shared by every caller in this process"""
+    global _shared_progress
+    with _shared_progress_lock:
+        if _shared_progress is None:
+            _shared_progress = RunProgress()
+        return _shared_progress
+
+
+def _metric(lines: List[str], name: str, kind: str, help_text: str, samples) -> None:
+    """Append one metric family in the Prometheus text format"""
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {kind}")
+    for labels, value in samples:
+        label_text = ','.join(f'{key}="{val}"' for key, val in labels.items())
+        lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+
+def render_metrics() -> str:
+    """Current progress, API and rate limiter figures in the Prometheus text format"""
+    progress = get_progress()
+    counts = get_metrics().counts()
+    limiter = get_rate_limiter()
+    lines: List[str] = []
+
+    processed, total, commutes = progress.snapshot()
+    _metric(lines, 'transit_addresses_processed_total', 'counter',
+            'Addresses with both commutes analyzed', [({}, processed)])
+    if total is not None:
+        _metric(lines, 'transit_addresses', 'gauge', 'Addresses in this run', [({}, total)])
+    _metric(lines, 'transit_addresses_per_second', 'gauge',
+            'Addresses processed per second since the run started', [({}, round(progress.addresses_per_second(), 4))])
+    _metric(lines, 'transit_commutes_analyzed_total', 'counter', 'Commutes analyzed by direction and outcome',
+            [({'direction': direction, 'result': result}, count)
+             for (direction, result), count in sorted(commutes.items())])
+
+    _metric(lines, 'maps_api_calls_total', 'counter', 'Google Maps requests sent over the network',
+            [({'endpoint': endpoint}, c['calls']) for endpoint, c in sorted(counts.items())])
+    _metric(lines, 'maps_api_errors_total', 'counter', 'Google Maps requests that failed',
+            [({'endpoint': endpoint}, c['errors']) for endpoint, c in sorted(counts.items())])
+    _metric(lines, 'maps_api_cache_hits_total', 'counter', 'Google Maps requests answered from the response cache',
+            [({'endpoint': endpoint}, c['cache_hits']) for endpoint, c in sorted(counts.items())])
+    _metric(lines, 'maps_api_response_bytes_total', 'counter', 'Bytes of Google Maps responses received',
+            [({'endpoint': endpoint}, c['bytes']) for endpoint, c in sorted(counts.items())])
+    calls = sum(c['calls'] for c in counts.values())
+    hits = sum(c['cache_hits'] for c in counts.values())
+    _metric(lines, 'maps_api_cache_hit_ratio', 'gauge', 'Share of Google Maps requests answered from the cache',
+            [({}, round(hits / (calls + hits), 4) if calls + hits else 0)])
+
+    with limiter.condition:
+        in_flight = limiter.in_flight
+        concurrency = limiter.concurrency
+        wait_seconds = limiter.wait_seconds
+        throttled = limiter.throttled_count
+    _metric(lines, 'maps_api_in_flight', 'gauge', 'Google Maps requests currently in flight', [({}, in_flight)])
+    _metric(lines, 'maps_api_concurrency_limit', 'gauge', 'Current adaptive concurrency limit', [({}, concurrency)])
+    _metric(lines, 'maps_api_rate_limit_wait_seconds_total', 'counter',
+            'Time spent waiting on the rate limiter', [({}, round(wait_seconds, 3))])
+    _metric(lines, 'maps_api_throttled_total', 'counter', 'Requests throttled by Google', [({}, throttled)])
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = render_metrics().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug("Metrics request: " + format, *args)
+
+
+def start_metrics_server(port: int, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+    """Serve /metrics from a daemon thread until the process exits"""
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name='metrics-exporter', daemon=True)
+    thread.start()
+    logging.info(f"Serving metrics on http://{host}:{server.server_port}/metrics")
+    return server
@@ -0,0 +1,196 @@
+import contextlib
+import contextvars
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+# What --profile runs on top of the phase timings
+PROFILE_MODES = ['spans', 'sample', 'cprofile']
+
+SAMPLE_INTERVAL_SECONDS = 0.005
+
+# Innermost frames of threads parked on a lock or queue, which are left out of samples
+IDLE_FRAMES = {('threading.py', 'wait'), ('threading.py', '_wait_for_tstate_lock'), ('queue.py', 'get'),
+               ('thread.py', '_worker')}
+
+TOP_FUNCTIONS = 30
+
+_NO_SPAN = contextlib.nullcontext()
+
+
+class Profiler:
+    """Phase timings for one run, with an optional sampling or cProfile pass.
+
+    span() times a named phase in whichever thread or task runs it; nested
+    spans build paths like "transit routing;geocode". Open spans are tracked
+    per context, so coroutines interleaved on one event loop keep separate
+    paths. The folded file written at the end (one "path count" line each,
+    as read by flamegraph.pl and speedscope) has stack samples in sample
+    mode and span self-time in microseconds otherwise. Samples are tagged
+    with the phases last entered on their thread.
+    """
+
+    def __init__(self, mode: str = 'spans'):
+        self.mode = mode
+        self._lock = threading.Lock()
+        # phase -> [count, total seconds, max seconds]
+        self.phases: Dict[str, list] = {}
+        # span path -> self time in seconds
+        self.span_paths: Counter = Counter()
+        # Spans open in the current context, outermost first
+        self._stack: contextvars.ContextVar[Tuple[list, ...]] = contextvars.ContextVar('profiler_spans', default=())
+        # Spans last entered on each thread, for tagging samples
+        self._thread_stacks: Dict[int, Tuple[list, ...]] = {}
+        self.samples: Counter = Counter()
+        self.sample_count = 0
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+        self._stop = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+        self._cprofile: Optional[cProfile.Profile] = None
+
+    @contextlib.contextmanager
+    def span(self, name: str):
+        thread = threading.get_ident()
+        stack = self._stack.get()
+        path = ';'.join([entry[0] for entry in stack] + [name])
+        entry = [name, time.perf_counter(), 0.0]
+        parent = stack[-1] if stack else None
+        self._stack.set(stack + (entry,))
+        self._thread_stacks[thread] = stack + (entry,)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - entry[1]
+            self._stack.set(stack)
+            self._thread_stacks[thread] = stack
+            with self._lock:
+                if parent is not None:
+                    # Children may run in worker threads or tasks, so this can exceed the parent's time
+                    parent[2] += elapsed
+                totals = self.phases.setdefault(name, [0, 0.0, 0.0])
+                totals[0] += 1
+                totals[1] += elapsed
+                totals[2] = max(totals[2], elapsed)
+                self.span_paths[path] += max(elapsed - entry[2], 0.0)
+
+    def start(self) -> None:
+        if self.mode == 'cprofile':
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        elif self.mode == 'sample':
+            self._sampler = threading.Thread(target=self._sample_loop, name='profiler', daemon=True)
+            self._sampler.start()
+
+    def stop(self) -> None:
+        self.elapsed = time.perf_counter() - self.started
+        if self._cprofile is not None:
+            self._cprofile.disable()
+        if self._sampler is not None:
+            self._stop.set()
+            self._sampler.join()
+
+    def _sample_loop(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(SAMPLE_INTERVAL_SECONDS):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                code = frame.f_code
+                if (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+                    continue
+                names = []
+                while frame is not None:
+                    code = frame.f_code
+                    names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                phases = [f"[{entry[0]}]" for entry in self._thread_stacks.get(thread_id, ())]
+                self.samples[';'.join(phases + names[::-1])] += 1
+                self.sample_count += 1
+
+    def report(self, details: bool = True) -> str:
+        """Phase breakdown, plus the hottest functions when sampling or profiling and details is set"""
+        lines = [f"Wall time: {self.elapsed:.2f}s (phase totals are summed over threads and tasks)", '']
+        header = f"{'phase':<24} {'count':>8} {'total s':>10} {'mean ms':>10} {'max ms':>10} {'% wall':>7}"
+        lines += [header, '-' * len(header)]
+        with self._lock:
+            phases = sorted(self.phases.items(), key=lambda item: -item[1][1])
+        for name, (count, total, longest) in phases:
+            share = total / self.elapsed * 100 if self.elapsed else 0
+            lines.append(f"{name:<24} {count:>8} {total:>10.3f} {total / count * 1000:>10.2f} "
+                         f"{longest * 1000:>10.2f} {share:>6.1f}%")
+
+        if details and self.mode == 'sample' and self.sample_count:
+            # Inclusive samples per function, counted once per stack
+            inclusive: Counter = Counter()
+            for stack, count in self.samples.items():
+                for name in set(stack.split(';')):
+                    if not name.startswith('['):
+                        inclusive[name] += count
+            lines += ['', f"Top functions by share of {self.sample_count} samples "
+                          f"({SAMPLE_INTERVAL_SECONDS * 1000:.0f} ms interval):"]
+            for name, count in inclusive.most_common(TOP_FUNCTIONS):
+                lines.append(f"{count / self.sample_count * 100:>6.1f}%  {name}")
+
+        if details and self._cprofile is not None:
+            stream = io.StringIO()
+            pstats.Stats(self._cprofile, stream=stream).sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+            lines += ['', 'cProfile (main thread only), by cumulative time:', stream.getvalue()]
+        return '\n'.join(lines)
+
+    def write(self, prefix: str) -> List[str]:
+        """Write the report, folded stacks and any cProfile stats; returns the paths written"""
+        paths = [f"{prefix}.profile.txt", f"{prefix}.folded"]
+        with open(paths[0], 'w') as f:
+            f.write(self.report() + '\n')
+        with open(paths[1], 'w') as f:
+            if self.mode == 'sample':
+                folded = self.samples.items()
+            else:
+                folded = ((path, round(seconds * 1e6)) for path, seconds in self.span_paths.items())
+            for stack, count in sorted(folded):
+                if count:
+                    f.write(f"{stack} {count}\n")
+        if self._cprofile is not None:
+            paths.append(f"{prefix}.pstats")
+            self._cprofile.dump_stats(paths[-1])
+        return paths
+
+
+_active: Optional[Profiler] = None
+
+
+def phase(name: str):
+    """Time a block as a named phase when profiling is on; a no-op otherwise"""
+    if _active is None:
+        return _NO_SPAN
+    return _active.span(name)
+
+
+def start_profiling(mode: Optional[str]) -> Optional[Profiler]:
+    """Start profiling the process in the given mode, if any"""
+    global _active
+    if not mode:
+        return None
+    _active = Profiler(mode)
+    _active.start()
+    return _active
+
+
+def finish_profiling(prefix: str) -> None:
+    """Stop profiling, print the phase breakdown and write the profile files"""
+    global _active
+    if _active is None:
+        return
+    profiler, _active = _active, None
+    profiler.stop()
+    print("\nProfile:")
+    print(profiler.report(details=False))
+    paths = profiler.write(prefix)
+    print(f"Profile saved to {', '.join(paths)}")
@@ -0,0 +1,236 @@
+import atexit
+import json
+import logging
+import os
+import random
+import threading
+import time
+from datetime import date
+from typing import Dict, Optional
+
+from googlemaps.exceptions import HTTPError, _OverQueryLimit
+
+# Default requests per second for each endpoint. Distance Matrix is limited
+# by elements (60,000 per minute), which is 10 full 100-element requests/sec.
+DEFAULT_QPS = {
+    'geocode': 50,
+    'places_nearby': 50,
+    'directions': 50,
+    'distance_matrix': 10,
+}
+DEFAULT_MAX_CONCURRENCY = 16
+DEFAULT_STATE_PATH = '.api_usage.json'
+
+# Requests between saves of the daily usage count (it is also saved at exit)
+USAGE_SAVE_EVERY = 50
+
+MAX_RETRIES = 5
+BASE_BACKOFF_SECONDS = 1.0
+
+
+class QuotaExhausted(Exception):
+    """Raised when the daily request budget has been used up"""
+
+
+class TokenBucket:
+    """Classic token bucket allowing short bursts up to one second's worth of requests"""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = max(rate, 1.0)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Take a token, sleeping until one is available. Returns seconds waited."""
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(max(self.rate, 1.0), self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class RateLimiter:
+    """Process-wide limiter shared by every Google Maps call.
+
+    Enforces a per-endpoint QPS, a per-day request budget that persists
+    across runs, and a cap on requests in flight. Usage is only saved when
+    a daily budget is set. When Google throttles us
+    the concurrency cap and QPS are halved, then recover gradually.
+    """
+
+    def __init__(self, qps: Optional[Dict[str, float]] = None, daily_budget: Optional[int] = None,
+                 max_concurrency: int = DEFAULT_MAX_CONCURRENCY, state_path: Optional[str] = DEFAULT_STATE_PATH):
+        self.target_qps = dict(DEFAULT_QPS, **(qps or {}))
+        self.buckets = {endpoint: TokenBucket(rate) for endpoint, rate in self.target_qps.items()}
+        self.daily_budget = daily_budget
+        self.max_concurrency = max_concurrency
+        self.concurrency = max_concurrency
+        self.in_flight = 0
+        # Only a daily budget needs usage remembered between runs
+        self.state_path = state_path if daily_budget is not None else None
+        self._unsaved = 0
+        self._save_lock = threading.Lock()
+        self.condition = threading.Condition()
+        self.successes = 0
+        self.throttled_count = 0
+        self.wait_seconds = 0.0
+        self.usage_date, self.calls_today = self._load_usage()
+        if self.state_path:
+            atexit.register(self.save_usage)
+
+    def _load_usage(self):
+        today = date.today().isoformat()
+        if self.state_path and os.path.exists(self.state_path):
+            try:
+                with open(self.state_path) as f:
+                    state = json.load(f)
+                if state.get('date') == today:
+                    return today, state.get('calls', 0)
+            except (OSError, ValueError) as e:
+                logging.warning(f"Could not read API usage from {self.state_path}: {e}")
+        return today, 0
+
+    def save_usage(self) -> None:
+        """Write today's request count to the state file"""
+        if not self.state_path:
+            return
+        with self._save_lock:
+            with self.condition:
+                state = {'date': self.usage_date, 'calls': self.calls_today}
+                self._unsaved = 0
+            try:
+                with open(self.state_path, 'w') as f:
+                    json.dump(state, f)
+            except OSError as e:
+                logging.warning(f"Could not save API usage to {self.state_path}: {e}")
+
+    def acquire(self, endpoint: str) -> None:
+        """Block until a request to endpoint may be sent"""
+        start = time.monotonic()
+        with self.condition:
+            today = date.today().isoformat()
+            if today != self.usage_date:
+                self.usage_date, self.calls_today = today, 0
+            if self.daily_budget is not None and self.calls_today >= self.daily_budget:
+                raise QuotaExhausted(f"Daily budget of {self.daily_budget} API requests used up")
+
+            while self.in_flight >= self.concurrency:
+                self.condition.wait()
+            self.in_flight += 1
+            self.calls_today += 1
+            self._unsaved += 1
+            save = self.state_path is not None and self._unsaved >= USAGE_SAVE_EVERY
+
+        if save:
+            self.save_usage()
+        bucket = self.buckets.get(endpoint)
+        if bucket is not None:
+            bucket.acquire()
+        with self.condition:
+            self.wait_seconds += time.monotonic() - start
+
+    def release(self, throttled: bool = False) -> None:
+        """Return a concurrency slot, adapting limits to whether the request was throttled"""
+        with self.condition:
+            self.in_flight -= 1
+            if throttled:
+                self.throttled_count += 1
+                self.successes = 0
+                self.concurrency = max(1, self.concurrency // 2)
+                for bucket in self.buckets.values():
+                    bucket.rate = max(1.0, bucket.rate / 2)
+                logging.warning(f"Throttled by Google Maps; concurrency lowered to {self.concurrency}")
+            else:
+                self.successes += 1
+                # Additive increase: recover one step every concurrency-worth of successes
+                if self.successes >= self.concurrency:
+                    self.successes = 0
+                    self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+                    for endpoint, bucket in self.buckets.items():
+                        bucket.rate = min(self.target_qps[endpoint], bucket.rate * 1.25)
+            self.condition.notify_all()
+
+
+def is_throttled(error: Exception) -> bool:
+    """Whether an error means Google is rate limiting us"""
+    if isinstance(error, _OverQueryLimit):
+        return True
+    return isinstance(error, HTTPError) and getattr(error, 'status_code', None) == 429
+
+
+def backoff_delay(attempt: int) -> float:
+    """Jittered exponential backoff before retrying a throttled request"""
+    return BASE_BACKOFF_SECONDS * 2 ** attempt * (random.random() + 0.5)
+
+
+class RateLimitedClient:
+    """Wraps a googlemaps.Client so every request goes through a RateLimiter.
+
+    Throttled requests are retried with jittered exponential backoff instead
+    of surfacing as errors.
+    """
+
+    def __init__(self, client, limiter: RateLimiter):
+        self.client = client
+        self.limiter = limiter
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def geocode(self, *args, **kwargs):
+        return self._call('geocode', self.client.geocode, args, kwargs)
+
+    def places_nearby(self, *args, **kwargs):
+        return self._call('places_nearby', self.client.places_nearby, args, kwargs)
+
+    def directions(self, *args, **kwargs):
+        return self._call('directions', self.client.directions, args, kwargs)
+
+    def distance_matrix(self, *args, **kwargs):
+        return self._call('distance_matrix', self.client.distance_matrix, args, kwargs)
+
+    def _call(self, endpoint: str, fn, args, kwargs):
+        for attempt in range(MAX_RETRIES + 1):
+            self.limiter.acquire(endpoint)
+            throttled = False
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                throttled = is_throttled(e)
+                if not throttled or attempt == MAX_RETRIES:
+                    raise
+            finally:
+                self.limiter.release(throttled)
+            delay = backoff_delay(attempt)
+            logging.debug("Retrying %s in %.1fs after throttling", endpoint, delay)
+            time.sleep(delay)
+
+
+_shared_limiter: Optional[RateLimiter] = None
+_shared_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """The limiter shared by every client in this process, configured from the environment"""
+    global _shared_limiter
+    with _shared_limiter_lock:
+        if _shared_limiter is None:
+            qps = {}
+            if os.getenv('API_QPS'):
+                qps = {endpoint: float(os.getenv('API_QPS')) for endpoint in DEFAULT_QPS}
+            budget = os.getenv('API_DAILY_BUDGET')
+            _shared_limiter = RateLimiter(
+                qps=qps,
+                daily_budget=int(budget) if budget else None,
+                max_concurrency=int(os.getenv('API_MAX_CONCURRENCY', DEFAULT_MAX_CONCURRENCY)),
+                state_path=os.getenv('API_USAGE_PATH', DEFAULT_STATE_PATH) or None
+            )
+        return _shared_limiter
@@ -0,0 +1,207 @@
+import argparse
+import csv
+import json
+import logging
+import math
+import os
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+from geo import haversine_matrix, nearest
+
+# Grid cell size in degrees (about 5.5 km north-south)
+CELL_DEG = 0.05
+KM_PER_DEG_LAT = 111.32
+
+# Places searches used to build the index
+SEARCH_RADIUS_METERS = 5000
+PAGE_TOKEN_DELAY_SECONDS = 2
+
+
+class StationIndex:
+    """In-memory grid index of rail stations.
+
+    Stations are stored in the same shape as Places API results (name,
+    vicinity, place_id, geometry.location) so they can stand in for a
+    places_nearby response. Radius and nearest-neighbour queries only look
+    at grid cells near the query point.
+    """
+
+    def __init__(self, stations: Iterable[Dict] = ()):
+        self.stations: List[Dict] = []
+        self._ids = set()
+        self._coords = np.empty((0, 2))
+        self._grid: Dict[Tuple[int, int], List[int]] = {}
+        self.add(stations)
+
+    def __len__(self) -> int:
+        return len(self.stations)
+
+    def add(self, stations: Iterable[Dict]) -> int:
+        """Add stations, skipping ones already indexed. Returns how many were new."""
+        new_coords = []
+        for station in stations:
+            location = station['geometry']['location']
+            station_id = station.get('place_id') or f"{station['name']}@{location['lat']:.5f},{location['lng']:.5f}"
+            if station_id in self._ids:
+                continue
+            self._ids.add(station_id)
+            index = len(self.stations)
+            self.stations.append(station)
+            new_coords.append((location['lat'], location['lng']))
+            self._grid.setdefault(self._cell(location['lat'], location['lng']), []).append(index)
+        if new_coords:
+            self._coords = np.vstack([self._coords, np.asarray(new_coords)])
+        return len(new_coords)
+
+    @staticmethod
+    def _cell(lat: float, lng: float) -> Tuple[int, int]:
+        return int(math.floor(lat / CELL_DEG)), int(math.floor(lng / CELL_DEG))
+
+    def _candidates(self, lat: float, lng: float, radius_km: float) -> np.ndarray:
+        """Indices of stations in grid cells overlapping the query circle's bounding box"""
+        dlat = radius_km / KM_PER_DEG_LAT
+        dlng = radius_km / (KM_PER_DEG_LAT * max(math.cos(math.radians(lat)), 0.01))
+        lat_lo, lng_lo = self._cell(lat - dlat, lng - dlng)
+        lat_hi, lng_hi = self._cell(lat + dlat, lng + dlng)
+        indices = []
+        for i in range(lat_lo, lat_hi + 1):
+            for j in range(lng_lo, lng_hi + 1):
+                indices.extend(self._grid.get((i, j), ()))
+        return np.asarray(indices, dtype=np.int64)
+
+    def within(self, lat: float, lng: float, radius_meters: float) -> List[Dict]:
+        """Stations within radius_meters of a point, closest first"""
+        radius_km = radius_meters / 1000
+        candidates = self._candidates(lat, lng, radius_km)
+        if len(candidates) == 0:
+            return []
+        distances = haversine_matrix([(lat, lng)], self._coords[candidates])[0]
+        order = np.argsort(distances, kind='stable')
+        return [self.stations[candidates[i]] for i in order if distances[i] <= radius_km]
+
+    def nearest(self, lat: float, lng: float, k: int = 1) -> List[Dict]:
+        """The k stations closest to a point"""
+        if not self.stations or k < 1:
+            return []
+        # Widen the search ring until it holds k stations, then fall back to a full scan
+        radius_km = CELL_DEG * KM_PER_DEG_LAT
+        while radius_km < 200:
+            candidates = self._candidates(lat, lng, radius_km)
+            if len(candidates) >= k:
+                indices, distances = nearest([(lat, lng)], self._coords[candidates], k)
+                # Only trust stations inside the searched radius; farther ones may be missing
+                if distances[0, -1] <= radius_km:
+                    return [self.stations[candidates[i]] for i in indices[0]]
+            radius_km *= 2
+        indices, _ = nearest([(lat, lng)], self._coords, k)
+        return [self.stations[i] for i in indices[0]]
+
+    def save(self, path: str) -> None:
+        """Write the indexed stations to a JSON file"""
+        with open(path, 'w') as f:
+            json.dump({'stations': self.stations}, f)
+
+    @classmethod
+    def load(cls, path: str) -> 'StationIndex':
+        """Load an index saved with save(), or a CSV with name, lat, lng (and optional vicinity, place_id) columns"""
+        if path.lower().endswith('.csv'):
+            with open(path, newline='') as f:
+                stations = [
+                    {
+                        'name': row['name'],
+                        'vicinity': row.get('vicinity', ''),
+                        'place_id': row.get('place_id') or None,
+                        'geometry': {'location': {'lat': float(row['lat']), 'lng': float(row['lng'])}},
+                    }
+                    for row in csv.DictReader(f)
+                ]
+        else:
+            with open(path) as f:
+                stations = json.load(f)['stations']
+        return cls(stations)
+
+    @classmethod
+    def build_from_places(cls, client, center: Dict[str, float], radius_km: float) -> 'StationIndex':
+        """Sweep a grid of Places nearby searches covering radius_km around center"""
+        index = cls()
+        # Adjacent search circles overlap so the grid leaves no gaps
+        spacing_km = SEARCH_RADIUS_METERS / 1000 * math.sqrt(2)
+        steps = int(math.ceil(radius_km / spacing_km))
+        km_per_deg_lng = KM_PER_DEG_LAT * math.cos(math.radians(center['lat']))
+
+        for i in range(-steps, steps + 1):
+            for j in range(-steps, steps + 1):
+                if math.hypot(i, j) * spacing_km > radius_km + spacing_km:
+                    continue
+                location = {
+                    'lat': center['lat'] + i * spacing_km / KM_PER_DEG_LAT,
+                    'lng': center['lng'] + j * spacing_km / km_per_deg_lng,
+                }
+                added = index.add(_search_stations(client, location))
+                logging.info(f"Searched around {location['lat']:.4f},{location['lng']:.4f}: {added} new stations")
+
+        return index
+
+
+def _search_stations(client, location: Dict[str, float]) -> List[Dict]:
+    """All pages of train stations around a location"""
+    results = []
+    response = client.places_nearby(
+        location=location,
+        radius=SEARCH_RADIUS_METERS,
+        keyword='train station',
+        type='train_station'
+    )
+    while True:
+        results.extend(response.get('results', []))
+        token = response.get('next_page_token')
+        if not token:
+            return results
+        # Google needs a moment before a page token becomes valid
+        time.sleep(PAGE_TOKEN_DELAY_SECONDS)
+        response = client.places_nearby(page_token=token)
+
+
+def load_station_index(path: Optional[str]) -> Optional[StationIndex]:
+    """Load the station index at path, or None if no index is configured"""
+    if not path:
+        return None
+    if not os.path.exists(path):
+        logging.warning(f"Station index {path} not found; falling back to Places searches")
+        return None
+    index = StationIndex.load(path)
+    logging.info(f"Loaded {len(index)} stations from {path}")
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build a local index of train stations.')
+    parser.add_argument('--around', help='Address to center a Places sweep on')
+    parser.add_argument('--radius-km', type=float, default=40, help='Radius of the Places sweep')
+    parser.add_argument('--from-file', help='CSV (name, lat, lng[, vicinity, place_id]) or JSON station file to import')
+    parser.add_argument('--output', default='stations.json', help='Where to save the index')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    load_dotenv()
+
+    if args.from_file:
+        index = StationIndex.load(args.from_file)
+    elif args.around:
+        from maps_client import create_client
+        client = create_client(os.getenv('GOOGLE_MAPS_API_KEY'))
+        center = client.geocode(args.around)[0]['geometry']['location']
+        index = StationIndex.build_from_places(client, center, args.radius_km)
+    else:
+        parser.error('Either --around or --from-file is required')
+
+    index.save(args.output)
+    print(f"Saved {len(index)} stations to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
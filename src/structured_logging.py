@@ -0,0 +1,54 @@
+import atexit
+import json
+import logging
+import queue
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import List
+
+# Context passed through `extra=` that JsonFormatter writes as top-level fields
+STRUCTURED_FIELDS = ('address', 'station', 'phase', 'duration')
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with any structured fields the record carries"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        for field in STRUCTURED_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = round(value, 4) if isinstance(value, float) else value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class DeferredQueueHandler(QueueHandler):
+    """QueueHandler that leaves all formatting to the listener thread.
+
+    The standard QueueHandler merges the message and its arguments before
+    enqueueing so records can cross process boundaries. Records here stay in
+    the process, so the caller only pays for creating the record.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def start_queue_logging(handlers: List[logging.Handler], level: int) -> DeferredQueueHandler:
+    """Feed handlers from a background thread and return the handler that enqueues for them"""
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.setLevel(level)
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    # Flush whatever is still queued when the process exits
+    atexit.register(listener.stop)
+    return queue_handler
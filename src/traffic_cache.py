@@ -0,0 +1,155 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from api_cache import DAY, TRAFFIC_BUCKET_MINUTES
+
+DEFAULT_TRAFFIC_CACHE_PATH = '.traffic_cache.sqlite'
+DEFAULT_MAX_AGE_DAYS = 14
+
+# Kinds of observation: the single best route (Distance Matrix or one
+# directions route), or min/avg/max over alternative routes
+BEST_ROUTE = 'best'
+ROUTE_RANGE = 'range'
+
+# Pairs looked up per query, within SQLite's default limit on bound parameters
+LOOKUP_BATCH = 400
+
+
+def departure_slot(departure_time: datetime) -> Tuple[str, int]:
+    """Quantize a departure time to (weekday/weekend, minute of day rounded down to the bucket)"""
+    day_type = 'weekend' if departure_time.weekday() > 4 else 'weekday'
+    minutes = departure_time.hour * 60 + departure_time.minute
+    return day_type, minutes - minutes % TRAFFIC_BUCKET_MINUTES
+
+
+def _place(value: str) -> str:
+    return ' '.join(value.split()).lower()
+
+
+class TrafficCache:
+    """Observed traffic-aware drive times per origin/destination and departure slot.
+
+    The response cache only helps when a request is repeated exactly. This
+    cache stores each pair's durations on its own, so a pair seen in any
+    earlier matrix batch or directions call answers later queries for the
+    same weekday type and 15-minute slot until the observation is older
+    than max_age_days.
+    """
+
+    def __init__(self, path: str = DEFAULT_TRAFFIC_CACHE_PATH, max_age_days: float = DEFAULT_MAX_AGE_DAYS):
+        self.path = path
+        self.max_age = max_age_days * DAY
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS drive_times (
+                origin TEXT NOT NULL,
+                destination TEXT NOT NULL,
+                day_type TEXT NOT NULL,
+                slot INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                observation TEXT NOT NULL,
+                observed_at REAL NOT NULL,
+                PRIMARY KEY (origin, destination, day_type, slot, kind)
+            )
+        """)
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, origin: str, destination: str, departure_time: datetime,
+            kind: str = BEST_ROUTE) -> Optional[Tuple[float, ...]]:
+        """The stored observation for a pair and departure slot, or None if missing or stale"""
+        return self.get_many([(origin, destination)], departure_time, kind).get((origin, destination))
+
+    def get_many(self, pairs: Iterable[Tuple[str, str]], departure_time: datetime,
+                 kind: str = BEST_ROUTE) -> Dict[Tuple[str, str], Tuple[float, ...]]:
+        """Fresh observations for the pairs that have one, looked up a batch of pairs per query"""
+        day_type, slot = departure_slot(departure_time)
+        by_place: Dict[Tuple[str, str], List[Tuple[str, str]]] = {}
+        for pair in dict.fromkeys(pairs):
+            by_place.setdefault((_place(pair[0]), _place(pair[1])), []).append(pair)
+        places = list(by_place)
+
+        rows = []
+        with self._lock:
+            for start in range(0, len(places), LOOKUP_BATCH):
+                batch = places[start:start + LOOKUP_BATCH]
+                rows += self._conn.execute(
+                    "SELECT origin, destination, observation, observed_at FROM drive_times "
+                    "WHERE day_type = ? AND slot = ? AND kind = ? AND (origin, destination) IN "
+                    f"(VALUES {', '.join(['(?, ?)'] * len(batch))})",
+                    [day_type, slot, kind] + [value for place in batch for value in place]
+                ).fetchall()
+
+        cutoff = time.time() - self.max_age
+        found = {}
+        for origin, destination, observation, observed_at in rows:
+            if observed_at >= cutoff:
+                for pair in by_place[(origin, destination)]:
+                    found[pair] = tuple(json.loads(observation))
+        self.hits += len(found)
+        self.misses += sum(len(requested) for requested in by_place.values()) - len(found)
+        return found
+
+    def put(self, origin: str, destination: str, departure_time: datetime,
+            observation: Sequence[float], kind: str = BEST_ROUTE) -> None:
+        """Record an observation, replacing any older one for the same slot"""
+        self.put_many({(origin, destination): observation}, departure_time, kind)
+
+    def put_many(self, observations: Dict[Tuple[str, str], Sequence[float]], departure_time: datetime,
+                 kind: str = BEST_ROUTE) -> None:
+        """Record observations for many pairs in a single transaction"""
+        if not observations:
+            return
+        day_type, slot = departure_slot(departure_time)
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO drive_times "
+                "(origin, destination, day_type, slot, kind, observation, observed_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (_place(origin), _place(destination), day_type, slot, kind,
+                     json.dumps([float(v) for v in observation]), now)
+                    for (origin, destination), observation in observations.items()
+                ]
+            )
+            self._conn.commit()
+
+    def split(self, pairs: Iterable[Tuple[str, str]], departure_time: datetime,
+              kind: str = BEST_ROUTE) -> Tuple[Dict[Tuple[str, str], Tuple[float, ...]], List[Tuple[str, str]]]:
+        """Separate pairs answered from the cache from those that still need a request"""
+        pairs = list(dict.fromkeys(pairs))
+        found = self.get_many(pairs, departure_time, kind)
+        missing = [pair for pair in pairs if pair not in found]
+        if found:
+            logging.debug("Answered %d drive times from the traffic cache", len(found))
+        return found, missing
+
+
+_shared_cache: Optional[TrafficCache] = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_traffic_cache() -> Optional[TrafficCache]:
+    """The traffic cache shared by every caller in this process, or None if disabled.
+
+    Configured from TRAFFIC_CACHE_PATH (empty to disable) and
+    TRAFFIC_CACHE_MAX_AGE_DAYS.
+    """
+    global _shared_cache
+    path = os.getenv('TRAFFIC_CACHE_PATH', DEFAULT_TRAFFIC_CACHE_PATH)
+    if not path:
+        return None
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = TrafficCache(
+                path, float(os.getenv('TRAFFIC_CACHE_MAX_AGE_DAYS', DEFAULT_MAX_AGE_DAYS))
+            )
+        return _shared_cache
@@ -1,17 +1,60 @@
 import os
 from datetime import datetime, timedelta
+import numpy as np
 import pandas as pd
 from dotenv import load_dotenv
-import googlemaps
 import pytz
 from typing import Dict, List, Tuple, Optional
 import argparse
+import asyncio
+import contextvars
 import logging
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
+from itertools import islice
+from maps_client import create_client
+from api_cache import CachedClient, TRAFFIC_BUCKET_MINUTES as DEPARTURE_BUCKET_MINUTES
+from distance_matrix import batch_distance_matrix, batch_distance_matrix_async, element_minutes, element_miles
+from async_maps_client import AsyncMapsClient
+from rate_limiter import QuotaExhausted
+from geo import KM_PER_MILE, haversine_matrix, haversine_pairs
+from station_index import load_station_index
+from gtfs_router import load_router
+from traffic_cache import get_traffic_cache
+from checkpoint import EVENING, MORNING, CheckpointStore, CompletedKeys
+from address_stream import CsvAppender, read_address_chunks, read_row_keys
+from api_metrics import calls_from, report_metrics, track_caller
+from metrics_exporter import get_progress, start_metrics_server
+from cost_ledger import get_cost_ledger, report_costs
+from structured_logging import JsonFormatter, start_queue_logging
+from profiling import PROFILE_MODES, finish_profiling, phase, start_profiling
 
 # Load environment variables
 load_dotenv()
 
+# Rail lines that reach Penn Medicine
+VALID_RAIL_LINES = [
+    'Paoli/Thorndale Line',
+    'Media/Wawa Line',
+    'Airport Line',
+    'Wilmington/Newark Line'
+]
+
+# Typical straight-line speeds used to estimate a station's total commute
+# before any routing call is made
+DRIVE_SPEED_KMH = 40
+RAIL_SPEED_KMH = 45
+
+# Directions parameters for station <-> destination rail legs
+TRANSIT_PARAMS = {
+    'mode': "transit",
+    'alternatives': True,
+    'transit_mode': ["rail"]
+}
+
 @dataclass
 class TransitConfig:
     """Configuration for transit analysis"""
@@ -21,6 +64,10 @@ class TransitConfig:
     fallback_stations: List[str]
     morning_arrival: str  # Format: "HH:MM"
     evening_arrival: str  # Format: "HH:MM"
+    max_stations: int = 3  # Route only the closest K stations per address (0 for all)
+    station_slack: float = 1.5  # Skip stations estimated slower than this multiple of the best
+    station_index_path: str = ''  # Local station index used instead of Places searches
+    gtfs_feed_path: str = ''  # GTFS feed routed offline instead of transit directions
     
     @classmethod
     def from_env(cls) -> 'TransitConfig':
@@ -36,6 +83,10 @@ class TransitConfig:
         fallback_stations_str = os.getenv('FALLBACK_STATIONS', '')
         morning_arrival = os.getenv('MORNING_ARRIVAL', '09:00')
         evening_arrival = os.getenv('EVENING_ARRIVAL', '17:30')
+        max_stations = int(os.getenv('MAX_STATIONS', '3'))
+        station_slack = float(os.getenv('STATION_SLACK', '1.5'))
+        station_index_path = os.getenv('STATION_INDEX_PATH', '')
+        gtfs_feed_path = os.getenv('GTFS_FEED_PATH', '')
         
         # Validate time formats
         for time_str in [morning_arrival, evening_arrival]:
@@ -50,16 +101,27 @@ class TransitConfig:
             final_destination=final_destination,
             fallback_stations=fallback_stations_str.split(',') if fallback_stations_str else [],
             morning_arrival=morning_arrival,
-            evening_arrival=evening_arrival
+            evening_arrival=evening_arrival,
+            max_stations=max_stations,
+            station_slack=station_slack,
+            station_index_path=station_index_path,
+            gtfs_feed_path=gtfs_feed_path
         )
 
-def setup_logging(verbose: bool, debug: bool) -> None:
-    """Configure logging based on verbosity and debug flags"""
-    # Set up file handler (always at DEBUG level for troubleshooting)
-    file_handler = logging.FileHandler('route_details.log')
-    file_handler.setLevel(logging.DEBUG)
-    file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-    
+DEFAULT_LOG_FILE = 'route_details.log'
+DEFAULT_LOG_MAX_MB = 50
+DEFAULT_LOG_BACKUPS = 3
+
+def setup_logging(verbose: bool, debug: bool) -> Optional[str]:
+    """Configure logging based on verbosity and debug flags.
+
+    The log file (LOG_FILE, empty to disable) is written from a background
+    thread and rotated every LOG_MAX_MB, keeping LOG_BACKUPS old files.
+    LOG_FILE_LEVEL picks what it records (DEBUG by default) and
+    LOG_FORMAT=json writes one JSON object per line. Records below every
+    handler's level are never created, so with LOG_FILE_LEVEL=INFO debug
+    logging costs nothing. Returns the log file path, if any.
+    """
     # Set up console handler (level based on flags)
     console_handler = logging.StreamHandler()
     if debug:
@@ -69,60 +131,99 @@ def setup_logging(verbose: bool, debug: bool) -> None:
     else:
         console_handler.setLevel(logging.WARNING)
     console_handler.setFormatter(logging.Formatter('%(message)s'))
+    handlers = [console_handler]
+    
+    # Set up file handler, fed through a queue so callers never wait on disk
+    log_file = os.getenv('LOG_FILE', DEFAULT_LOG_FILE)
+    if log_file:
+        file_level = logging.getLevelName(os.getenv('LOG_FILE_LEVEL', 'DEBUG').upper())
+        file_handler = RotatingFileHandler(
+            log_file,
+            maxBytes=int(float(os.getenv('LOG_MAX_MB', DEFAULT_LOG_MAX_MB)) * 1024 * 1024),
+            backupCount=int(os.getenv('LOG_BACKUPS', DEFAULT_LOG_BACKUPS))
+        )
+        file_handler.setLevel(file_level)
+        if os.getenv('LOG_FORMAT', 'text').lower() == 'json':
+            file_handler.setFormatter(JsonFormatter())
+        else:
+            file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+        handlers.append(start_queue_logging([file_handler], file_level))
     
     # Configure root logger
     root_logger = logging.getLogger()
-    root_logger.setLevel(logging.DEBUG)  # Capture everything, let handlers filter
+    root_logger.setLevel(min(handler.level for handler in handlers))  # Skip records no handler wants
     root_logger.handlers = []  # Clear any existing handlers
-    root_logger.addHandler(file_handler)
-    root_logger.addHandler(console_handler)
+    for handler in handlers:
+        root_logger.addHandler(handler)
+    return log_file or None
 
 class TransitAnalyzer:
-    def __init__(self, config: TransitConfig):
+    def __init__(self, config: TransitConfig, workers: int = 1):
         self.config = config
-        self.gmaps = googlemaps.Client(key=config.google_maps_key)
+        self.gmaps = create_client(config.google_maps_key, pool_size=workers)
         self.eastern = pytz.timezone('America/New_York')
+        # Station -> destination legs don't depend on the home address, so
+        # they are computed once per station and shared across addresses
+        self.station_legs: Dict[Tuple[str, bool, str], Optional[Dict]] = {}
+        self._station_legs_lock = threading.Lock()
+        self._station_leg_locks: Dict[Tuple[str, bool, str], threading.Lock] = {}
+        self._pending_legs: Dict[Tuple[str, bool, str], asyncio.Future] = {}
+        # Workers resolving the destination together wait for one geocode
+        self._destination_lock = threading.Lock()
+        # Geocoded (lat, lng) of addresses, used to prune stations before routing
+        self.locations: Dict[str, Tuple[float, float]] = {}
+        # When configured, station lookups are local queries instead of Places searches
+        self.station_index = load_station_index(config.station_index_path)
+        # When configured, rail legs are routed offline instead of through transit directions
+        self.router = load_router(config.gtfs_feed_path, VALID_RAIL_LINES)
+        # Drive times observed in earlier runs, per pair and departure slot
+        self.traffic = get_traffic_cache()
+        # Prices requests; near the end of the run's budget fewer are made per address
+        self.ledger = get_cost_ledger()
+        # Bounded pool for network calls; results always come back in input order
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+
+    def map(self, fn, items) -> List:
+        """Apply fn to each item, concurrently when a worker pool is configured"""
+        if self.executor is None:
+            return list(map(fn, items))
+        # Worker threads run in a copy of the caller's context so API metrics keep the caller
+        context = contextvars.copy_context()
+        return list(self.executor.map(lambda item: context.copy().run(fn, item), items))
     
+    @track_caller
     def find_nearby_stations(self, address: str, radius_meters: int = 3000) -> List[Dict]:
         """Find train stations near an address"""
+        start = time.perf_counter()
         try:
-            location = self.gmaps.geocode(address)[0]['geometry']['location']
+            with phase('geocode'):
+                location = self.gmaps.geocode(address)[0]['geometry']['location']
+            self.locations[address] = (location['lat'], location['lng'])
             
-            stations = self.gmaps.places_nearby(
-                location=location,
-                radius=radius_meters,
-                keyword='train station',
-                type='train_station'
-            )
+            with phase('station search'):
+                if self.station_index is not None:
+                    stations = self.station_index.within(location['lat'], location['lng'], radius_meters)
+                else:
+                    stations = self.gmaps.places_nearby(
+                        location=location,
+                        radius=radius_meters,
+                        keyword='train station',
+                        type='train_station'
+                    ).get('results', [])
             
-            logging.info(f"\nFound stations near {address}:")
-            for station in stations.get('results', []):
-                logging.info(f"- {station['name']} ({station['vicinity']})")
+            logging.info("Found %d stations near %s:", len(stations), address,
+                         extra={'address': address, 'phase': 'stations', 'duration': time.perf_counter() - start})
+            for station in stations:
+                logging.info("- %s (%s)", station['name'], station['vicinity'])
                 
-            return stations.get('results', [])
+            return stations
+        except QuotaExhausted:
+            raise
         except Exception as e:
             logging.error(f"Error finding stations near {address}: {e}")
             return []
     
-    def get_drive_time_to_station(self, home: str, station: Dict, departure_time: datetime) -> Tuple[Optional[float], Optional[float]]:
-        """Get driving time to station"""
-        try:
-            result = self.gmaps.directions(
-                home,
-                f"{station['geometry']['location']['lat']},{station['geometry']['location']['lng']}",
-                mode="driving",
-                departure_time=departure_time
-            )
-            
-            if result:
-                duration_mins = result[0]['legs'][0]['duration_in_traffic']['value'] / 60
-                distance_miles = result[0]['legs'][0]['distance']['value'] / 1609.34
-                return duration_mins, distance_miles
-            return None, None
-        except Exception as e:
-            logging.error(f"Error getting drive time to station: {e}")
-            return None, None
-
     def get_walking_details(self, route: Dict) -> Tuple[float, float]:
         """Extract final walking segment details from route"""
         try:
@@ -142,225 +243,839 @@ class TransitAnalyzer:
             final_walk_time = 0
             final_walk_distance = 0
             
-            logging.debug(f"Processing steps after final transit (index {last_transit_index})")
+            logging.debug("Processing steps after final transit (index %d)", last_transit_index)
             for step in steps[last_transit_index + 1:]:
                 if step['travel_mode'] == 'WALKING':
                     duration_mins = step['duration']['value'] / 60
                     distance_miles = step['distance']['value'] / 1609.34
                     final_walk_time += duration_mins
                     final_walk_distance += distance_miles
-                    logging.debug(f"Final walking segment:")
-                    logging.debug(f"  Duration: {duration_mins:.1f} min")
-                    logging.debug(f"  Distance: {distance_miles:.2f} miles")
-                    logging.debug(f"  Instructions: {step.get('html_instructions', 'No instructions')}")
+                    logging.debug("Final walking segment: %.1f min, %.2f miles, %s",
+                                  duration_mins, distance_miles, step.get('html_instructions', 'No instructions'))
             
-            logging.debug(f"Total final walk: {final_walk_time:.1f} min, distance: {final_walk_distance:.2f} miles")
+            logging.debug("Total final walk: %.1f min, distance: %.2f miles", final_walk_time, final_walk_distance)
             return final_walk_time, final_walk_distance
             
         except Exception as e:
-            logging.error(f"Error getting walking details: {e}")
-            logging.error(f"Route structure: {route.keys()}")
+            logging.error("Error getting walking details: %s", e)
+            logging.error("Route structure: %s", list(route.keys()))
             return 0.0, 0.0
 
+    def transit_endpoints(self, station: Dict, destination: str) -> Tuple[str, str]:
+        """Work out the origin and destination of a station's transit leg"""
+        station_location = self.station_location(station)
+        
+        # For evening commute, swap origin and destination
+        if destination == station_location:  # Evening commute
+            origin = self.config.final_destination
+            dest = station_location
+            logging.debug("Analyzing evening route from %s to %s", origin, dest)
+        else:  # Morning commute
+            origin = station_location
+            dest = destination
+            logging.debug("Analyzing morning route from %s to %s", origin, dest)
+        return origin, dest
+
+    @track_caller
     def get_transit_details(self, station: Dict, arrival_time: datetime, destination: str) -> Optional[Dict]:
         """Get transit journey details from station to destination"""
+        if self.router is not None:
+            return self.get_transit_details_offline(station, arrival_time, destination)
         try:
-            station_location = f"{station['geometry']['location']['lat']},{station['geometry']['location']['lng']}"
-            
-            # For evening commute, swap origin and destination
-            if destination == station_location:  # Evening commute
-                origin = self.config.final_destination
-                dest = station_location
-                logging.debug(f"\nAnalyzing evening route from {origin} to {dest}")
-            else:  # Morning commute
-                origin = station_location
-                dest = destination
-                logging.debug(f"\nAnalyzing morning route from {origin} to {dest}")
+            origin, dest = self.transit_endpoints(station, destination)
             
+            start = time.perf_counter()
             result = self.gmaps.directions(
                 origin,
                 dest,
-                mode="transit",
                 arrival_time=arrival_time,
-                alternatives=True,
-                transit_mode=["rail"]
+                **TRANSIT_PARAMS
             )
+            logging.debug("Transit directions for %s returned %d routes", station['name'], len(result or []),
+                          extra={'station': station['name'], 'phase': 'transit',
+                                 'duration': time.perf_counter() - start})
             
-            if not result:
-                logging.debug(f"No routes found")
-                return None
-
-            valid_routes = []
-            for i, route in enumerate(result):
-                steps = route['legs'][0]['steps']
-                logging.debug(f"\nRoute {i+1}:")
-                
-                # Log each step in the route
-                has_valid_rail = False
-                for step in steps:
-                    if step['travel_mode'] == 'TRANSIT':
-                        transit_details = step.get('transit_details', {})
-                        line = transit_details.get('line', {}).get('name', 'Unknown')
-                        vehicle = transit_details.get('line', {}).get('vehicle', {}).get('name', 'Unknown')
-                        departure = transit_details.get('departure_stop', {}).get('name', 'Unknown')
-                        arrival = transit_details.get('arrival_stop', {}).get('name', 'Unknown')
-                        logging.debug(f"  Transit: {line} ({vehicle}) from {departure} to {arrival}")
-                        
-                        # Check if this is a valid rail line for Penn Medicine
-                        if any(valid_line in line for valid_line in [
-                            'Paoli/Thorndale Line',
-                            'Media/Wawa Line',
-                            'Airport Line',
-                            'Wilmington/Newark Line'
-                        ]):
-                            has_valid_rail = True
-                    elif step['travel_mode'] == 'WALKING':
-                        distance = step['distance']['value']
-                        duration = step['duration']['value'] / 60
-                        logging.debug(f"  Walk: {distance}m ({duration:.1f} min)")
-                
-                if not has_valid_rail:
-                    logging.debug("  Rejected: No valid rail connection to Penn Medicine")
-                    continue
-                    
-                # Get all steps by type
-                transit_steps = [step for step in steps if step['travel_mode'] == 'TRANSIT']
-                walking_steps = [step for step in steps if step['travel_mode'] == 'WALKING']
-                
-                # Calculate times
-                transit_time = sum(step['duration']['value'] / 60 for step in transit_steps)
-                final_walk = walking_steps[-1] if walking_steps else None
-                walk_time = final_walk['duration']['value'] / 60 if final_walk else 0
-                walk_distance = final_walk['distance']['value'] / 1609.34 if final_walk else 0
-                
-                logging.debug(f"  Valid route found: {transit_time:.1f} min transit + {walk_time:.1f} min walk")
-                valid_routes.append({
-                    'route': route['legs'][0],
-                    'transfers': len(transit_steps) - 1,
-                    'duration_mins': transit_time,
-                    'walk_time_mins': walk_time,
-                    'walk_distance_miles': walk_distance,
-                    'arrival_time': route['legs'][0]['arrival_time']['text'],
-                    'departure_time': route['legs'][0]['departure_time']['text'],
-                    'destination_station': transit_steps[-1]['transit_details']['arrival_stop']['name']
-                })
+            return self.select_transit_route(result)
+        except QuotaExhausted:
+            raise
+        except Exception as e:
+            logging.error(f"Error getting transit details: {e}")
+            return None
 
-            if valid_routes:
-                best_route = min(valid_routes, key=lambda x: x['duration_mins'] + x['walk_time_mins'])
-                logging.debug(f"\nSelected best route: {best_route['duration_mins']:.1f} min transit + {best_route['walk_time_mins']:.1f} min walk")
-                return best_route
-                
+    def get_transit_details_offline(self, station: Dict, arrival_time: datetime, destination: str) -> Optional[Dict]:
+        """Route a station's transit leg with the GTFS router instead of the Directions API"""
+        office = self.destination_location()
+        if office is None:
             return None
+        station_point = (station['geometry']['location']['lat'], station['geometry']['location']['lng'])
+        
+        # Same orientation as transit_endpoints: evening legs run office -> station
+        if destination == self.station_location(station):
+            origin, dest = office, station_point
+        else:
+            origin, dest = station_point, office
+        
+        try:
+            route = self.router.route(origin, dest, arrival_time)
         except Exception as e:
-            logging.error(f"Error getting transit details: {e}")
+            logging.error(f"Error routing {station['name']} offline: {e}")
             return None
+        # The router only loads VALID_RAIL_LINES, so every route it returns qualifies
+        return self.select_transit_route([route] if route else [], valid_lines=None)
 
-    def calculate_distance(self, point1: Tuple[float, float], point2: Tuple[float, float]) -> float:
-        """Calculate distance between two lat/lng points in kilometers"""
-        from math import sin, cos, sqrt, atan2, radians
+    def select_transit_route(self, result: List[Dict], valid_lines: Optional[List[str]] = VALID_RAIL_LINES) -> Optional[Dict]:
+        """Pick the fastest route on a valid rail line from a transit directions response"""
+        if not result:
+            logging.debug("No routes found")
+            return None
+
+        # Step-by-step details are only worth extracting when someone records them
+        debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+        valid_routes = []
+        for i, route in enumerate(result):
+            steps = route['legs'][0]['steps']
+            if debug:
+                logging.debug("Route %d:", i + 1)
+            
+            has_valid_rail = False
+            for step in steps:
+                if step['travel_mode'] == 'TRANSIT':
+                    transit_details = step.get('transit_details', {})
+                    line = transit_details.get('line', {}).get('name', 'Unknown')
+                    if debug:
+                        logging.debug("  Transit: %s (%s) from %s to %s", line,
+                                      transit_details.get('line', {}).get('vehicle', {}).get('name', 'Unknown'),
+                                      transit_details.get('departure_stop', {}).get('name', 'Unknown'),
+                                      transit_details.get('arrival_stop', {}).get('name', 'Unknown'))
+                    
+                    # Check if this is a valid rail line for Penn Medicine
+                    if valid_lines is None or any(valid_line in line for valid_line in valid_lines):
+                        has_valid_rail = True
+                elif debug and step['travel_mode'] == 'WALKING':
+                    logging.debug("  Walk: %dm (%.1f min)", step['distance']['value'], step['duration']['value'] / 60)
+            
+            if not has_valid_rail:
+                logging.debug("  Rejected: No valid rail connection to Penn Medicine")
+                continue
+                
+            # Get all steps by type
+            transit_steps = [step for step in steps if step['travel_mode'] == 'TRANSIT']
+            walking_steps = [step for step in steps if step['travel_mode'] == 'WALKING']
+            
+            # Calculate times
+            transit_time = sum(step['duration']['value'] / 60 for step in transit_steps)
+            final_walk = walking_steps[-1] if walking_steps else None
+            walk_time = final_walk['duration']['value'] / 60 if final_walk else 0
+            walk_distance = final_walk['distance']['value'] / 1609.34 if final_walk else 0
+            
+            logging.debug("  Valid route found: %.1f min transit + %.1f min walk", transit_time, walk_time)
+            valid_routes.append({
+                'route': route['legs'][0],
+                'transfers': len(transit_steps) - 1,
+                'duration_mins': transit_time,
+                'walk_time_mins': walk_time,
+                'walk_distance_miles': walk_distance,
+                'arrival_time': route['legs'][0]['arrival_time']['text'],
+                'departure_time': route['legs'][0]['departure_time']['text'],
+                'destination_station': transit_steps[-1]['transit_details']['arrival_stop']['name'],
+                'polyline': route.get('overview_polyline', {}).get('points')
+            })
+
+        if valid_routes:
+            best_route = min(valid_routes, key=lambda x: x['duration_mins'] + x['walk_time_mins'])
+            logging.debug("Selected best route: %.1f min transit + %.1f min walk",
+                          best_route['duration_mins'], best_route['walk_time_mins'])
+            return best_route
+            
+        return None
+
+    def get_station_leg(self, station: Dict, arrival_time: datetime, destination: str, is_morning: bool) -> Optional[Dict]:
+        """Get the transit leg for a station, reusing earlier results for the same station"""
+        key = self.station_leg_key(station, arrival_time, is_morning)
         
-        R = 6371  # Earth's radius in kilometers
+        # Hold a per-station lock so concurrent addresses wait for one request
+        with self._station_legs_lock:
+            key_lock = self._station_leg_locks.setdefault(key, threading.Lock())
         
-        lat1, lon1 = radians(point1[0]), radians(point1[1])
-        lat2, lon2 = radians(point2[0]), radians(point2[1])
+        with key_lock:
+            if key in self.station_legs:
+                logging.debug("Reusing transit leg for %s", station['name'])
+                return self.station_legs[key]
+            
+            with phase('transit routing'):
+                transit_details = self.get_transit_details(station, arrival_time, destination)
+            self.station_legs[key] = transit_details
+            return transit_details
+
+    def station_leg_key(self, station: Dict, arrival_time: datetime, is_morning: bool) -> Tuple[str, bool, str]:
+        """Key identifying a station's transit leg in the station_legs table"""
+        return (station.get('place_id', self.station_location(station)), is_morning, arrival_time.isoformat())
+
+    @track_caller
+    def destination_location(self) -> Optional[Tuple[float, float]]:
+        """Geocode the final destination once per run"""
+        destination = self.config.final_destination
+        if destination in self.locations:
+            return self.locations[destination]
+        with self._destination_lock:
+            if destination not in self.locations:
+                try:
+                    location = self.gmaps.geocode(destination)[0]['geometry']['location']
+                    self.locations[destination] = (location['lat'], location['lng'])
+                except QuotaExhausted:
+                    raise
+                except Exception as e:
+                    logging.error(f"Error geocoding destination {destination}: {e}")
+                    return None
+            return self.locations[destination]
+
+    @track_caller
+    async def destination_location_async(self, client: AsyncMapsClient) -> Optional[Tuple[float, float]]:
+        """Async version of destination_location"""
+        destination = self.config.final_destination
+        if destination not in self.locations:
+            try:
+                location = (await client.geocode(destination))[0]['geometry']['location']
+                self.locations[destination] = (location['lat'], location['lng'])
+            except QuotaExhausted:
+                raise
+            except Exception as e:
+                logging.error(f"Error geocoding destination {destination}: {e}")
+                return None
+        return self.locations[destination]
+
+    def prune_stations(self, home_address: str, stations: List[Dict],
+                       destination: Optional[Tuple[float, float]]) -> List[Dict]:
+        """Keep only the stations worth routing through.
+
+        Each station's commute is estimated from straight-line distances
+        (home -> station by car, station -> destination by rail). Stations
+        estimated slower than station_slack times the best estimate are
+        dropped, and at most max_stations of the rest are kept (only the
+        best one once most of the run's budget is spent).
+        """
+        home = self.locations.get(home_address)
+        if home is None or destination is None or len(stations) <= 1:
+            return stations
         
-        dlat = lat2 - lat1
-        dlon = lon2 - lon1
+        locations = [(station['geometry']['location']['lat'], station['geometry']['location']['lng']) for station in stations]
+        distances = haversine_matrix([home, destination], locations)
+        estimates = distances[0] / DRIVE_SPEED_KMH * 60 + distances[1] / RAIL_SPEED_KMH * 60
+        order = np.argsort(estimates, kind='stable')
         
-        a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-        c = 2 * atan2(sqrt(a), sqrt(1-a))
+        best = estimates[order[0]]
+        kept = [stations[i] for i in order if estimates[i] <= best * self.config.station_slack]
+        max_stations = 1 if self.ledger.degraded else self.config.max_stations
+        if max_stations > 0:
+            kept = kept[:max_stations]
         
-        return R * c
+        if len(kept) < len(stations):
+            logging.debug("Routing %d of %d stations near %s: %s", len(kept), len(stations), home_address,
+                          ', '.join(station['name'] for station in kept))
+        return kept
 
-    def analyze_commute(self, home_address: str, is_morning: bool = True, verbose: bool = False) -> Optional[Dict]:
-        """Analyze complete commute including drive to station and transit"""
-        next_weekday = datetime.now(self.eastern).date() + timedelta(days=1)
+    def calculate_distance(self, point1: Tuple[float, float], point2: Tuple[float, float]) -> float:
+        """Calculate distance between two lat/lng points in kilometers"""
+        return float(haversine_pairs([point1], [point2])[0])
+
+    @track_caller
+    def get_drive_times(self, requests: List[Tuple[str, Dict, datetime]]) -> Dict[Tuple[str, str, datetime], Tuple[float, float]]:
+        """Get driving times from homes to stations in batched Distance Matrix calls.
+
+        Requests are (home, station, departure_time) tuples. Departure times
+        are grouped into buckets so that each bucket needs only a handful of
+        matrix requests. Results are keyed on (home, station location, bucket).
+        """
+        drive_times = {}
+        for bucket, pairs in self.group_drive_requests(requests).items():
+            pairs = self.cached_drive_times(drive_times, bucket, pairs)
+            start = time.perf_counter()
+            elements = batch_distance_matrix(self.gmaps, pairs, map_fn=self.map, mode="driving", departure_time=bucket)
+            logging.debug("Fetched %d drive times departing around %s", len(pairs), bucket,
+                          extra={'phase': 'drive', 'duration': time.perf_counter() - start})
+            self.add_drive_times(drive_times, bucket, elements)
+            self.remember_drive_times(bucket, elements)
+        self.check_drive_times(drive_times)
+        return drive_times
+
+    def cached_drive_times(self, drive_times: Dict, bucket: datetime, pairs: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+        """Fill drive_times from the traffic cache, returning the pairs that still need a request"""
+        if self.traffic is None:
+            return pairs
+        found, missing = self.traffic.split(pairs, bucket)
+        for (home, station_location), drive in found.items():
+            drive_times[(home, station_location, bucket)] = drive
+        return missing
+
+    def remember_drive_times(self, bucket: datetime, elements: Dict[Tuple[str, str], Optional[Dict]]) -> None:
+        """Save fetched drive times in the traffic cache for later runs"""
+        if self.traffic is None:
+            return
+        self.traffic.put_many({
+            pair: (element_minutes(element), element_miles(element))
+            for pair, element in elements.items()
+            if element is not None
+        }, bucket)
+
+    @staticmethod
+    def add_drive_times(drive_times: Dict, bucket: datetime, elements: Dict[Tuple[str, str], Optional[Dict]]) -> None:
+        """Record the (minutes, miles) of each successful matrix element under its departure bucket"""
+        for (home, station_location), element in elements.items():
+            if element is not None:
+                drive_times[(home, station_location, bucket)] = (element_minutes(element), element_miles(element))
+
+    def check_drive_times(self, drive_times: Dict[Tuple[str, str, datetime], Tuple[float, float]]) -> None:
+        """Warn about drives shorter than the straight-line distance, which point to a bad geocode"""
+        keys = [key for key in drive_times if key[0] in self.locations]
+        if not keys:
+            return
+        
+        homes = [self.locations[home] for home, _, _ in keys]
+        stations = [tuple(map(float, station_location.split(','))) for _, station_location, _ in keys]
+        straight_miles = haversine_pairs(homes, stations) / KM_PER_MILE
+        drive_miles = np.array([drive_times[key][1] for key in keys])
         
+        for i in np.flatnonzero(drive_miles < straight_miles * 0.9):
+            home, station_location, _ = keys[i]
+            logging.warning(f"Drive from {home} to {station_location} is {drive_miles[i]:.1f} miles, "
+                            f"shorter than the {straight_miles[i]:.1f} mile straight line; check the address")
+
+    def group_drive_requests(self, requests: List[Tuple[str, Dict, datetime]]) -> Dict[datetime, List[Tuple[str, str]]]:
+        """Group (home, station, departure_time) requests into (home, station location) pairs per departure bucket"""
+        buckets: Dict[datetime, List[Tuple[str, str]]] = {}
+        for home, station, departure_time in requests:
+            bucket = self.departure_bucket(departure_time)
+            buckets.setdefault(bucket, []).append((home, self.station_location(station)))
+        return buckets
+
+    @staticmethod
+    def departure_bucket(departure_time: datetime) -> datetime:
+        """Round a departure time down to the start of its traffic bucket"""
+        minute = departure_time.minute - departure_time.minute % DEPARTURE_BUCKET_MINUTES
+        return departure_time.replace(minute=minute, second=0, microsecond=0)
+
+    @staticmethod
+    def station_location(station: Dict) -> str:
+        """Format a station's coordinates as a "lat,lng" string"""
+        return f"{station['geometry']['location']['lat']},{station['geometry']['location']['lng']}"
+
+    def get_transit_options(self, home_address: str, is_morning: bool, next_weekday) -> List[Tuple[Dict, Dict, datetime]]:
+        """Find stations near a home and the transit leg from each one.
+
+        Returns (station, transit_details, station_departure_datetime) tuples
+        for every station with a valid rail connection.
+        """
         # Always find stations near home address
-        logging.debug(f"\nSearching for stations near {home_address}")
+        logging.debug("Searching for stations near %s", home_address)
         stations = self.find_nearby_stations(home_address)
         if not stations:
             logging.debug("No stations found near address")
-            return None
-        
-        all_options = []
+            return []
+        stations = self.prune_stations(home_address, stations, self.destination_location())
         
+        options = []
+
         for station in stations:
-            station_location = f"{station['geometry']['location']['lat']},{station['geometry']['location']['lng']}"
-            logging.debug(f"\nAnalyzing {'morning' if is_morning else 'evening'} commute using {station['name']}")
-            
-            # For morning: home -> station -> Penn Medicine
-            # For evening: Penn Medicine -> same station -> home
-            if is_morning:
-                origin = station_location
-                destination = self.config.final_destination
-                arrival_time = self.eastern.localize(
-                    datetime.combine(next_weekday, datetime.strptime(self.config.morning_arrival, "%H:%M").time())
-                )
-                logging.debug(f"Morning route: {station['name']} -> {destination}")
-            else:
-                origin = self.config.final_destination
-                destination = station_location  # Return to same station
-                arrival_time = self.eastern.localize(
-                    datetime.combine(next_weekday, datetime.strptime(self.config.evening_arrival, "%H:%M").time())
-                )
-                logging.debug(f"Evening route: {self.config.final_destination} -> {station['name']}")
-            
-            logging.debug(f"Target arrival time: {arrival_time}")
-            
-            transit_details = self.get_transit_details(station, arrival_time, destination)  # Added destination parameter
+            arrival_time, destination = self.station_leg_request(station, is_morning, next_weekday)
+
+            transit_details = self.get_station_leg(station, arrival_time, destination, is_morning)
             if not transit_details:
-                logging.debug(f"No valid transit routes found for {station['name']}")
+                logging.debug("No valid transit routes found for %s", station['name'])
                 continue
-            
-            try:
-                departure_time_str = transit_details['departure_time'].replace('\u202f', ' ').strip()
-                station_arrival_time = datetime.strptime(departure_time_str, '%I:%M %p').time()
-                station_arrival_datetime = self.eastern.localize(
-                    datetime.combine(next_weekday, station_arrival_time)
-                )
-            except ValueError as e:
-                logging.error(f"Error parsing time '{transit_details['departure_time']}': {e}")
+
+            station_arrival_datetime = self.station_departure(transit_details, next_weekday)
+            if station_arrival_datetime is None:
                 continue
-            
-            drive_time, drive_distance = self.get_drive_time_to_station(
-                home_address, 
-                station, 
-                station_arrival_datetime
+
+            options.append((station, transit_details, station_arrival_datetime))
+
+        return options
+
+    def station_leg_request(self, station: Dict, is_morning: bool, next_weekday) -> Tuple[datetime, str]:
+        """Target arrival time and destination for a station's transit leg"""
+        logging.debug("Analyzing %s commute using %s", 'morning' if is_morning else 'evening', station['name'])
+
+        # For morning: home -> station -> Penn Medicine
+        # For evening: Penn Medicine -> same station -> home
+        if is_morning:
+            destination = self.config.final_destination
+            arrival_time = self.eastern.localize(
+                datetime.combine(next_weekday, datetime.strptime(self.config.morning_arrival, "%H:%M").time())
             )
-            
-            if drive_time is None:
+            logging.debug("Morning route: %s -> %s", station['name'], destination)
+        else:
+            destination = self.station_location(station)  # Return to same station
+            arrival_time = self.eastern.localize(
+                datetime.combine(next_weekday, datetime.strptime(self.config.evening_arrival, "%H:%M").time())
+            )
+            logging.debug("Evening route: %s -> %s", self.config.final_destination, station['name'])
+
+        logging.debug("Target arrival time: %s", arrival_time)
+        return arrival_time, destination
+
+    def station_departure(self, transit_details: Dict, next_weekday) -> Optional[datetime]:
+        """Parse when the transit leg leaves, which is when the drive has to reach the station"""
+        try:
+            departure_time_str = transit_details['departure_time'].replace('\u202f', ' ').strip()
+            station_arrival_time = datetime.strptime(departure_time_str, '%I:%M %p').time()
+            return self.eastern.localize(datetime.combine(next_weekday, station_arrival_time))
+        except ValueError as e:
+            logging.error(f"Error parsing time '{transit_details['departure_time']}': {e}")
+            return None
+
+    def build_option(self, home_address: str, station: Dict, transit_details: Dict,
+                     station_arrival_datetime: datetime, drive_time: float, drive_distance: float,
+                     is_morning: bool) -> Dict:
+        """Combine the drive and transit legs into a single commute option"""
+        total_time = drive_time + transit_details['duration_mins'] + transit_details['walk_time_mins']
+
+        # Extract destination station from last transit step
+        dest_station = None
+        dest_location = {}
+        for step in transit_details['route']['steps']:
+            if step['travel_mode'] == 'TRANSIT':
+                dest_station = step['transit_details']['arrival_stop']['name']
+                dest_location = step['transit_details']['arrival_stop'].get('location', {})
+        home_lat, home_lng = self.locations.get(home_address, (None, None))
+
+        return {
+            'home_address': home_address,
+            'station_name': station['name'],
+            'station_address': station['vicinity'],
+            'destination_station': dest_station,
+            'drive_time_mins': round(drive_time, 1),
+            'drive_distance_miles': round(drive_distance, 1),
+            'transit_time_mins': round(transit_details['duration_mins'], 1),
+            'walk_time_mins': round(transit_details['walk_time_mins'], 1),
+            'walk_distance_miles': round(transit_details['walk_distance_miles'], 2),
+            'total_time_mins': round(total_time, 1),
+            'transfers': transit_details['transfers'],
+            'arrival_time': transit_details['arrival_time'].replace('\u202f', ' ').strip(),
+            'departure_time': f"Leave home at {(station_arrival_datetime - timedelta(minutes=drive_time)).strftime('%I:%M %p')}",
+            'commute_type': 'Morning' if is_morning else 'Evening',
+            # Coordinates and route shapes let the map be drawn without API calls
+            'home_lat': home_lat,
+            'home_lng': home_lng,
+            'station_lat': station['geometry']['location']['lat'],
+            'station_lng': station['geometry']['location']['lng'],
+            'destination_lat': dest_location.get('lat'),
+            'destination_lng': dest_location.get('lng'),
+            'transit_polyline': transit_details.get('polyline'),
+            'drive_polyline': None
+        }
+
+    def analyze_commutes(self, home_addresses: List[str], is_morning: bool = True) -> Dict[str, Optional[Dict]]:
+        """Analyze commutes for many homes at once.
+
+        Transit legs are gathered for every home first so that all drive
+        times can be fetched together through the Distance Matrix API.
+        Returns the best option for each home, or None if there is none.
+        """
+        next_weekday = datetime.now(self.eastern).date() + timedelta(days=1)
+
+        transit_options = dict(zip(
+            home_addresses,
+            self.map(lambda home: self.get_transit_options(home, is_morning, next_weekday), home_addresses)
+        ))
+
+        with phase('drive routing'):
+            drive_times = self.get_drive_times([
+                (home, station, station_arrival_datetime)
+                for home, options in transit_options.items()
+                for station, _, station_arrival_datetime in options
+            ])
+
+        with phase('option selection'):
+            best = {
+                home: self.best_option(home, options, drive_times, is_morning)
+                for home, options in transit_options.items()
+            }
+        get_progress().commutes_done(is_morning, best.values())
+        with phase('drive routing'):
+            self.map(self.add_drive_polyline, [option for option in best.values() if option])
+        return best
+
+    @track_caller
+    def add_drive_polyline(self, option: Dict) -> None:
+        """Attach the driving route shape between home and the chosen station.
+
+        The Distance Matrix returns no geometry, so this is one plain
+        (not traffic-aware) directions request per winning station, which
+        the response cache keeps for a month. The shape is only cosmetic,
+        so it is skipped once most of the run's budget is spent.
+        """
+        if self.ledger.degraded:
+            return
+        try:
+            result = self.gmaps.directions(
+                option['home_address'],
+                f"{option['station_lat']},{option['station_lng']}",
+                mode="driving"
+            )
+            if result:
+                option['drive_polyline'] = result[0]['overview_polyline']['points']
+        except QuotaExhausted:
+            raise
+        except Exception as e:
+            logging.error(f"Error getting drive route to {option['station_name']}: {e}")
+
+    def best_option(self, home_address: str, options: List[Tuple[Dict, Dict, datetime]],
+                    drive_times: Dict[Tuple[str, str, datetime], Tuple[float, float]], is_morning: bool) -> Optional[Dict]:
+        """Pick the best commute for a home from its transit options and the fetched drive times"""
+        all_options = []
+        for station, transit_details, station_arrival_datetime in options:
+            drive = drive_times.get((
+                home_address,
+                self.station_location(station),
+                self.departure_bucket(station_arrival_datetime)
+            ))
+            if drive is None:
                 continue
+            all_options.append(self.build_option(
+                home_address, station, transit_details, station_arrival_datetime, *drive, is_morning
+            ))
+
+        if all_options:
+            best = min(all_options, key=lambda x: (x['transfers'], x['total_time_mins']))
+            logging.debug("Best %s commute for %s: %s, %.1f min", best['commute_type'].lower(), home_address,
+                          best['station_name'], best['total_time_mins'],
+                          extra={'address': home_address, 'station': best['station_name'], 'phase': 'select'})
+            return best
+
+        return None
+
+    def analyze_commute(self, home_address: str, is_morning: bool = True, verbose: bool = False) -> Optional[Dict]:
+        """Analyze complete commute including drive to station and transit"""
+        return self.analyze_commutes([home_address], is_morning)[home_address]
+
+    def forget_addresses(self, home_addresses: List[str]) -> None:
+        """Drop per-address state once both directions are done, keeping memory flat on long runs"""
+        for address in home_addresses:
+            if address != self.config.final_destination:
+                self.locations.pop(address, None)
+
+    def arrival_profiles(self, stations: List[Dict], arrival_times: List[str], is_morning: bool = True) -> List[Dict]:
+        """Best rail trip for every station and target arrival time, routed offline.
+
+        Morning profiles cover every station in one GTFS search per target;
+        evening profiles need one search per station, still sharing work
+        across targets. Returns one row per station and target.
+        """
+        office = self.destination_location()
+        if office is None:
+            return []
+        next_weekday = datetime.now(self.eastern).date() + timedelta(days=1)
+        targets = []
+        for arrival in arrival_times:
+            arrival = datetime.strptime(arrival, '%H:%M')
+            targets.append(arrival.hour * 3600 + arrival.minute * 60)
+        
+        points = {
+            self.station_location(station): (station['geometry']['location']['lat'], station['geometry']['location']['lng'])
+            for station in stations
+        }
+        if is_morning:
+            profiles = self.router.arrival_profile(points, office, next_weekday, targets)
+        else:
+            profiles = {
+                key: self.router.arrival_profile({key: office}, point, next_weekday, targets)[key]
+                for key, point in points.items()
+            }
+        
+        rows = []
+        for station in stations:
+            for arrival, route in zip(arrival_times, profiles[self.station_location(station)]):
+                transit_details = self.select_transit_route([route] if route else [], valid_lines=None)
+                rows.append({
+                    'station_name': station['name'],
+                    'station_address': station['vicinity'],
+                    'commute_type': 'Morning' if is_morning else 'Evening',
+                    'target_arrival': datetime.strptime(arrival, '%H:%M').strftime('%I:%M %p'),
+                    'departure_time': transit_details['departure_time'] if transit_details else None,
+                    'arrival_time': transit_details['arrival_time'] if transit_details else None,
+                    'transit_time_mins': round(transit_details['duration_mins'], 1) if transit_details else None,
+                    'walk_time_mins': round(transit_details['walk_time_mins'], 1) if transit_details else None,
+                    'transfers': transit_details['transfers'] if transit_details else None,
+                })
+        return rows
+
+    @track_caller
+    async def find_nearby_stations_async(self, address: str, client: AsyncMapsClient, radius_meters: int = 3000) -> List[Dict]:
+        """Async version of find_nearby_stations"""
+        try:
+            with phase('geocode'):
+                location = (await client.geocode(address))[0]['geometry']['location']
+            self.locations[address] = (location['lat'], location['lng'])
             
-            total_time = drive_time + transit_details['duration_mins'] + transit_details['walk_time_mins']
-            
-            # Extract destination station from last transit step
-            dest_station = None
-            for step in transit_details['route']['steps']:
-                if step['travel_mode'] == 'TRANSIT':
-                    dest_station = step['transit_details']['arrival_stop']['name']
+            with phase('station search'):
+                if self.station_index is not None:
+                    stations = self.station_index.within(location['lat'], location['lng'], radius_meters)
+                else:
+                    stations = (await client.places_nearby(
+                        location=location,
+                        radius=radius_meters,
+                        keyword='train station',
+                        type='train_station'
+                    )).get('results', [])
             
-            all_options.append({
-                'home_address': home_address,
-                'station_name': station['name'],
-                'station_address': station['vicinity'],
-                'destination_station': dest_station,
-                'drive_time_mins': round(drive_time, 1),
-                'drive_distance_miles': round(drive_distance, 1),
-                'transit_time_mins': round(transit_details['duration_mins'], 1),
-                'walk_time_mins': round(transit_details['walk_time_mins'], 1),
-                'walk_distance_miles': round(transit_details['walk_distance_miles'], 2),
-                'total_time_mins': round(total_time, 1),
-                'transfers': transit_details['transfers'],
-                'arrival_time': transit_details['arrival_time'].replace('\u202f', ' ').strip(),
-                'departure_time': f"Leave home at {(station_arrival_datetime - timedelta(minutes=drive_time)).strftime('%I:%M %p')}",
-                'commute_type': 'Morning' if is_morning else 'Evening'
-            })
+            logging.info("Found %d stations near %s:", len(stations), address,
+                         extra={'address': address, 'phase': 'stations'})
+            for station in stations:
+                logging.info("- %s (%s)", station['name'], station['vicinity'])
+                
+            return stations
+        except QuotaExhausted:
+            raise
+        except Exception as e:
+            logging.error(f"Error finding stations near {address}: {e}")
+            return []
+
+    async def get_station_leg_async(self, station: Dict, arrival_time: datetime, destination: str,
+                                    is_morning: bool, client: AsyncMapsClient) -> Optional[Dict]:
+        """Async version of get_station_leg, sharing the same station_legs table"""
+        key = self.station_leg_key(station, arrival_time, is_morning)
+        if key in self.station_legs:
+            logging.debug("Reusing transit leg for %s", station['name'])
+            return self.station_legs[key]
         
-        if all_options:
-            return min(all_options, key=lambda x: (x['transfers'], x['total_time_mins']))
+        # Concurrent addresses near the same station wait on a single request
+        if key not in self._pending_legs:
+            self._pending_legs[key] = asyncio.ensure_future(
+                self._fetch_transit_details_async(station, arrival_time, destination, client)
+            )
+        transit_details = await self._pending_legs[key]
+        self.station_legs[key] = transit_details
+        self._pending_legs.pop(key, None)
+        return transit_details
+
+    @track_caller
+    async def _fetch_transit_details_async(self, station: Dict, arrival_time: datetime, destination: str,
+                                           client: AsyncMapsClient) -> Optional[Dict]:
+        if self.router is not None:
+            with phase('transit routing'):
+                return self.get_transit_details_offline(station, arrival_time, destination)
+        try:
+            origin, dest = self.transit_endpoints(station, destination)
+            with phase('transit routing'):
+                result = await client.directions(origin, dest, arrival_time=arrival_time, **TRANSIT_PARAMS)
+                return self.select_transit_route(result)
+        except QuotaExhausted:
+            raise
+        except Exception as e:
+            logging.error(f"Error getting transit details: {e}")
+            return None
+
+    async def analyze_commute_async(self, home_address: str, client: AsyncMapsClient, is_morning: bool = True) -> Optional[Dict]:
+        """Async version of analyze_commute that queries all nearby stations at once"""
+        next_weekday = datetime.now(self.eastern).date() + timedelta(days=1)
         
-        return None
+        logging.debug("Searching for stations near %s", home_address)
+        stations = await self.find_nearby_stations_async(home_address, client)
+        if not stations:
+            logging.debug("No stations found near address")
+            return None
+        stations = self.prune_stations(home_address, stations, await self.destination_location_async(client))
+        
+        async def station_option(station):
+            arrival_time, destination = self.station_leg_request(station, is_morning, next_weekday)
+            transit_details = await self.get_station_leg_async(station, arrival_time, destination, is_morning, client)
+            if not transit_details:
+                logging.debug("No valid transit routes found for %s", station['name'])
+                return None
+            station_arrival_datetime = self.station_departure(transit_details, next_weekday)
+            if station_arrival_datetime is None:
+                return None
+            return station, transit_details, station_arrival_datetime
+        
+        options = [option for option in await asyncio.gather(*(station_option(s) for s in stations)) if option]
+        
+        drive_times = {}
+        buckets = self.group_drive_requests([(home_address, station, departure) for station, _, departure in options])
+        for bucket, pairs in buckets.items():
+            pairs = self.cached_drive_times(drive_times, bucket, pairs)
+            with calls_from('get_drive_times'), phase('drive routing'):
+                elements = await batch_distance_matrix_async(client, pairs, mode="driving", departure_time=bucket)
+            self.add_drive_times(drive_times, bucket, elements)
+            self.remember_drive_times(bucket, elements)
+        self.check_drive_times(drive_times)
+        
+        with phase('option selection'):
+            best = self.best_option(home_address, options, drive_times, is_morning)
+        if best:
+            with phase('drive routing'):
+                await self.add_drive_polyline_async(best, client)
+        return best
+
+    @track_caller
+    async def add_drive_polyline_async(self, option: Dict, client: AsyncMapsClient) -> None:
+        """Async version of add_drive_polyline"""
+        if self.ledger.degraded:
+            return
+        try:
+            result = await client.directions(
+                option['home_address'],
+                f"{option['station_lat']},{option['station_lng']}",
+                mode="driving"
+            )
+            if result:
+                option['drive_polyline'] = result[0]['overview_polyline']['points']
+        except QuotaExhausted:
+            raise
+        except Exception as e:
+            logging.error(f"Error getting drive route to {option['station_name']}: {e}")
+
+async def analyze_addresses_async(analyzer: TransitAnalyzer, addresses: List[str],
+                                  concurrency: int) -> Tuple[Dict[str, Optional[Dict]], Dict[str, Optional[Dict]]]:
+    """Analyze morning and evening commutes for addresses over one async connection pool"""
+    semaphore = asyncio.Semaphore(concurrency)
+    cache = analyzer.gmaps if isinstance(analyzer.gmaps, CachedClient) else None
+    
+    async with AsyncMapsClient(analyzer.config.google_maps_key, cache=cache) as client:
+        # Geocode the destination up front rather than once per concurrent address
+        await analyzer.destination_location_async(client)
+        
+        async def analyze(address, is_morning):
+            async with semaphore:
+                result = await analyzer.analyze_commute_async(address, client, is_morning)
+            get_progress().commutes_done(is_morning, [result])
+            return result
+        
+        morning, evening = await asyncio.gather(
+            asyncio.gather(*(analyze(address, True) for address in addresses)),
+            asyncio.gather(*(analyze(address, False) for address in addresses))
+        )
+    
+    return dict(zip(addresses, morning)), dict(zip(addresses, evening))
+
+def analyze_batch(analyzer: TransitAnalyzer, batch: List[str], workers: int,
+                  use_async: bool) -> Tuple[Dict[str, Optional[Dict]], Dict[str, Optional[Dict]]]:
+    """Morning and evening results for a batch of addresses"""
+    for address in batch:
+        print(f"\nAnalyzing commutes for: {address}")
+
+    if use_async:
+        return asyncio.run(analyze_addresses_async(analyzer, batch, workers))
+    # Morning and evening share the analyzer's worker pool
+    with ThreadPoolExecutor(max_workers=2) as directions:
+        morning = directions.submit(analyzer.analyze_commutes, batch, True)
+        evening = directions.submit(analyzer.analyze_commutes, batch, False)
+        return morning.result(), evening.result()
+
+def pending_addresses(addresses: List[str], completed) -> List[str]:
+    """Unique addresses, in input order, missing either direction from completed"""
+    return [
+        address for address in dict.fromkeys(addresses)
+        if (address, MORNING) not in completed or (address, EVENING) not in completed
+    ]
+
+def batch_results(batch: List[str], morning_details: Dict[str, Optional[Dict]],
+                  evening_details: Dict[str, Optional[Dict]]) -> List[Tuple[str, str, Optional[Dict]]]:
+    """(address, direction, result) for both directions of every address in a batch"""
+    return [
+        (address, direction, details[address])
+        for address in batch
+        for direction, details in ((MORNING, morning_details), (EVENING, evening_details))
+    ]
+
+def stream_analysis(analyzer: TransitAnalyzer, input_path: str, output_path: str, checkpoint: CheckpointStore,
+                    resume: bool, chunk_size: int, batch_size: int, workers: int, use_async: bool) -> int:
+    """Analyze an address CSV chunk by chunk, appending each batch's rows to the output.
+
+    Only one chunk of addresses and one batch of results are in memory at a
+    time; finished addresses are tracked in a temporary on-disk table. When
+    resuming, the output is appended to and addresses already in the
+    checkpoint are skipped. Rows a crashed run wrote before recording their
+    batch in the checkpoint are not written again. Returns the number of
+    rows in the output, including those from earlier runs.
+    """
+    completed = checkpoint.completed() if resume else CompletedKeys()
+    try:
+        return _stream_analysis(analyzer, input_path, output_path, checkpoint, completed, resume,
+                                chunk_size, batch_size, workers, use_async)
+    finally:
+        completed.close()
+
+def _stream_analysis(analyzer: TransitAnalyzer, input_path: str, output_path: str, checkpoint: CheckpointStore,
+                     completed: CompletedKeys, resume: bool, chunk_size: int, batch_size: int, workers: int,
+                     use_async: bool) -> int:
+    earlier_rows = 0
+    unrecorded = set()
+    if resume:
+        print(f"Resuming: {len(completed)} results already recorded in {checkpoint.path}")
+        keys = read_row_keys(output_path, ['home_address', 'commute_type'])
+        while True:
+            rows = list(islice(keys, chunk_size))
+            if not rows:
+                break
+            earlier_rows += len(rows)
+            recorded = completed.present(rows)
+            unrecorded.update(key for key in rows if key not in recorded)
+        if earlier_rows:
+            print(f"{earlier_rows} rows already in {output_path}")
+    output = CsvAppender(output_path, append=resume)
+    analyzed = 0
+
+    for chunk in read_address_chunks(input_path, chunk_size):
+        done = completed.present((address, direction) for address in chunk for direction in (MORNING, EVENING))
+        pending = pending_addresses(chunk, done)
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start:start + batch_size]
+            morning_details, evening_details = analyze_batch(analyzer, batch, workers, use_async)
+            finished = batch_results(batch, morning_details, evening_details)
+            output.write([
+                result for address, direction, result in finished
+                if result and (address, direction) not in unrecorded
+            ])
+            checkpoint.record_many(finished)
+            completed.add_many((address, direction) for address, direction, _ in finished)
+            analyzer.forget_addresses(batch)
+            get_progress().addresses_done(len(batch))
+            analyzed += len(batch)
+        print(f"\n{output.rows_written} rows written to {output_path}")
+
+    if resume and not analyzed:
+        print("Nothing left to analyze")
+    return earlier_rows + output.rows_written
+
+def parse_arrival_window(window: str) -> List[str]:
+    """Expand a "HH:MM-HH:MM/step" window into HH:MM arrival targets every step minutes"""
+    try:
+        span, step = window.split('/')
+        start, end = (datetime.strptime(t.strip(), '%H:%M') for t in span.split('-'))
+        step = int(step)
+    except ValueError:
+        raise ValueError(f"Invalid arrival window: {window}. Use HH:MM-HH:MM/minutes, e.g. 07:00-10:00/5")
+    if step <= 0 or end < start:
+        raise ValueError(f"Invalid arrival window: {window}")
+    
+    times = []
+    current = start
+    while current <= end:
+        times.append(current.strftime('%H:%M'))
+        current += timedelta(minutes=step)
+    return times
+
+def write_arrival_profiles(analyzer: TransitAnalyzer, addresses: List[str], morning_window: Optional[str],
+                           evening_window: Optional[str], output: str) -> None:
+    """Write arrival-time profiles for every station near the given addresses"""
+    stations = {}
+    for nearby in analyzer.map(analyzer.find_nearby_stations, addresses):
+        for station in nearby:
+            stations.setdefault(analyzer.station_location(station), station)
+    
+    rows = []
+    for window, is_morning in [(morning_window, True), (evening_window, False)]:
+        if not window:
+            continue
+        arrival_times = parse_arrival_window(window)
+        print(f"Profiling {len(stations)} stations at {len(arrival_times)} "
+              f"{'morning' if is_morning else 'evening'} arrival times")
+        rows.extend(analyzer.arrival_profiles(list(stations.values()), arrival_times, is_morning))
+    if not rows:
+        print("No stations found to profile.")
+        return
+    pd.DataFrame(rows).to_csv(output, index=False)
+    print(f"\nArrival profiles saved to {output}")
 
 def main():
     parser = argparse.ArgumentParser(description='Analyze transit commute options.')
@@ -368,38 +1083,112 @@ def main():
     parser.add_argument('--output', default='transit_analysis.csv', help='Output CSV file')
     parser.add_argument('--verbose', action='store_true', help='Print detailed output')
     parser.add_argument('--debug', action='store_true', help='Print debug information')
+    parser.add_argument('--batch-size', type=int, default=50, help='Addresses whose drive times are fetched together')
+    parser.add_argument('--workers', type=int, default=1, help='Number of concurrent API requests')
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help='Use the asyncio client; --workers then limits addresses analyzed at once')
+    parser.add_argument('--arrival-profile', metavar='WINDOW',
+                        help='Profile every nearby station across morning arrival times, e.g. 07:00-10:00/5 (needs GTFS_FEED_PATH)')
+    parser.add_argument('--evening-profile', metavar='WINDOW',
+                        help='Like --arrival-profile for evening arrivals at the station, e.g. 16:30-19:00/5')
+    parser.add_argument('--profile-output', default='transit_profiles.csv', help='Output CSV file for arrival profiles')
+    parser.add_argument('--checkpoint', help='JSONL file recording finished results (default: <output>.checkpoint.jsonl)')
+    parser.add_argument('--resume', action='store_true',
+                        help='Skip addresses already recorded in the checkpoint instead of starting over')
+    parser.add_argument('--chunk-size', type=int,
+                        help='Stream the input this many addresses at a time, appending results as they finish')
+    parser.add_argument('--metrics-json', help='Save per-endpoint API call metrics to this JSON file')
+    parser.add_argument('--metrics-port', type=int,
+                        help='Serve live progress and API metrics for Prometheus on this local port')
+    parser.add_argument('--max-cost', type=float,
+                        help='Stop sending API requests once their estimated cost reaches this many dollars')
+    parser.add_argument('--max-calls', type=int, help='Stop sending API requests after this many')
+    parser.add_argument('--profile', nargs='?', const='spans', choices=PROFILE_MODES,
+                        help='Time each phase and write <output>.profile.txt and a folded flamegraph file; '
+                             '"sample" adds stack sampling, "cprofile" adds cProfile')
     args = parser.parse_args()
 
-    setup_logging(args.verbose, args.debug)
+    start_profiling(args.profile)
+    log_file = setup_logging(args.verbose, args.debug)
+    get_cost_ledger().set_budget(args.max_cost, args.max_calls)
+    if args.metrics_port:
+        start_metrics_server(args.metrics_port)
 
     try:
         # Load config from environment
         config = TransitConfig.from_env()
         
-        addresses_df = pd.read_csv(args.input)
-        analyzer = TransitAnalyzer(config)
+        analyzer = TransitAnalyzer(config, workers=args.workers)
+        
+        if args.arrival_profile or args.evening_profile:
+            if analyzer.router is None:
+                parser.error('Arrival profiles need a GTFS feed; set GTFS_FEED_PATH')
+            with phase('CSV load'):
+                addresses = pd.read_csv(args.input)['address'].tolist()
+            write_arrival_profiles(analyzer, addresses, args.arrival_profile,
+                                   args.evening_profile, args.profile_output)
+            return
+        
+        # Every finished batch is recorded so a crashed run can pick up where it stopped
+        checkpoint = CheckpointStore(args.checkpoint or f"{args.output}.checkpoint.jsonl")
+        if not args.resume:
+            checkpoint.clear()
+        
+        if args.chunk_size:
+            try:
+                rows = stream_analysis(analyzer, args.input, args.output, checkpoint, args.resume,
+                                       args.chunk_size, args.batch_size, args.workers, args.use_async)
+            except QuotaExhausted as e:
+                # Rows for finished batches are already in the output
+                print(f"\nStopping early: {e}")
+            else:
+                if not rows:
+                    print("No valid transit routes found.")
+            if log_file:
+                print(f"Detailed log saved to {log_file}")
+            return
+        
+        with phase('CSV load'):
+            addresses = pd.read_csv(args.input)['address'].tolist()
         
-        all_results = []
+        if args.resume:
+            completed = checkpoint.load()
+            print(f"Resuming: {len(completed)} results already recorded in {checkpoint.path}")
+        else:
+            completed = {}
+        pending = pending_addresses(addresses, completed)
+        get_progress().set_total(len(pending))
         
-        for _, row in addresses_df.iterrows():
-            print(f"\nAnalyzing commutes for: {row['address']}")
+        for start in range(0, len(pending), args.batch_size):
+            batch = pending[start:start + args.batch_size]
+            try:
+                morning_details, evening_details = analyze_batch(analyzer, batch, args.workers, args.use_async)
+            except QuotaExhausted as e:
+                # Save the batches finished so far instead of losing them
+                print(f"\nStopping early: {e}")
+                break
             
-            morning_details = analyzer.analyze_commute(row['address'], is_morning=True, verbose=args.verbose)
-            if morning_details:
-                all_results.append(morning_details)
-                
-            evening_details = analyzer.analyze_commute(row['address'], is_morning=False, verbose=args.verbose)
-            if evening_details:
-                all_results.append(evening_details)
+            finished = batch_results(batch, morning_details, evening_details)
+            checkpoint.record_many(finished)
+            for address, direction, result in finished:
+                completed[(address, direction)] = result
+            get_progress().addresses_done(len(batch))
+
+        # Input order, Morning before Evening for each address
+        all_results = [
+            completed[(address, direction)]
+            for address in addresses
+            for direction in (MORNING, EVENING)
+            if completed.get((address, direction))
+        ]
 
         if all_results:
-            results_df = pd.DataFrame(all_results)
-            # Sort by address and commute type (Morning first, then Evening)
-            results_df = results_df.sort_values(['home_address', 'commute_type'])
-            
-            results_df.to_csv(args.output, index=False)
+            with phase('DataFrame build'):
+                results_df = pd.DataFrame(all_results)
+                results_df.to_csv(args.output, index=False)
             print(f"\nResults saved to {args.output}")
-            print(f"Detailed log saved to route_details.log")
+            if log_file:
+                print(f"Detailed log saved to {log_file}")
             
             if args.verbose or args.debug:
                 pd.set_option('display.max_columns', None)
@@ -413,6 +1202,10 @@ def main():
     except Exception as e:
         logging.error(f"Error running transit analysis: {e}")
         raise
+    finally:
+        report_metrics(args.metrics_json)
+        report_costs(get_progress().addresses_processed)
+        finish_profiling(os.path.splitext(args.output)[0])
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -1,231 +1,320 @@
 import argparse
 import folium
 from folium import plugins
+from folium.map import Layer
+import json
 import pandas as pd
 import webbrowser
 import os
 from datetime import datetime
 import pdfkit
 from jinja2 import Template
-import googlemaps
+from maps_client import create_client
+from api_metrics import report_metrics, track_caller
+from cost_ledger import get_cost_ledger, report_costs
+from profiling import PROFILE_MODES, finish_profiling, phase, start_profiling
+from rate_limiter import QuotaExhausted
+from geometry import line_weight, prepare_lines, simplify, tolerance_for_zoom
 from dotenv import load_dotenv
 import polyline  # Add this for decoding Google's polyline format
 import logging
 
 # Load environment variables and initialize Google Maps client
 load_dotenv()
-gmaps = googlemaps.Client(key=os.getenv('GOOGLE_MAPS_API_KEY'))
+gmaps = create_client(os.getenv('GOOGLE_MAPS_API_KEY'))
 
 def decode_polyline(polyline_str):
     """Decode Google's polyline format into list of coordinates"""
     return polyline.decode(polyline_str)
 
-def create_commute_map(transit_data: pd.DataFrame, output_file: str = "commute_analysis.html"):
-    """Create an interactive map with all commute routes"""
+# Columns written by transit_analyzer that let the map be drawn without API calls
+ROUTE_COLUMNS = ['home_lat', 'home_lng', 'station_lat', 'station_lng', 'transit_polyline', 'drive_polyline']
+
+def has_route_columns(row: pd.Series) -> bool:
+    """Whether a row carries its own coordinates (older analysis files do not)"""
+    return all(col in row.index for col in ROUTE_COLUMNS) and pd.notna(row['home_lat']) and pd.notna(row['station_lat'])
+
+def route_from_row(row: pd.Series) -> dict:
+    """Read a route's coordinates and shapes straight from the analysis output"""
+    return {
+        'home': (row['home_lat'], row['home_lng']),
+        'station': (row['station_lat'], row['station_lng']),
+        'drive': decode_polyline(row['drive_polyline']) if pd.notna(row['drive_polyline']) else None,
+        'transit': decode_polyline(row['transit_polyline']) if pd.notna(row['transit_polyline']) else None,
+    }
+
+def lookup_route(row: pd.Series):
+    """Geocode and route an analysis row that lacks coordinates, as older files require"""
+    # Get coordinates for home address
+    home_result = gmaps.geocode(row['home_address'])
+    if not home_result:
+        logging.warning(f"Could not geocode home address: {row['home_address']}")
+        return None
+    home = (home_result[0]['geometry']['location']['lat'], home_result[0]['geometry']['location']['lng'])
     
-    # Create a map centered on Philadelphia
-    m = folium.Map(
-        location=[39.9526, -75.1652],
-        zoom_start=11,
-        tiles="cartodbpositron"
+    # Handle station coordinates
+    if 'Amtrak' in row['station_name']:
+        # Special handling for Amtrak stations
+        station_query = f"{row['station_name']}, {row['station_address']}"
+    else:
+        station_query = f"SEPTA {row['station_name']}"
+    
+    station_result = gmaps.geocode(station_query)
+    if not station_result:
+        logging.warning(f"Could not geocode station: {station_query}")
+        return None
+    station = (station_result[0]['geometry']['location']['lat'], station_result[0]['geometry']['location']['lng'])
+    
+    driving_route = gmaps.directions(
+        row['home_address'],
+        f"{station[0]},{station[1]}",  # Use exact coordinates
+        mode="driving"
+    )
+    transit_route = gmaps.directions(
+        f"{station[0]},{station[1]}",  # Use exact coordinates
+        row['destination_station'],
+        mode="transit",
+        transit_mode=["rail"]
     )
     
-    # Add destination station marker (Penn Medicine or final destination)
+    return {
+        'home': home,
+        'station': station,
+        'drive': decode_polyline(driving_route[0]['overview_polyline']['points']) if driving_route else None,
+        'transit': decode_polyline(transit_route[0]['overview_polyline']['points']) if transit_route else None,
+    }
+
+def destination_point(transit_data: pd.DataFrame):
+    """Location of the destination station, from the data when available"""
+    if 'destination_lat' in transit_data.columns:
+        located = transit_data.dropna(subset=['destination_lat', 'destination_lng'])
+        if not located.empty:
+            return located.iloc[0]['destination_lat'], located.iloc[0]['destination_lng']
     for _, row in transit_data.iterrows():
         dest_result = gmaps.geocode(row['destination_station'])
         if dest_result:
-            dest_lat = dest_result[0]['geometry']['location']['lat']
-            dest_lng = dest_result[0]['geometry']['location']['lng']
-            folium.Marker(
-                [dest_lat, dest_lng],
-                popup=f"Destination: {row['destination_station']}",
-                icon=folium.Icon(color='red', icon='info-sign')
-            ).add_to(m)
-            break  # Only need to add destination marker once
-    
-    # Add markers and routes for each home address
+            return dest_result[0]['geometry']['location']['lat'], dest_result[0]['geometry']['location']['lng']
+    return None
+
+# Above this many routes the map switches to clustered markers and GeoJSON layers
+LARGE_MAP_ROUTES = 300
+
+# Lines are simplified so the error stays under a pixel at this zoom level
+SIMPLIFY_ZOOM = 14
+
+HOME_MARKER_CALLBACK = """
+function (row) {
+    var icon = L.AwesomeMarkers.icon({icon: 'home', markerColor: 'green', prefix: 'glyphicon'});
+    return L.marker(new L.LatLng(row[0], row[1]), {icon: icon}).bindPopup(row[2]);
+}
+"""
+
+STATION_MARKER_CALLBACK = """
+function (row) {
+    var icon = L.AwesomeMarkers.icon({icon: 'train', markerColor: 'blue', prefix: 'glyphicon'});
+    return L.marker(new L.LatLng(row[0], row[1]), {icon: icon}).bindPopup(row[2]);
+}
+"""
+
+class GeoJsonLines(Layer):
+    """A FeatureCollection of lines drawn as one Leaflet layer with a fixed style.
+
+    Features are embedded in the page, or fetched from url once the page
+    has loaded so the HTML itself stays small. Each feature's "label"
+    property becomes its tooltip, and a "weight" property overrides the
+    stroke width.
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = L.geoJSON(null, {
+                style: function (feature) {
+                    return Object.assign({}, {{ this.style|tojson }},
+                        feature.properties.weight ? {weight: feature.properties.weight} : {});
+                },
+                onEachFeature: function (feature, layer) {
+                    layer.bindTooltip(feature.properties.label);
+                }
+            });
+            {%- if this.url %}
+            fetch({{ this.url|tojson }})
+                .then(function (response) { return response.json(); })
+                .then(function (data) { {{ this.get_name() }}.addData(data); });
+            {%- else %}
+            {{ this.get_name() }}.addData({{ this.data|tojson }});
+            {%- endif %}
+        {% endmacro %}
+    """)
+
+    def __init__(self, data: dict, style: dict, name: str = None, url: str = None):
+        super().__init__(name=name, overlay=True)
+        self._name = 'GeoJsonLines'
+        self.data = data
+        self.style = style
+        self.url = url
+
+def collect_routes(transit_data: pd.DataFrame) -> list:
+    """Pair each analysis row with its coordinates and route shapes"""
+    routes = []
     for _, row in transit_data.iterrows():
         try:
-            # Get coordinates for home address
-            home_result = gmaps.geocode(row['home_address'])
-            if not home_result:
-                logging.warning(f"Could not geocode home address: {row['home_address']}")
-                continue
-                
-            home_lat = home_result[0]['geometry']['location']['lat']
-            home_lng = home_result[0]['geometry']['location']['lng']
-            
-            # Add home marker
-            folium.Marker(
-                [home_lat, home_lng],
-                popup=f"Home: {row['home_address']}<br>"
-                      f"Total time: {row['total_time_mins']} min",
-                icon=folium.Icon(color='green', icon='home')
-            ).add_to(m)
-            
-            # Handle station coordinates
-            if 'Amtrak' in row['station_name']:
-                # Special handling for Amtrak stations
-                station_query = f"{row['station_name']}, {row['station_address']}"
-            else:
-                station_query = f"SEPTA {row['station_name']}"
-            
-            station_result = gmaps.geocode(station_query)
-            if not station_result:
-                logging.warning(f"Could not geocode station: {station_query}")
-                continue
-                
-            station_lat = station_result[0]['geometry']['location']['lat']
-            station_lng = station_result[0]['geometry']['location']['lng']
-            
-            # Add station marker
-            folium.Marker(
-                [station_lat, station_lng],
-                popup=f"Station: {row['station_name']}<br>"
-                      f"Drive: {row['drive_time_mins']} min<br>"
-                      f"Transit: {row['transit_time_mins']} min",
-                icon=folium.Icon(color='blue', icon='train')
-            ).add_to(m)
-            
-            # Draw driving route
-            driving_route = gmaps.directions(
-                row['home_address'],
-                f"{station_lat},{station_lng}",  # Use exact coordinates
-                mode="driving"
-            )
-            
-            if driving_route:
-                driving_coords = decode_polyline(driving_route[0]['overview_polyline']['points'])
-                folium.PolyLine(
-                    driving_coords,
-                    weight=2,
-                    color='orange',
-                    opacity=0.8,
-                    popup=f"Drive: {row['drive_time_mins']} min"
-                ).add_to(m)
-            
-            # Draw transit route
-            transit_route = gmaps.directions(
-                f"{station_lat},{station_lng}",  # Use exact coordinates
-                row['destination_station'],
-                mode="transit",
-                transit_mode=["rail"]
-            )
-            
-            if transit_route:
-                transit_coords = decode_polyline(transit_route[0]['overview_polyline']['points'])
-                folium.PolyLine(
-                    transit_coords,
-                    weight=2,
-                    color='blue',
-                    opacity=0.8,
-                    popup=f"Transit: {row['transit_time_mins']} min"
-                ).add_to(m)
-                
+            route = route_from_row(row) if has_route_columns(row) else lookup_route(row)
+            if route is not None:
+                routes.append((row, route))
+        except QuotaExhausted as e:
+            # Keep the routes found so far rather than losing the whole map
+            logging.error(f"Stopping route visualization early: {e}")
+            break
         except Exception as e:
             logging.error(f"Error processing route visualization: {e}")
             continue
-    
-    # Save the map
-    m.save(output_file)
-    
-    # Create PDF with map and table
-    create_pdf_report(output_file, transit_data)
+    return routes
 
-def create_pdf_report(map_file: str, transit_data: pd.DataFrame):
-    """Create a PDF report with the map and commute analysis table"""
-    
-    html_template = """
-    <html>
-        <head>
-            <style>
-                body { font-family: Arial, sans-serif; margin: 20px; }
-                table { border-collapse: collapse; width: 100%; margin: 20px 0; }
-                th, td { border: 1px solid #ddd; padding: 8px; text-align: left; }
-                th { background-color: #f2f2f2; }
-                h1, h2 { color: #333; }
-                .summary { margin: 20px 0; }
-            </style>
-        </head>
-        <body>
-            <h1>Commute Analysis Report</h1>
-            <h2>Generated on {{ date }}</h2>
-            
-            <div class="summary">
-                <h3>Summary</h3>
-                <p>Number of routes analyzed: {{ num_routes }}</p>
-                <p>Average total commute time: {{ "%.1f"|format(avg_time) }} minutes</p>
-                <p>Shortest commute: {{ "%.1f"|format(min_time) }} minutes</p>
-                <p>Longest commute: {{ "%.1f"|format(max_time) }} minutes</p>
-            </div>
-            
-            <div style="height: 600px;">
-                {{ map_html }}
-            </div>
-            
-            <h2>Detailed Commute Analysis</h2>
-            {{ table_html }}
-        </body>
-    </html>
-    """
-    
-    # Read the map HTML
-    with open(map_file, 'r') as f:
-        map_html = f.read()
-    
-    # Calculate summary statistics
-    summary_stats = {
-        'num_routes': len(transit_data),
-        'avg_time': transit_data['total_time_mins'].mean(),
-        'min_time': transit_data['total_time_mins'].min(),
-        'max_time': transit_data['total_time_mins'].max()
+def line_collection(features: list) -> dict:
+    """GeoJSON FeatureCollection of (label, [(lat, lng), ...], weight) lines"""
+    return {
+        'type': 'FeatureCollection',
+        'features': [
+            {
+                'type': 'Feature',
+                'properties': {'label': label, 'weight': weight},
+                'geometry': {'type': 'LineString', 'coordinates': [[lng, lat] for lat, lng in coords]},
+            }
+            for label, coords, weight in features
+        ],
     }
-    
-    # Define desired columns in order of preference
-    desired_columns = [
-        'home_address',
-        'station_name',
-        'destination_station',
-        'drive_time_mins',
-        'drive_distance_miles',
-        'transit_time_mins',
-        'walk_time_mins',
-        'walk_distance_miles',
-        'total_time_mins',
-        'transfers'
+
+def transit_segments(routes: list, zoom: float) -> list:
+    """Rail legs merged into shared segments, as (label, coords, weight) sized by how many routes use them"""
+    segments = prepare_lines([route['transit'] for _, route in routes if route['transit']], zoom)
+    return [
+        (f"Rail segment used by {count} route{'s' if count != 1 else ''}", coords, line_weight(count))
+        for coords, count in segments
     ]
+
+def drive_lines(routes: list, zoom: float) -> list:
+    """Simplified drive legs as (row, coords) pairs"""
+    lines = [(row, route['drive']) for row, route in routes if route['drive']]
+    if not lines:
+        return []
+    tolerance = tolerance_for_zoom(zoom, lines[0][1][0][0])
+    return [(row, simplify(coords, tolerance)) for row, coords in lines]
+
+def add_route_markers(m: folium.Map, routes: list, zoom: float = SIMPLIFY_ZOOM) -> None:
+    """Draw every route with its own markers and drive polyline, and the merged rail segments"""
+    for row, route in routes:
+        # Add home marker
+        folium.Marker(
+            list(route['home']),
+            popup=f"Home: {row['home_address']}<br>"
+                  f"Total time: {row['total_time_mins']} min",
+            icon=folium.Icon(color='green', icon='home')
+        ).add_to(m)
+
+        # Add station marker
+        folium.Marker(
+            list(route['station']),
+            popup=f"Station: {row['station_name']}<br>"
+                  f"Drive: {row['drive_time_mins']} min<br>"
+                  f"Transit: {row['transit_time_mins']} min",
+            icon=folium.Icon(color='blue', icon='train')
+        ).add_to(m)
+
+    # Draw driving routes
+    for row, coords in drive_lines(routes, zoom):
+        folium.PolyLine(
+            coords,
+            weight=2,
+            color='orange',
+            opacity=0.8,
+            popup=f"Drive: {row['drive_time_mins']} min"
+        ).add_to(m)
+
+    # Draw transit routes, each shared stretch once with width showing how many routes use it
+    for label, coords, weight in transit_segments(routes, zoom):
+        folium.PolyLine(
+            coords,
+            weight=weight,
+            color='blue',
+            opacity=0.8,
+            popup=label
+        ).add_to(m)
+
+def add_clustered_layers(m: folium.Map, routes: list, layer_prefix: str = None, zoom: float = SIMPLIFY_ZOOM) -> None:
+    """Draw routes as clustered markers plus one GeoJSON layer each for drive and transit legs.
+
+    With layer_prefix, the line layers are written to <prefix>_drive.geojson
+    and <prefix>_transit.geojson and loaded by the page after it opens.
+    """
+    homes = []
+    stations = {}
+    for row, route in routes:
+        homes.append([*route['home'], f"Home: {row['home_address']}<br>Total time: {row['total_time_mins']} min"])
+        stations.setdefault(route['station'], [*route['station'], f"Station: {row['station_name']}"])
+    drives = [(f"Drive: {row['drive_time_mins']} min", coords, None) for row, coords in drive_lines(routes, zoom)]
+    transits = transit_segments(routes, zoom)
     
-    # Filter for columns that actually exist in the DataFrame
-    available_columns = [col for col in desired_columns if col in transit_data.columns]
+    plugins.FastMarkerCluster(homes, callback=HOME_MARKER_CALLBACK, name='Homes').add_to(m)
+    plugins.FastMarkerCluster(list(stations.values()), callback=STATION_MARKER_CALLBACK, name='Stations').add_to(m)
     
-    # Create display DataFrame with available columns
-    display_df = transit_data[available_columns].copy()
+    for name, features, color in [('Drive legs', drives, 'orange'), ('Transit legs', transits, 'blue')]:
+        data = line_collection(features)
+        url = None
+        if layer_prefix:
+            path = f"{layer_prefix}_{name.split()[0].lower()}.geojson"
+            with open(path, 'w') as f:
+                json.dump(data, f)
+            url = os.path.basename(path)
+            data = None
+        GeoJsonLines(data, {'color': color, 'weight': 2, 'opacity': 0.8}, name=name, url=url).add_to(m)
     
-    # Create the table HTML
-    table_html = display_df.to_html(classes='dataframe', index=False)
+    folium.LayerControl().add_to(m)
+
+@track_caller
+def create_commute_map(transit_data: pd.DataFrame, clustered: bool = None, layer_prefix: str = None,
+                       zoom: float = SIMPLIFY_ZOOM) -> folium.Map:
+    """Create an interactive map with all commute routes.
+
+    Rows written by the current analyzer carry their coordinates and
+    polylines, so the map is built without any API calls. Older files are
+    geocoded and routed as before. Large maps (or clustered=True) use
+    clustered markers and GeoJSON line layers; see add_clustered_layers.
+    Lines are simplified to within a pixel at the given zoom level.
+    """
+    routes = collect_routes(transit_data)
+    if clustered is None:
+        clustered = len(routes) > LARGE_MAP_ROUTES
     
-    # Render the template
-    template = Template(html_template)
-    html_content = template.render(
-        date=datetime.now().strftime("%Y-%m-%d %H:%M"),
-        map_html=map_html,
-        table_html=table_html,
-        **summary_stats
+    # Create a map centered on Philadelphia
+    m = folium.Map(
+        location=[39.9526, -75.1652],
+        zoom_start=11,
+        tiles="cartodbpositron",
+        prefer_canvas=clustered  # Thousands of lines draw much faster on a canvas
     )
     
-    # Save as PDF
-    pdf_file = map_file.replace('.html', '.pdf')
+    # Add destination station marker (Penn Medicine or final destination)
     try:
-        pdfkit.from_string(html_content, pdf_file)
-        print(f"PDF report saved as {pdf_file}")
-    except Exception as e:
-        print(f"Error creating PDF: {e}")
-        print("HTML report still available at", map_file)
-
-def create_html_report(map_file: str, transit_data: pd.DataFrame):
-    """Create an HTML report with map and analysis"""
+        destination = destination_point(transit_data) if not transit_data.empty else None
+    except QuotaExhausted as e:
+        logging.error(f"Could not locate destination: {e}")
+        destination = None
+    if destination:
+        folium.Marker(
+            list(destination),
+            popup=f"Destination: {transit_data.iloc[0]['destination_station']}",
+            icon=folium.Icon(color='red', icon='info-sign')
+        ).add_to(m)
+    
+    if clustered:
+        add_clustered_layers(m, routes, layer_prefix, zoom)
+    else:
+        add_route_markers(m, routes, zoom)
     
-    html_template = """
+    return m
+
+# Shared by the HTML and PDF reports; compiled once when the module loads
+REPORT_TEMPLATE = Template("""
     <html>
         <head>
             <style>
@@ -258,75 +347,130 @@ def create_html_report(map_file: str, transit_data: pd.DataFrame):
             {{ table_html }}
         </body>
     </html>
-    """
-    
-    # Read the map HTML
-    with open(map_file, 'r') as f:
-        map_html = f.read()
-    
-    # Calculate summary statistics
-    summary_stats = {
+""")
+
+# Report table columns in order of preference
+REPORT_COLUMNS = [
+    'home_address',
+    'station_name',
+    'destination_station',
+    'drive_time_mins',
+    'drive_distance_miles',
+    'transit_time_mins',
+    'walk_time_mins',
+    'walk_distance_miles',
+    'total_time_mins',
+    'transfers'
+]
+
+REPORT_FORMATS = ['html', 'pdf', 'map']
+
+def summary_stats(transit_data: pd.DataFrame) -> dict:
+    """Summary statistics shown at the top of the report"""
+    return {
         'num_routes': len(transit_data),
         'avg_time': transit_data['total_time_mins'].mean(),
         'min_time': transit_data['total_time_mins'].min(),
         'max_time': transit_data['total_time_mins'].max()
     }
-    
-    # Define desired columns in order of preference
-    desired_columns = [
-        'home_address',
-        'station_name',
-        'destination_station',
-        'drive_time_mins',
-        'drive_distance_miles',
-        'transit_time_mins',
-        'walk_time_mins',
-        'walk_distance_miles',
-        'total_time_mins',
-        'transfers'
-    ]
-    
-    # Filter for columns that actually exist in the DataFrame
-    available_columns = [col for col in desired_columns if col in transit_data.columns]
-    
-    # Create display DataFrame with available columns
-    display_df = transit_data[available_columns].copy()
-    
-    # Create the table HTML
-    table_html = display_df.to_html(classes='dataframe', index=False)
-    
-    # Render the template
-    template = Template(html_template)
-    html_content = template.render(
+
+def report_table(transit_data: pd.DataFrame) -> str:
+    """HTML table of the columns in REPORT_COLUMNS that the data actually has"""
+    available_columns = [col for col in REPORT_COLUMNS if col in transit_data.columns]
+    return transit_data[available_columns].to_html(classes='dataframe', index=False)
+
+def render_report(map_html: str, transit_data: pd.DataFrame) -> str:
+    """Render the full report page around an already rendered map"""
+    return REPORT_TEMPLATE.render(
         date=datetime.now().strftime("%Y-%m-%d %H:%M"),
         map_html=map_html,
-        table_html=table_html,
-        **summary_stats
+        table_html=report_table(transit_data),
+        **summary_stats(transit_data)
     )
+
+def create_reports(transit_data: pd.DataFrame, output_file: str = "commute_analysis.html",
+                   formats=('html', 'pdf'), open_browser: bool = True,
+                   clustered: bool = None, lazy_layers: bool = False, zoom: float = SIMPLIFY_ZOOM) -> None:
+    """Build the map and report once and write each requested format from memory.
+
+    html writes the report to output_file, pdf writes the same page next to
+    it with a .pdf extension, and map writes the bare map as *_map.html.
+    lazy_layers writes clustered maps' line layers to separate GeoJSON
+    files next to the report.
+    """
+    base, _ = os.path.splitext(output_file)
+    with phase('map render'):
+        m = create_commute_map(transit_data, clustered, layer_prefix=base if lazy_layers else None, zoom=zoom)
+        map_html = m.get_root().render()
+    with phase('report render'):
+        html_content = render_report(map_html, transit_data)
     
-    # Save as HTML
-    html_file = map_file
-    try:
-        with open(html_file, 'w') as f:
-            f.write(html_content)
-        print(f"HTML report saved as {html_file}")
-        # Open the HTML file in the default browser
-        webbrowser.open('file://' + os.path.realpath(html_file))
-    except Exception as e:
-        print(f"Error creating HTML report: {e}")
+    if 'map' in formats:
+        map_file = f"{base}_map.html"
+        with open(map_file, 'w') as f:
+            f.write(map_html)
+        print(f"Map saved as {map_file}")
+    
+    if 'pdf' in formats:
+        pdf_file = f"{base}.pdf"
+        try:
+            with phase('PDF render'):
+                pdfkit.from_string(html_content, pdf_file)
+            print(f"PDF report saved as {pdf_file}")
+        except Exception as e:
+            print(f"Error creating PDF: {e}")
+    
+    if 'html' in formats:
+        try:
+            with open(output_file, 'w') as f:
+                f.write(html_content)
+            print(f"HTML report saved as {output_file}")
+            if open_browser:
+                # Open the HTML file in the default browser
+                webbrowser.open('file://' + os.path.realpath(output_file))
+        except Exception as e:
+            print(f"Error creating HTML report: {e}")
 
 def main():
     parser = argparse.ArgumentParser(description='Visualize commute analysis')
     parser.add_argument('--input', default='transit_analysis.csv', help='Input CSV file with commute analysis')
     parser.add_argument('--output', default='commute_analysis.html', help='Output HTML file name')
+    parser.add_argument('--formats', default='html,pdf',
+                        help=f"Comma-separated outputs to write: {', '.join(REPORT_FORMATS)} (default html,pdf)")
+    parser.add_argument('--no-browser', action='store_true', help="Don't open the HTML report when done")
+    parser.add_argument('--map-mode', choices=['auto', 'detailed', 'clustered'], default='auto',
+                        help=f"clustered draws clustered markers and GeoJSON layers; auto uses it above {LARGE_MAP_ROUTES} routes")
+    parser.add_argument('--lazy-layers', action='store_true',
+                        help='Write clustered route layers to separate GeoJSON files loaded by the page (serve the output over HTTP)')
+    parser.add_argument('--simplify-zoom', type=float, default=SIMPLIFY_ZOOM,
+                        help=f"Simplify route lines to within a pixel at this zoom level (default {SIMPLIFY_ZOOM}; higher keeps more detail)")
+    parser.add_argument('--metrics-json', help='Save per-endpoint API call metrics to this JSON file')
+    parser.add_argument('--max-cost', type=float,
+                        help='Stop sending API requests once their estimated cost reaches this many dollars')
+    parser.add_argument('--max-calls', type=int, help='Stop sending API requests after this many')
+    parser.add_argument('--profile', nargs='?', const='spans', choices=PROFILE_MODES,
+                        help='Time each phase and write <output>.profile.txt and a folded flamegraph file; '
+                             '"sample" adds stack sampling, "cprofile" adds cProfile')
     args = parser.parse_args()
+    start_profiling(args.profile)
+    get_cost_ledger().set_budget(args.max_cost, args.max_calls)
+    
+    formats = [f.strip() for f in args.formats.split(',') if f.strip()]
+    unknown = set(formats) - set(REPORT_FORMATS)
+    if unknown:
+        parser.error(f"Unknown format(s): {', '.join(sorted(unknown))}")
     
     # Read the transit analysis data
-    transit_data = pd.read_csv(args.input)
+    with phase('CSV load'):
+        transit_data = pd.read_csv(args.input)
     
-    # Create the visualization and HTML report
-    create_commute_map(transit_data, args.output)
-    create_html_report(args.output, transit_data)
+    # Create the visualization and reports in one pass
+    clustered = {'auto': None, 'detailed': False, 'clustered': True}[args.map_mode]
+    create_reports(transit_data, args.output, formats, open_browser=not args.no_browser,
+                   clustered=clustered, lazy_layers=args.lazy_layers, zoom=args.simplify_zoom)
+    report_metrics(args.metrics_json)
+    report_costs(len(transit_data))
+    finish_profiling(os.path.splitext(args.output)[0])
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
@@ -0,0 +1,97 @@
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+from aiohttp import web
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from api_cache import CachedClient
+from async_maps_client import AsyncMapsClient
+from rate_limiter import QuotaExhausted, RateLimiter
+
+GEOCODE_RESULT = [{'geometry': {'location': {'lat': 39.95, 'lng': -75.19}}}]
+
+
+class FakeMapsServer:
+    """Local stand-in for the Maps web service, answering from a queue of statuses"""
+
+    def __init__(self):
+        self.statuses = []
+        self.requests = []
+        self.runner = None
+        self.base_url = None
+
+    async def geocode(self, request):
+        self.requests.append(dict(request.query))
+        status = self.statuses.pop(0) if self.statuses else 'OK'
+        if status != 'OK':
+            return web.json_response({'status': status, 'results': []})
+        return web.json_response({'status': 'OK', 'results': GEOCODE_RESULT})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/maps/api/geocode/json', self.geocode)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://127.0.0.1:{port}"
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+
+class AsyncMapsClientTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = FakeMapsServer()
+        await self.server.start()
+        self.limiter = RateLimiter(state_path=None)
+
+    async def asyncTearDown(self):
+        await self.server.stop()
+
+    def client(self, **kwargs):
+        return AsyncMapsClient('test-key', base_url=self.server.base_url, limiter=self.limiter, **kwargs)
+
+    async def test_cache_hit_skips_the_server(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = CachedClient(None, os.path.join(directory, 'cache.sqlite'))
+            async with self.client(cache=cache) as client:
+                first = await client.geocode('3400 Civic Center Blvd')
+                second = await client.geocode('3400  civic center blvd')
+            cache.flush_access_times()
+
+        self.assertEqual(first, GEOCODE_RESULT)
+        self.assertEqual(second, GEOCODE_RESULT)
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    async def test_retries_after_over_query_limit(self):
+        self.server.statuses = ['OVER_QUERY_LIMIT', 'OVER_QUERY_LIMIT']
+        with mock.patch('async_maps_client.backoff_delay', return_value=0):
+            async with self.client() as client:
+                result = await client.geocode('Philadelphia, PA')
+
+        self.assertEqual(result, GEOCODE_RESULT)
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(self.limiter.throttled_count, 2)
+        self.assertEqual(self.server.requests[0]['key'], 'test-key')
+
+    async def test_stops_when_the_daily_budget_is_used_up(self):
+        self.limiter.daily_budget = 2
+        async with self.client() as client:
+            await client.geocode('Philadelphia, PA')
+            await client.geocode('Pittsburgh, PA')
+            with self.assertRaises(QuotaExhausted):
+                await client.geocode('Harrisburg, PA')
+
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(self.limiter.in_flight, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
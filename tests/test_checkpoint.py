@@ -0,0 +1,109 @@
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import transit_analyzer
+from checkpoint import CheckpointStore
+from rate_limiter import QuotaExhausted
+
+ADDRESSES = ['1 Elm St', '2 Oak Ave', '3 Pine Rd', '1 Elm St', '4 Birch Ln', '5 Cedar Ct', '2 Oak Ave', '6 Ash Way']
+
+
+class FakeAnalyzer:
+    def forget_addresses(self, addresses):
+        pass
+
+
+class FakeBatches:
+    """Stands in for analyze_batch, optionally running out of quota after some batches"""
+
+    def __init__(self, fail_after=None):
+        self.fail_after = fail_after
+        self.batches = 0
+        self.analyzed = []
+
+    def __call__(self, analyzer, batch, workers, use_async):
+        if self.fail_after is not None and self.batches >= self.fail_after:
+            raise QuotaExhausted("Daily budget used up")
+        self.batches += 1
+        self.analyzed.extend(batch)
+
+        def results(direction):
+            return {address: {'home_address': address, 'commute_type': direction, 'total_time_mins': 30.0}
+                    for address in batch}
+        return results('Morning'), results('Evening')
+
+
+class StreamResumeTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.input = self.path('addresses.csv')
+        pd.DataFrame({'address': ADDRESSES}).to_csv(self.input, index=False)
+        self.output = self.path('results.csv')
+        self.checkpoint = CheckpointStore(self.path('results.checkpoint.jsonl'))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.directory.name, name)
+
+    def run_stream(self, batches, resume):
+        with mock.patch.object(transit_analyzer, 'analyze_batch', batches):
+            return transit_analyzer.stream_analysis(FakeAnalyzer(), self.input, self.output, self.checkpoint,
+                                                    resume, chunk_size=3, batch_size=2, workers=1, use_async=False)
+
+    def assert_complete_output(self):
+        rows = pd.read_csv(self.output)
+        keys = list(zip(rows['home_address'], rows['commute_type']))
+        expected = [(address, direction) for address in dict.fromkeys(ADDRESSES) for direction in ('Morning', 'Evening')]
+        self.assertEqual(sorted(keys), sorted(expected))
+
+    def test_resume_after_quota_stop(self):
+        with self.assertRaises(QuotaExhausted):
+            self.run_stream(FakeBatches(fail_after=2), resume=False)
+
+        batches = FakeBatches()
+        total = self.run_stream(batches, resume=True)
+
+        self.assert_complete_output()
+        self.assertEqual(total, 12)
+        self.assertEqual(batches.analyzed, ['4 Birch Ln', '5 Cedar Ct', '6 Ash Way'])
+
+    def test_resume_after_crash_before_checkpoint(self):
+        self.run_stream(FakeBatches(), resume=False)
+        # The last batch reached the output but its checkpoint write was cut short
+        with open(self.checkpoint.path) as f:
+            lines = f.readlines()
+        with open(self.checkpoint.path, 'w') as f:
+            f.writelines(lines[:-2])
+            f.write(lines[-2][:10])
+
+        batches = FakeBatches()
+        with self.assertLogs(level='WARNING'):
+            total = self.run_stream(batches, resume=True)
+
+        self.assert_complete_output()
+        self.assertEqual(total, 12)
+        self.assertEqual(batches.analyzed, ['6 Ash Way'])
+        self.assertEqual(len(self.checkpoint.load()), 12)
+
+    def test_nothing_left_to_resume(self):
+        self.run_stream(FakeBatches(), resume=False)
+
+        batches = FakeBatches()
+        total = self.run_stream(batches, resume=True)
+
+        self.assert_complete_output()
+        self.assertEqual(total, 12)
+        self.assertEqual(batches.analyzed, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
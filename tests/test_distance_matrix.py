@@ -0,0 +1,53 @@
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from distance_matrix import MAX_ELEMENTS, MAX_ORIGINS, plan_requests
+
+
+def billed_elements(blocks):
+    return sum(len(origins) * len(destinations) for origins, destinations in blocks)
+
+
+class PlanRequestsTest(unittest.TestCase):
+    def test_bills_only_needed_elements(self):
+        # 400 homes, each with three of the stations along a line of 60
+        rng = random.Random(7)
+        pairs = []
+        for home in range(400):
+            first = rng.randrange(58)
+            pairs += [(f"home {home}", f"station {first + i}") for i in range(3)]
+
+        blocks = plan_requests(pairs)
+
+        self.assertEqual(billed_elements(blocks), len(pairs))
+        self.assertLessEqual(len(blocks), 400)
+        covered = {(o, d) for origins, destinations in blocks for o in origins for d in destinations}
+        self.assertEqual(covered, set(pairs))
+
+    def test_shared_destinations_share_requests(self):
+        stations = [f"station {i}" for i in range(4)]
+        pairs = [(f"home {home}", station) for home in range(60) for station in stations]
+
+        blocks = plan_requests(pairs)
+
+        self.assertEqual(billed_elements(blocks), len(pairs))
+        self.assertEqual(len(blocks), 3)
+        for origins, destinations in blocks:
+            self.assertLessEqual(len(origins), MAX_ORIGINS)
+            self.assertLessEqual(len(origins) * len(destinations), MAX_ELEMENTS)
+
+    def test_splits_large_destination_sets(self):
+        pairs = [('home', f"station {i}") for i in range(60)]
+
+        blocks = plan_requests(pairs)
+
+        self.assertEqual([len(destinations) for _, destinations in blocks], [25, 25, 10])
+        self.assertEqual(billed_elements(blocks), 60)
+
+
+if __name__ == '__main__':
+    unittest.main()
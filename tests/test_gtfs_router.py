@@ -0,0 +1,165 @@
+import os
+import sys
+import tempfile
+import unittest
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from gtfs_router import GTFSRouter, _line_matches
+
+DAY = date(2026, 10, 19)
+
+# Line A runs S1 -> S2 -> S3 and line B runs S3 -> S4, so S1 to S4 needs one
+# transfer. The 07:40 A train has no time at S2, which is not a timepoint.
+# X and Y are just beyond walking distance of S1 and S3, and are linked to
+# them by footpaths in transfers.txt.
+FEED = {
+    'agency.txt': """agency_id,agency_name,agency_url,agency_timezone
+X,Example Rail,https://example.com,America/New_York
+""",
+    'routes.txt': """route_id,route_short_name,route_long_name,route_type
+A,A,Main Line,2
+B,B,Airport Line,2
+""",
+    'stops.txt': """stop_id,stop_name,stop_lat,stop_lon
+S1,First,40.00,-75.0
+S2,Second,40.05,-75.0
+S3,Junction,40.10,-75.0
+S4,Airport,40.15,-75.0
+X,Cross,40.00,-74.985
+Y,Yard,40.10,-74.985
+""",
+    'calendar.txt': """service_id,monday,tuesday,wednesday,thursday,friday,saturday,sunday,start_date,end_date
+WK,1,1,1,1,1,1,1,20260101,20271231
+""",
+    'trips.txt': """route_id,service_id,trip_id,trip_headsign
+A,WK,A1,Junction
+A,WK,A2,Junction
+A,WK,A3,Junction
+B,WK,B1,Airport
+B,WK,B2,Airport
+A,WK,A4,Junction
+B,WK,B3,Airport
+""",
+    'stop_times.txt': """trip_id,arrival_time,departure_time,stop_id,stop_sequence
+A1,07:10:00,07:10:00,S1,1
+A1,07:20:00,07:20:00,S2,2
+A1,07:30:00,07:30:00,S3,3
+A2,07:40:00,07:40:00,S1,1
+A2,,,S2,2
+A2,08:00:00,08:00:00,S3,3
+A3,08:10:00,08:10:00,S1,1
+A3,08:20:00,08:20:00,S2,2
+A3,08:30:00,08:30:00,S3,3
+B1,07:35:00,07:35:00,S3,1
+B1,07:50:00,07:50:00,S4,2
+B2,08:05:00,08:05:00,S3,1
+B2,08:20:00,08:20:00,S4,2
+A4,07:00:00,07:00:00,X,1
+A4,07:25:00,07:25:00,S3,2
+B3,06:00:00,06:00:00,Y,1
+B3,06:15:00,06:15:00,S4,2
+""",
+    'transfers.txt': """from_stop_id,to_stop_id,transfer_type,min_transfer_time
+X,S1,2,300
+S3,Y,2,300
+""",
+}
+
+
+def seconds(clock: str) -> int:
+    hours, minutes = map(int, clock.split(':'))
+    return hours * 3600 + minutes * 60
+
+
+def rides(journey):
+    """(departure, arrival) seconds of each train ridden"""
+    return [
+        (int(pattern.departures[row, board]), int(pattern.arrivals[row, alight]))
+        for kind, pattern, row, board, alight in (leg for leg in journey if leg[0] == 'trip')
+    ]
+
+
+class GTFSRouterTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.feed = tempfile.TemporaryDirectory()
+        for name, content in FEED.items():
+            with open(os.path.join(cls.feed.name, name), 'w') as f:
+                f.write(content)
+        cls.router = GTFSRouter(cls.feed.name)
+        cls.stops = {stop_id: i for i, stop_id in enumerate(cls.router.stop_ids)}
+        cls.points = {stop_id: tuple(cls.router.stop_coords[i]) for stop_id, i in cls.stops.items()}
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.feed.cleanup()
+
+    def at(self, *stop_ids):
+        return {self.stops[stop_id]: 0 for stop_id in stop_ids}
+
+    def test_earliest_arrival(self):
+        journey = self.router.earliest_arrival(self.at('S1'), self.at('S3'), DAY, seconds('07:00'))
+        self.assertEqual(rides(journey), [(seconds('07:10'), seconds('07:30'))])
+
+    def test_latest_departure(self):
+        journey = self.router.latest_departure(self.at('S1'), self.at('S3'), DAY, seconds('08:00'))
+        self.assertEqual(rides(journey), [(seconds('07:40'), seconds('08:00'))])
+
+    def test_one_transfer(self):
+        journey = self.router.earliest_arrival(self.at('S1'), self.at('S4'), DAY, seconds('07:00'))
+        self.assertEqual(rides(journey), [(seconds('07:10'), seconds('07:30')), (seconds('07:35'), seconds('07:50'))])
+
+        journey = self.router.latest_departure(self.at('S1'), self.at('S4'), DAY, seconds('08:20'))
+        self.assertEqual(rides(journey), [(seconds('07:40'), seconds('08:00')), (seconds('08:05'), seconds('08:20'))])
+
+    def test_blank_times_are_interpolated(self):
+        journey = self.router.earliest_arrival(self.at('S2'), self.at('S3'), DAY, seconds('07:45'))
+        self.assertEqual(rides(journey), [(seconds('07:50'), seconds('08:00'))])
+
+    def test_footpaths_at_either_end(self):
+        arrive_by = self.router.timezone.localize(datetime.combine(DAY, datetime.min.time())) + timedelta(hours=8, minutes=10)
+
+        route = self.router.route(self.points['X'], self.points['Y'], arrive_by)
+
+        leg = route['legs'][0]
+        self.assertEqual([step['travel_mode'] for step in leg['steps']], ['WALKING', 'TRANSIT', 'WALKING'])
+        self.assertEqual(leg['steps'][0]['start_location'], {'lat': 40.0, 'lng': -74.985})
+        self.assertEqual(leg['steps'][2]['end_location'], {'lat': 40.1, 'lng': -74.985})
+        self.assertEqual(leg['steps'][1]['transit_details']['trip_id'], 'A2')
+        self.assertEqual(leg['departure_time']['text'], '7:35 AM')
+        self.assertEqual(leg['arrival_time']['text'], '8:05 AM')
+
+        profiles = self.router.arrival_profile({'cross': self.points['X']}, self.points['Y'], DAY, [seconds('08:10')])
+        self.assertEqual(profiles['cross'][0], route)
+
+    def test_arrival_profile_matches_single_queries(self):
+        origins = {'first': self.points['S1'], 'second': self.points['S2']}
+        destination = self.points['S4']
+        targets = [seconds(clock) for clock in ('08:20', '07:55', '07:50', '07:00')]
+
+        profiles = self.router.arrival_profile(origins, destination, DAY, targets)
+
+        midnight = self.router.timezone.localize(datetime.combine(DAY, datetime.min.time()))
+        for key, point in origins.items():
+            for slot, target in enumerate(targets):
+                expected = self.router.route(point, destination, midnight + timedelta(seconds=target))
+                self.assertEqual(profiles[key][slot], expected, f"{key} arriving by {target}")
+        self.assertIsNone(profiles['first'][3])
+        self.assertIsNotNone(profiles['first'][0])
+
+
+class LineMatchesTest(unittest.TestCase):
+    def test_exact_names_after_normalizing(self):
+        self.assertTrue(_line_matches(['Paoli/Thorndale'], ['Paoli/Thorndale Line']))
+        self.assertTrue(_line_matches(['', 'paoli / thorndale line'], ['Paoli/Thorndale Line']))
+
+    def test_substrings_do_not_match(self):
+        self.assertFalse(_line_matches(['PAO'], ['Paoli/Thorndale Line']))
+        self.assertFalse(_line_matches(['Main'], ['Main Line Express']))
+        self.assertFalse(_line_matches(['Airport Line Shuttle'], ['Airport Line']))
+
+
+if __name__ == '__main__':
+    unittest.main()